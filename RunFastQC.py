@@ -18,25 +18,119 @@
 #   5.1 sendmail ...
 
 import argparse
+import errno
 import os
+import sys
 import subprocess
 import shutil
-import csv
+import tempfile
+import gzip
+import io
 import re
+import time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from collections import OrderedDict
 from bs4 import BeautifulSoup
 import datetime
+import hashlib
+import json
+from collections import namedtuple
+import qc_batches
+import qc_cache
+import bcl2fastq_output
+import command_runner
+import fastq_sampler
+import samplesheet
+import shard_queue
+import tex_table
+import html_report
+import qc_history
+import stage_metrics
+try:
+    import ijson
+except ImportError:
+    ijson = None
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+import run_units
+try:
+    # needs NumPy
+    import fastqc_metrics
+except ImportError:
+    fastqc_metrics = None
 
 
 BCL2FASTQ_PATH = '/usr/local/bin/bcl2fastq'
 FASTQC_PATH = '/data/runs/FastQC/FastQC/fastqc'
 WORKING_DIR = os.path.dirname(os.path.abspath(__file__))
+# NumPy implementation of the FastQC plots used by the report
+NATIVE_QC_PATH = os.path.join(WORKING_DIR, 'fastq_qc.py')
+SAMPLER_PATH = os.path.join(WORKING_DIR, 'fastq_sampler.py')
+SHARD_QUEUE_PATH = os.path.join(WORKING_DIR, 'shard_queue.py')
+# folder of the run with the work queue of a sharded conversion (--shardBy)
+SHARD_QUEUE = 'bcl2fastq_queue'
+# folder of the fastq folder with the samples of the lanes (--sampleReads)
+SAMPLE_DIR = 'sampled'
 REPORT_FILE = 'FastQC_report.tex'
 REPORTS_PATH = 'FastQC_reports'
+# comments around the part of the template repeated for each lane/read
+LANE_BEGIN = '% LANE BEGIN'
+LANE_END = '% LANE END'
+# folder and name suffix of the report with all the lanes (--singleReport)
+SINGLE_REPORT = 'all'
+# FastQC modules of all the lanes/reads as NumPy columns, in the run folder
+METRICS_FILE = 'fastqc_metrics.npz'
+# QC metrics of all the runs processed here
+HISTORY_DB = os.path.join(WORKING_DIR, 'qc_history.sqlite')
+# time, CPU and memory of the stages, in the run folder
+RUN_METRICS_FILE = 'run_metrics.json'
+# Prometheus textfiles of the runs, for the node_exporter textfile collector
+METRICS_DIR = os.path.join(WORKING_DIR, 'metrics')
+# name of the html and json reports in REPORTS_PATH
+HTML_REPORT = 'FastQC_report'
+# pdflatex formats with the preamble of the template already loaded
+FORMAT_DIR = os.path.join(WORKING_DIR, 'tex_formats')
 STATUS_FILE = 'run_report'
+# logs of the programs, a folder per execution of a run
+LOG_DIR = os.path.join(WORKING_DIR, 'logs')
+# logs of executions idle for this long are compressed, removed after LOG_KEEP_DAYS
+LOG_IDLE_DAYS = 1
+LOG_KEEP_DAYS = 90
+# FastQC results of unchanged FASTQ files are reused from here
+CACHE_DIR = os.path.join(WORKING_DIR, 'fastqc_cache')
 # informações do experimento
 SAMPLESHEET = 'SampleSheet.csv'
 BCL2FASTQ_REPORT = 'laneBarcode.html'
+BCL2FASTQ_STATS = os.path.join('Stats', 'Stats.json')
+# FastQC reserves 250 MB of Java heap for each thread (-t)
+FASTQC_THREAD_MEMORY = 250
+# memory in MB used by a fastq_qc.py job and by each of its decompression processes
+NATIVE_QC_MEMORY = 512
+NATIVE_QC_THREAD_MEMORY = 128
+# memory in MB used by a bcl2fastq converting a single lane (--pipelined)
+BCL2FASTQ_LANE_MEMORY = 4096
+# memory in MB used by a fastq_sampler.py job besides the reads it keeps
+SAMPLER_MEMORY = 64
+# seconds between two checks of the running jobs
+SCHEDULER_INTERVAL = 5
+# seconds between two lines with the progress of the running jobs
+PROGRESS_INTERVAL = 60
+# seconds a program of a stage may run before it is stopped (--timeout),
+# stages not here have no limit
+STAGE_TIMEOUTS = {'pdflatex': 900}
+# resources asked by each stage when several runs share a budget (batch_runs.py);
+# io is the share of the disk bandwidth, FastQC jobs ask for their own cores and memory
+STAGE_PROFILES = {
+    'bcl2fastq': {'cores': 8, 'memory': 16384, 'io': 1},
+    'fastqc': {'io': 0.25},
+    'pdflatex': {'cores': 1, 'memory': 256, 'io': 0},
+}
 
 
 def getDatetime():
@@ -53,14 +147,108 @@ def getDatetime():
         raise e
 
 
-def getLogfile():
+def gzip_log(path, target):
+    """Compress the log at path in target and remove it, keeping its age.
+
+    The runs of batch_runs.py rotate the logs from threads of one process,
+    so the compressed copy is written to a file of its own and a log
+    already rotated by another thread is left alone.
+    """
     try:
-        d = getDatetime()
-        logfile = os.open(os.path.join(
-            WORKING_DIR, 'logfile-%s.log' % d), os.O_WRONLY | os.O_CREAT, 0o600)
-        return logfile
-    except Exception as e:
-        raise e
+        stat = os.stat(path)
+        src = open(path, 'rb')
+    except (IOError, OSError) as e:
+        if(e.errno == errno.ENOENT):
+            return
+        raise
+
+    fd, tmp = tempfile.mkstemp(
+        prefix='.%s.' % os.path.basename(target), dir=os.path.dirname(target))
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            out = gzip.GzipFile(filename=os.path.basename(path), mode='wb', fileobj=f)
+            shutil.copyfileobj(src, out)
+            out.close()
+        finally:
+            f.close()
+        os.chmod(tmp, stat.st_mode & 0o777)
+        os.utime(tmp, (stat.st_atime, stat.st_mtime))
+        os.rename(tmp, target)
+    except BaseException:
+        if(os.path.exists(tmp)):
+            os.remove(tmp)
+        raise
+    finally:
+        src.close()
+
+    try:
+        os.remove(path)
+    except OSError as e:
+        if(e.errno != errno.ENOENT):
+            raise
+
+
+def get_log_age(path):
+    """Seconds since a log, or the newest log of a folder, was written."""
+    mtimes = []
+    if(os.path.isdir(path)):
+        mtimes = [os.path.getmtime(os.path.join(path, f)) for f in os.listdir(path)]
+    return time.time() - max(mtimes or [os.path.getmtime(path)])
+
+
+def rotate_logs():
+    """Compress the logs of the executions idle for LOG_IDLE_DAYS and remove
+    the ones older than LOG_KEEP_DAYS.
+
+    The logfile-*.log of WORKING_DIR, of the versions with a single log, are
+    moved compressed to LOG_DIR.
+    """
+    for f in os.listdir(WORKING_DIR):
+        path = os.path.join(WORKING_DIR, f)
+        if(f.startswith('logfile-') and f.endswith('.log') and
+           get_log_age(path) > LOG_IDLE_DAYS * 86400):
+            try:
+                gzip_log(path, os.path.join(LOG_DIR, f + '.gz'))
+            except (IOError, OSError) as e:
+                print('It was not possible to compress the log %s. Error: %s' % (path, e))
+
+    for name in os.listdir(LOG_DIR):
+        path = os.path.join(LOG_DIR, name)
+        try:
+            age = get_log_age(path)
+            if(age > LOG_KEEP_DAYS * 86400):
+                if(os.path.isdir(path)):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            elif(age > LOG_IDLE_DAYS * 86400 and os.path.isdir(path)):
+                for f in os.listdir(path):
+                    if(f.endswith('.log')):
+                        gzip_log(os.path.join(path, f), os.path.join(path, f + '.gz'))
+        except (IOError, OSError) as e:
+            # rotated by another execution in the meantime
+            print('It was not possible to rotate the logs %s. Error: %s' % (path, e))
+
+
+def get_log_dir(run_name):
+    """New folder of LOG_DIR for the logs of the programs run by this execution."""
+    if(not os.path.exists(LOG_DIR)):
+        os.makedirs(LOG_DIR)
+    rotate_logs()
+
+    name = '%s-%s' % (run_name, getDatetime())
+    log_dir = os.path.join(LOG_DIR, name)
+    n = 1
+    while(True):
+        try:
+            os.mkdir(log_dir)
+            return log_dir
+        except OSError:
+            if(not os.path.exists(log_dir)):
+                raise
+        n += 1
+        log_dir = os.path.join(LOG_DIR, '%s.%d' % (name, n))
 
 
 def get_status_folder(file_status):
@@ -74,29 +262,195 @@ def get_status_folder(file_status):
 
 
 def get_run_details(args):
+    """SampleSheet model of the run, None if the run has no SampleSheet."""
     try:
         if(os.path.exists(
                 os.path.join(WORKING_DIR, args.runPath, SAMPLESHEET))):
-            csv_file = open(os.path.join(WORKING_DIR, args.runPath, SAMPLESHEET), 'rb')
-            ssheet = csv.reader(csv_file, delimiter=',')
-            lines = OrderedDict([])
-            key = ''
-            not_null = [row for row in ssheet if len(row) > 0]
-            for row in not_null:
-                if(row[0].startswith('[')):
-                    key = row[0].upper()
-                    lines[key] = []
-                else:
-                    v = lines.get(key)
-                    v.append(row)
-                    lines[key] = v
-
-            return lines
+            return samplesheet.load(os.path.join(WORKING_DIR, args.runPath, SAMPLESHEET))
     except Exception as e:
         raise e
 
 
+# compact demultiplexing metrics read from Stats.json
+LaneMetrics = namedtuple('LaneMetrics', ['lane', 'clusters_raw', 'clusters_pf', 'yield_bases'])
+SampleMetrics = namedtuple('SampleMetrics', [
+    'lane', 'sample_id', 'sample_name', 'barcode', 'reads', 'perfect', 'one_mismatch',
+    'yield_bases', 'yield_q30', 'quality_sum', 'read_yields'])
+UnknownMetrics = namedtuple('UnknownMetrics', ['lane', 'barcode', 'count'])
+
+# parsed bcl2fastq reports by fastq folder: (mtime of the source, ncolums, result)
+BCL2FASTQ_REPORTS = {}
+
+
+def read_sample_metrics(lane, sample):
+    barcodes = sample.get('IndexMetrics') or []
+    barcode = '+'.join(b.get('IndexSequence', '') for b in barcodes) or 'unknown'
+    perfect = sum(int(b.get('MismatchCounts', {}).get('0', 0)) for b in barcodes)
+    one_mismatch = sum(int(b.get('MismatchCounts', {}).get('1', 0)) for b in barcodes)
+    reads = sample.get('ReadMetrics') or []
+
+    return SampleMetrics(
+        lane,
+        sample.get('SampleId', 'Undetermined'),
+        sample.get('SampleName', 'Undetermined'),
+        barcode,
+        int(sample.get('NumberReads', 0)),
+        perfect if barcodes else None,
+        one_mismatch if barcodes else None,
+        int(sample.get('Yield', 0)),
+        sum(int(r.get('YieldQ30', 0)) for r in reads),
+        sum(int(r.get('QualityScoreSum', 0)) for r in reads),
+        tuple((int(r['ReadNumber']), int(r.get('Yield', 0)), int(r.get('YieldQ30', 0)))
+              for r in reads))
+
+
+def read_bcl2fastq_stats(path):
+    """Read Stats.json in compact lane, sample and unknown barcode records.
+
+    With ijson the lanes are parsed one at a time; the standard json module
+    is used otherwise.
+    """
+    lanes = []
+    samples = []
+    unknown = []
+
+    f = open(path, 'rb')
+    try:
+        if(ijson is not None):
+            conversion = ijson.items(f, 'ConversionResults.item')
+        else:
+            stats = json.load(f)
+            conversion = stats.get('ConversionResults', [])
+
+        for result in conversion:
+            lane = int(result['LaneNumber'])
+            lanes.append(LaneMetrics(
+                lane,
+                int(result.get('TotalClustersRaw', 0)),
+                int(result.get('TotalClustersPF', 0)),
+                int(result.get('Yield', 0))))
+            for sample in result.get('DemuxResults', []):
+                samples.append(read_sample_metrics(lane, sample))
+            if(result.get('Undetermined')):
+                samples.append(read_sample_metrics(lane, result['Undetermined']))
+
+        if(ijson is not None):
+            f.seek(0)
+            unknown_barcodes = ijson.items(f, 'UnknownBarcodes.item')
+        else:
+            unknown_barcodes = stats.get('UnknownBarcodes', [])
+
+        for result in unknown_barcodes:
+            barcodes = result.get('Barcodes', {})
+            for barcode in sorted(barcodes, key=lambda b: -int(barcodes[b])):
+                unknown.append(UnknownMetrics(int(result['Lane']), barcode, int(barcodes[barcode])))
+    finally:
+        f.close()
+
+    return lanes, samples, unknown
+
+
+def get_sample_projects(args):
+    """Sample_Project of each Sample_ID of the SampleSheet."""
+    data = get_run_details(args)
+    if(not data or 'sample_project' not in data.positions):
+        return {}
+    return dict((sample_id, samples[0].project) for sample_id, samples in data.by_id.items())
+
+
+def percent(value, total):
+    if(not total or value is None):
+        return 'NaN'
+    return '%.2f' % (100.0 * value / total)
+
+
+def get_read_q30(fastq_path):
+    """% >= Q30 bases of each (lane, read) from the yields of Stats.json."""
+    stats = os.path.join(fastq_path, BCL2FASTQ_STATS)
+    if(not os.path.exists(stats)):
+        return {}
+
+    yields = {}
+    for sample in read_bcl2fastq_stats(stats)[1]:
+        for number, yield_bases, yield_q30 in sample.read_yields:
+            key = (sample.lane, 'R%d' % number)
+            total, q30 = yields.get(key, (0, 0))
+            yields[key] = (total + yield_bases, q30 + yield_q30)
+
+    return dict((key, 100.0 * q30 / total) for key, (total, q30) in yields.items() if total)
+
+
+def get_bcl2fastq_stats_report(args, fastq_path):
+    """Build from Stats.json the tables of laneBarcode.html."""
+    lanes, samples, unknown = read_bcl2fastq_stats(os.path.join(fastq_path, BCL2FASTQ_STATS))
+    projects = get_sample_projects(args)
+    lane_pf = dict((lane.lane, lane.clusters_pf) for lane in lanes)
+
+    result = OrderedDict([])
+    result['h2'] = ['Flowcell Summary', 'Lane Summary', 'Top Unknown Barcodes']
+
+    result['table-0'] = OrderedDict([])
+    result['table-0']['head'] = ['Clusters (Raw)', 'Clusters(PF)', 'Yield (MBases)']
+    result['table-0']['1-col'] = [
+        '{:,}'.format(sum(lane.clusters_raw for lane in lanes)),
+        '{:,}'.format(sum(lane.clusters_pf for lane in lanes)),
+        '{:,}'.format(sum(lane.yield_bases for lane in lanes) // 1000000)]
+
+    result['table-1'] = OrderedDict([])
+    result['table-1']['head'] = [
+        'Lane', 'Project', 'Sample', 'Barcode sequence', 'PF Clusters', '% of the lane',
+        '% Perfect barcode', '% One mismatch barcode', 'Yield (Mbases)', '% PF Clusters',
+        '% >= Q30 bases', 'Mean Quality Score']
+    for j, sample in enumerate(samples):
+        result['table-1']['%i-col' % (j + 1)] = [
+            str(sample.lane),
+            projects.get(sample.sample_id, 'default'),
+            sample.sample_name,
+            sample.barcode,
+            '{:,}'.format(sample.reads),
+            percent(sample.reads, lane_pf.get(sample.lane)),
+            percent(sample.perfect, sample.reads),
+            percent(sample.one_mismatch, sample.reads),
+            '{:,}'.format(sample.yield_bases // 1000000),
+            # only PF clusters are demultiplexed
+            '100.00' if sample.reads else 'NaN',
+            percent(sample.yield_q30, sample.yield_bases),
+            '%.2f' % (float(sample.quality_sum) / sample.yield_bases) if sample.yield_bases else 'NaN']
+
+    result['table-2'] = OrderedDict([])
+    result['table-2']['head'] = ['Lane', 'Count', 'Sequence']
+    for j, barcode in enumerate(unknown):
+        result['table-2']['%i-col' % (j + 1)] = [
+            str(barcode.lane), '{:,}'.format(barcode.count), barcode.barcode]
+
+    return 12, result
+
+
 def get_bcl2fastq_report(args, fastq_path):
+    """Tables of the bcl2fastq report, from Stats.json or else from the html.
+
+    The result is kept per fastq folder until its source changes.
+    """
+    stats = os.path.join(fastq_path, BCL2FASTQ_STATS)
+    source = stats if os.path.exists(stats) else os.path.join(fastq_path, 'Reports')
+    if(not os.path.exists(source)):
+        return None, None
+
+    mtime = os.path.getmtime(source)
+    cached = BCL2FASTQ_REPORTS.get(fastq_path)
+    if(cached and cached[0] == (source, mtime)):
+        return cached[1], cached[2]
+
+    if(source == stats):
+        ncolums, result = get_bcl2fastq_stats_report(args, fastq_path)
+    else:
+        ncolums, result = get_bcl2fastq_html_report(args, fastq_path)
+
+    BCL2FASTQ_REPORTS[fastq_path] = ((source, mtime), ncolums, result)
+    return ncolums, result
+
+
+def get_bcl2fastq_html_report(args, fastq_path):
     try:
 
         if(os.path.exists(
@@ -147,97 +501,259 @@ def get_bcl2fastq_report(args, fastq_path):
         raise e
 
 
-def rreplace(s, old, new, occurrence):
-
-    li = s.rsplit(old, occurrence)
-    return new.join(li)
-
-
 def build_run_details_tex_table(args, data):
     if(data):
-        tex_table = ''
-        ncoluns = len(data['[DATA]'][0])
-
-        # {|l|l|l|l|l|l|l|}
-        columns_table = '{'
-        for c in range(ncoluns):
-            columns_table += '|l'
-        columns_table += '|}'
+        ncoluns = len(data.columns)
+        table = tex_table.TexTableWriter(ncoluns)
 
-        for key in data.keys():
+        for key in data.sections.keys():
             # HEADER
-            values = data.get(key)
-            tex_table += "\multicolumn{%s}{|c|}{%s} \\\\ \hline\n" % (
-                ncoluns, key.replace('[', '').replace(']', ''))
+            values = data.sections.get(key)
+            table.title(key.replace('[', '').replace(']', ''))
             if(key == '[HEADER]'):
                 for value in values:
-                    tex_table += "%s & \multicolumn{%s}{l|}{%s} \\\\ \hline\n" % (
-                        value[0].replace('_', '\_'), ncoluns - 1, value[1].replace('_', '\_'))
+                    table.field(value[0], value[1] if len(value) > 1 else '')
             # READS
             elif(key == '[READS]'):
                 for value in values:
-                    tex_table += "\multicolumn{%s}{|l|}{%s} \\\\ \hline\n" % (
-                        ncoluns, value[0].replace('_', '\_'))
+                    table.line(value[0])
             # SETTINGS
             elif(key == '[SETTINGS]'):
                 for value in values:
-                    tex_table += "%s & \multicolumn{%s}{l|}{%s} \\\\ \hline\n" % (
-                        value[0].replace('_', '\_'), ncoluns - 1, value[1].replace('_', '\_'))
+                    table.field(value[0], value[1] if len(value) > 1 else '')
             # DATA
             elif(key == '[DATA]'):
-                for value in values:
-                    tex_table += ''.join('%s & ' % v.replace('\\', '_').replace(
-                        '_', '\_') for v in value)
-                    tex_table = rreplace(tex_table, '&', ' ', 1)
-                    tex_table += '\\\\ \hline\n'
+                table.row(data.columns)
+                for sample in data.rows:
+                    table.row(sample.values)
 
-        return columns_table, tex_table
+        return table.columns(), table.getvalue()
 
 
 def build_bcl2fastq_report_tex_table(args, fastq_path):
     ncoluns, data = get_bcl2fastq_report(args, fastq_path)
 
     if(data):
-        tex_table = OrderedDict([])
+        tex = OrderedDict([])
         headers = data.get('h2')
 
         for i, head in enumerate(headers):
 
             if(head == 'Top Unknown Barcodes'):
-                pass
-            else:
-                tb = data.get('table-%i' % i)
-
-                tex = ''
-
-                cols = len(tb['head'])
-
-                tex += "\multicolumn{%s}{|c|}{%s} \\\\ \hline\n" % (cols, head)
-
-                for key in tb.keys():
-                    values = tb.get(key)
-
-                    if(key == 'head'):
-                        for v in values:
-                            if(len(v.rsplit(" ", 1)) > 1):
-                                v = "%s\\\\ %s" % (
-                                    v.rsplit(" ", 1)[0], v.rsplit(" ", 1)[1])
-                                line = "\\begin{tabular}[c]{@{}l@{}}%s\\end{tabular} &" % v.replace(
-                                    '_', '\_').replace('%', '\%')
-                                tex += line
-                            else:
-                                line = "%s &" % v
-                                tex += line
-                        tex = rreplace(tex, '&', ' ', 1)
-                        tex += '\\\\ \hline\n'
-                    else:
-                        tex += ''.join('%s & ' % v.replace('_', '\_') for v in values)
-                        tex = rreplace(tex, '&', ' ', 1)
-                        tex += '\\\\ \hline\n'
+                continue
 
-            tex_table[head] = tex
+            tb = data.get('table-%i' % i)
+            table = tex_table.TexTableWriter(len(tb['head']))
+            table.title(head)
 
-        return tex_table
+            for key in tb.keys():
+                values = tb.get(key)
+
+                if(key == 'head'):
+                    table.row([tex_table.two_lines(v) for v in values], escaped=True)
+                else:
+                    table.row(values)
+
+            tex[head] = table.getvalue()
+
+        return tex
+
+
+def get_lanes(args):
+    if(args.sequencerName.upper() == 'NEXTSEQ'):
+        return 4  # NextSeq has 4 lanes
+    return 1
+
+
+def get_reads(args):
+    data = get_run_details(args)
+    if(data and data.sections.get('[READS]')):
+        return max(1, len([row for row in data.sections['[READS]'] if row[0].strip()]))
+    return 2
+
+
+class FastqIndex(object):
+    """Single scan of a bcl2fastq output folder.
+
+    The folder and its project subfolders are listed once and the FASTQ
+    files are indexed by (lane, read, sample), together with the FastQC
+    reports and the links left by rename_fastq_file.
+    """
+
+    FASTQ = re.compile('(.*?)_?(?:S\\d+_)?L00(\\d)\\_R(\\d).*\\.gz\\Z')
+    HTML = re.compile('.*\\.html\\Z')
+
+    def __init__(self, fastq_path):
+        self.path = fastq_path
+        self.fastq = OrderedDict([])
+        self.html = []
+        self.links = set()
+
+        if(not os.path.exists(fastq_path)):
+            return
+
+        for name, is_dir, is_link in self.scan(fastq_path):
+            if(is_link):
+                self.links.add(name)
+            elif(name == SAMPLE_DIR):
+                continue
+            elif(is_dir):
+                for f, f_is_dir, f_is_link in self.scan(os.path.join(fastq_path, name)):
+                    if(not f_is_dir):
+                        self.add(os.path.join(name, f), f)
+            elif(self.HTML.match(name)):
+                self.html.append(name)
+            else:
+                self.add(name, name)
+
+    @staticmethod
+    def scan(path):
+        """Yield (name, is_dir, is_link) of the entries of a folder."""
+        if(scandir is not None):
+            for entry in scandir(path):
+                yield entry.name, entry.is_dir(), entry.is_symlink()
+        else:
+            for name in os.listdir(path):
+                full = os.path.join(path, name)
+                yield name, os.path.isdir(full), os.path.islink(full)
+
+    def add(self, relative, name):
+        match = self.FASTQ.match(name)
+        if(match):
+            sample, lane, read = match.groups()
+            self.fastq.setdefault((int(lane), int(read), sample), []).append(relative)
+
+    def get_files(self, lane, read):
+        """Paths, relative to the folder, of the FASTQ files of a lane/read."""
+        return sorted(
+            f for (l, r, sample), files in self.fastq.items()
+            if l == lane and r == read for f in files)
+
+    def get_samples(self, lane, read):
+        return sorted(sample for (l, r, sample) in self.fastq.keys() if l == lane and r == read)
+
+
+FASTQ_INDEXES = {}
+
+
+def get_fastq_index(fastq_path, refresh=False):
+    """Index of a fastq folder, scanned again only when refresh is set."""
+    if(refresh or fastq_path not in FASTQ_INDEXES):
+        FASTQ_INDEXES[fastq_path] = FastqIndex(fastq_path)
+    return FASTQ_INDEXES[fastq_path]
+
+
+def get_fastq_files(fastq_path, lane, read):
+    """FASTQ files written by bcl2fastq for a lane/read, without the renamed links."""
+    index = get_fastq_index(fastq_path)
+    return [os.path.join(fastq_path, f) for f in index.get_files(lane, read)]
+
+
+def build_unit_graph(args, fastq_path):
+    run_dir = os.path.join(WORKING_DIR, args.runPath)
+    reports_path = os.path.join(run_dir, REPORTS_PATH)
+    template = os.path.join(WORKING_DIR, REPORT_FILE)
+    run_files = [os.path.join(run_dir, f) for f in ['RunInfo.xml', SAMPLESHEET, 'RTAComplete.txt']]
+
+    graph = run_units.UnitGraph(run_dir)
+    reads = range(1, get_reads(args) + 1)
+    fastqc_reports = []
+
+    for l in range(1, get_lanes(args) + 1):
+        graph.add(run_units.Unit(
+            'bcl2fastq:L00%d' % l,
+            inputs=lambda: [f for f in run_files if os.path.exists(f)],
+            outputs=lambda l=l: [f for r in reads for f in get_fastq_files(fastq_path, l, r)]))
+
+    for l in range(1, get_lanes(args) + 1):
+        for r in reads:
+            name = 'L00%d-R%d' % (l, r)
+            report = 'L%d_L00%d_R%d_fastqc' % (l, l, r)
+            report_dir = os.path.join(reports_path, report)
+            pdf = '{0}-L00{1}-R{2}.pdf'.format(REPORT_FILE.rsplit('.', 1)[0], l, r)
+
+            graph.add(run_units.Unit(
+                'fastqc:%s' % name,
+                deps=['bcl2fastq:L00%d' % l],
+                inputs=lambda l=l, r=r: get_fastq_files(fastq_path, l, r),
+                outputs=lambda report=report: [
+                    os.path.join(fastq_path, '%s.html' % report),
+                    os.path.join(fastq_path, report)]))
+            fastqc_reports.append(report)
+            if(not args.sampleReads and os.path.exists(
+                    os.path.join(fastq_path, report, fastq_sampler.SAMPLE_INFO))):
+                # a quick-look report, every read is analysed now
+                graph.invalidate('fastqc:%s' % name, 'sampled')
+            if(args.singleReport or args.reportFormat == 'html'):
+                continue
+            graph.add(run_units.Unit(
+                'tex:%s' % name,
+                deps=['fastqc:%s' % name],
+                inputs=lambda report=report: [
+                    f for f in [template, os.path.join(run_dir, SAMPLESHEET),
+                                os.path.join(fastq_path, 'Reports'),
+                                os.path.join(fastq_path, report, 'Images')]
+                    if os.path.exists(f)],
+                outputs=lambda report_dir=report_dir: [os.path.join(report_dir, REPORT_FILE)]))
+            graph.add(run_units.Unit(
+                'pdf:%s' % name,
+                deps=['tex:%s' % name],
+                inputs=lambda report_dir=report_dir: [os.path.join(report_dir, REPORT_FILE)],
+                outputs=lambda report_dir=report_dir, pdf=pdf: [os.path.join(report_dir, pdf)]))
+
+    if(fastqc_metrics):
+        graph.add(run_units.Unit(
+            'metrics:run',
+            deps=[name for name in graph.units.keys() if name.startswith('fastqc:')],
+            inputs=lambda: [
+                f for f in [os.path.join(fastq_path, report, 'fastqc_data.txt')
+                            for report in fastqc_reports]
+                if os.path.exists(f)],
+            outputs=lambda: [os.path.join(run_dir, METRICS_FILE)]))
+
+    if(args.historyDb):
+        graph.add(run_units.Unit(
+            'history:run',
+            deps=[name for name in graph.units.keys()
+                  if name.startswith('fastqc:') or name == 'metrics:run'],
+            inputs=lambda: [
+                f for f in [os.path.join(run_dir, METRICS_FILE),
+                            os.path.join(fastq_path, BCL2FASTQ_STATS),
+                            os.path.join(fastq_path, 'Reports')]
+                if os.path.exists(f)]))
+
+    if(args.reportFormat != 'pdf'):
+        graph.add(run_units.Unit(
+            'html:run',
+            deps=[name for name in graph.units.keys() if name.startswith('fastqc:')],
+            inputs=lambda: [
+                f for f in [os.path.join(run_dir, SAMPLESHEET),
+                            os.path.join(fastq_path, 'Reports')] + [
+                    os.path.join(fastq_path, report) for report in fastqc_reports]
+                if os.path.exists(f)],
+            outputs=lambda: [os.path.join(reports_path, '%s.%s' % (HTML_REPORT, ext))
+                             for ext in ['html', 'json']]))
+
+    if(args.singleReport and args.reportFormat != 'html'):
+        report_dir = os.path.join(reports_path, SINGLE_REPORT)
+        pdf = '{0}-{1}.pdf'.format(REPORT_FILE.rsplit('.', 1)[0], SINGLE_REPORT)
+        fastqc = [name for name in graph.units.keys() if name.startswith('fastqc:')]
+        graph.add(run_units.Unit(
+            'tex:%s' % SINGLE_REPORT,
+            deps=fastqc,
+            inputs=lambda: [
+                f for f in [template, os.path.join(run_dir, SAMPLESHEET),
+                            os.path.join(fastq_path, 'Reports')] + [
+                    os.path.join(fastq_path, report, 'Images') for report in fastqc_reports]
+                if os.path.exists(f)],
+            outputs=lambda: [os.path.join(report_dir, REPORT_FILE)]))
+        graph.add(run_units.Unit(
+            'pdf:%s' % SINGLE_REPORT,
+            deps=['tex:%s' % SINGLE_REPORT],
+            inputs=lambda: [os.path.join(report_dir, REPORT_FILE)],
+            outputs=lambda: [os.path.join(report_dir, pdf)]))
+
+    return graph
 
 
 def check_analysed_folder(args, file_status):
@@ -252,81 +768,259 @@ def check_analysed_folder(args, file_status):
     return True
 
 
-def run_blc2fastq(args, file_status, fastq_path, logfile):
+def run_blc2fastq(args, file_status, fastq_path, log_dir, graph=None):
 
-    status = get_status_folder(file_status)
+    if(graph is None):
+        status = get_status_folder(file_status)
 
-    if(status and status in ['converted']):
-        return True
+        if(status and status in ['converted']):
+            return True
 
-    if(os.path.exists(fastq_path)):
-        return True
+        if(os.path.exists(fastq_path)):
+            return True
+    else:
+        # bcl2fastq converts every lane of the run at once
+        units = [name for name in graph.units.keys() if name.startswith('bcl2fastq:')]
+        if(not any(graph.is_dirty(name) for name in units)):
+            return True
 
     cl = [
-        '/usr/local/bin/bcl2fastq',
+        BCL2FASTQ_PATH,
         '--runfolder-dir',
         args.runPath,
         '--output-dir',
         fastq_path]
 
+    request = None
+    if(args.resources):
+        request = args.resources.acquire(args.runName, STAGE_PROFILES['bcl2fastq'])
+        # keep the processing threads in the granted cores
+        cl += ['-p', str(max(1, request.need['cores']))]
+
     print('running blc2fastq')
 
     fs = open(file_status, 'w+')
     fs.write('running\n')
     fs.close()
 
-    retProcess = subprocess.Popen(
-        cl, 0, stdout=logfile, stderr=logfile, shell=False)
-    retCode = retProcess.wait()
+    try:
+        group = command_runner.CommandGroup(log_dir, metrics=args.metrics, timeouts=args.timeouts)
+        retCode = group.run(
+            cl, 'bcl2fastq', 'bcl2fastq',
+            inputs=[os.path.join(WORKING_DIR, args.runPath, 'Data', 'Intensities', 'BaseCalls')])
+    finally:
+        if(request):
+            args.resources.release(request)
     if(retCode != 0):
         fs = open(file_status, 'w+')
         fs.write('error\n')
         fs.close()
-        print(os.system('tail %s' % logfile))
+        if(graph is not None):
+            for name in units:
+                graph.mark(name, False)
+        return False
+
+    fs = open(file_status, 'w+')
+    fs.write('converted\n')
+    fs.close()
+
+    get_fastq_index(fastq_path, refresh=True)
+
+    if(graph is not None):
+        for name in units:
+            graph.mark(name, True)
+
+    print('finished')
+
+    return True
+
+
+def get_flowcell_layout(args):
+    """(surfaces, swaths) of the flowcell in RunInfo.xml, (0, 0) if it is not there."""
+    try:
+        with open(os.path.join(WORKING_DIR, args.runPath, 'RunInfo.xml'), 'r') as f:
+            layout = re.search('<FlowcellLayout[^>]*>', f.read())
+    except (IOError, OSError):
+        return 0, 0
+    if(not layout):
+        return 0, 0
+    surfaces = re.search('SurfaceCount="(\\d+)"', layout.group(0))
+    swaths = re.search('SwathCount="(\\d+)"', layout.group(0))
+    return (int(surfaces.group(1)) if surfaces else 0,
+            int(swaths.group(1)) if swaths else 1)
+
+
+def get_shards(args, lanes):
+    """(name, lane, tiles) of the shards of the lanes, tiles as bcl2fastq --tiles.
+
+    The tiles are named s_<lane>_<surface><swath><tile>, a surface or a swath
+    of a lane is a prefix of its tiles. Lanes are not split when RunInfo.xml
+    has no FlowcellLayout.
+    """
+    surfaces, swaths = get_flowcell_layout(args)
+    if(args.shardBy != 'swath'):
+        swaths = 0
+    shards = []
+    for lane in lanes:
+        if(args.shardBy == 'lane' or not surfaces):
+            shards.append(('L00%d' % lane, lane, 's_%d' % lane))
+            continue
+        for surface in range(1, surfaces + 1):
+            if(not swaths):
+                shards.append(('L00%d-%d' % (lane, surface), lane, 's_%d_%d' % (lane, surface)))
+                continue
+            for swath in range(1, swaths + 1):
+                shards.append(('L00%d-%d%d' % (lane, surface, swath), lane,
+                               's_%d_%d%d' % (lane, surface, swath)))
+    return shards
+
+
+def get_shard_job(args, fastq_path, name, tiles, threads):
+    """Job of the work queue converting the tiles in a folder of their own.
+
+    The paths are absolute, the workers of other hosts run it as it is.
+    """
+    part = '%s.%s' % (fastq_path.rstrip('/'), name)
+    return {
+        'name': name,
+        'part': part,
+        'cwd': WORKING_DIR,
+        'cl': [
+            BCL2FASTQ_PATH,
+            '--runfolder-dir', os.path.join(WORKING_DIR, args.runPath),
+            '--output-dir', part,
+            '--interop-dir', os.path.join(part, 'InterOp'),
+            '--tiles', tiles,
+            '-p', str(threads)]}
+
+
+def run_sharded_blc2fastq(args, file_status, fastq_path, log_dir, graph):
+    """Convert the run in shards of lanes or tiles claimed by workers from a queue.
+
+    The shards are written as jobs in the SHARD_QUEUE folder of the run
+    (shard_queue.py) and args.shardWorkers local workers are started to run
+    them; workers of other hosts that see the run folder at the same path
+    can join with python shard_queue.py work RUN/bcl2fastq_queue. When every
+    shard is done they are merged in the fastq folder, lane by lane in the
+    order of their tiles.
+    """
+    lanes = range(1, get_lanes(args) + 1)
+    convert = [l for l in lanes if graph.is_dirty('bcl2fastq:L00%d' % l)]
+    if(not convert):
+        return True
+
+    shards = get_shards(args, convert)
+    workers = max(0, min(args.shardWorkers, len(shards)))
+
+    request = None
+    cores = args.cores
+    if(args.resources):
+        request = args.resources.acquire(args.runName, STAGE_PROFILES['bcl2fastq'])
+        cores = request.need['cores']
+    threads = max(1, cores // max(1, workers))
+
+    queue = shard_queue.WorkQueue(os.path.join(WORKING_DIR, args.runPath, SHARD_QUEUE))
+    queue.clear()
+    parts = {}
+    for name, lane, tiles in shards:
+        job = get_shard_job(args, fastq_path, name, tiles, threads)
+        # left by an interrupted execution
+        if(os.path.exists(job['part'])):
+            shutil.rmtree(job['part'])
+        queue.put(name, job)
+        parts[name] = job['part']
+
+    print('running blc2fastq in %d shards' % len(shards))
+
+    fs = open(file_status, 'w+')
+    fs.write('running\n')
+    fs.close()
+
+    group = command_runner.CommandGroup(log_dir, metrics=args.metrics, timeouts=args.timeouts)
+    running = []
+    started = 0
+    try:
+        while(not queue.finished()):
+            requeued = queue.requeue_stale()
+            if(requeued):
+                print('%s put back in the queue, its worker stopped' % ', '.join(requeued))
+            for worker in list(running):
+                if(group.poll(worker) is None):
+                    continue
+                running.remove(worker)
+                if(worker.reason):
+                    # timed out, its shard fails instead of going back to the queue
+                    queue.abandon(shard_queue.get_worker(worker.process.pid), worker.reason)
+            # a worker runs a single shard, so the bcl2fastq timeout is the one of a shard
+            if(queue.names(shard_queue.PENDING)):
+                for _ in range(workers - len(running)):
+                    started += 1
+                    running.append(group.start(
+                        [sys.executable, SHARD_QUEUE_PATH, 'work', queue.path, '--once'],
+                        'shard worker %d' % started, 'bcl2fastq'))
+            group.wait_any(SCHEDULER_INTERVAL)
+        for worker in running:
+            group.done(worker, worker.wait())
+    except BaseException:
+        group.cancel('stopped')
+        raise
+    finally:
+        if(request):
+            args.resources.release(request)
+
+    failed = queue.names(shard_queue.FAILED)
+    if(failed):
+        fs = open(file_status, 'w+')
+        fs.write('error\n')
+        fs.close()
+        print('bcl2fastq failed on %s, see %s' % (
+            ', '.join(failed), os.path.join(queue.path, shard_queue.LOGS)))
+        for lane in convert:
+            graph.mark('bcl2fastq:L00%d' % lane, False)
         return False
 
+    if(len(convert) == len(lanes)):
+        # a new conversion, the reports of an old one are not merged with it
+        bcl2fastq_output.clear_reports(fastq_path)
+    for lane in convert:
+        names = [name for name, l, tiles in shards if l == lane]
+        for i, name in enumerate(names):
+            if(len(names) == 1):
+                bcl2fastq_output.merge_part(parts[name], fastq_path)
+            else:
+                bcl2fastq_output.merge_shard(parts[name], fastq_path, name, i == 0)
+        graph.mark('bcl2fastq:L00%d' % lane, True)
+
     fs = open(file_status, 'w+')
     fs.write('converted\n')
     fs.close()
 
+    get_fastq_index(fastq_path, refresh=True)
+
     print('finished')
 
     return True
 
 
-def rename_fastq_file(args, fastq_path):
+def rename_fastq_file(args, fastq_path, lanes=None):
     try:
         fastq_files = {}
 
+        index = get_fastq_index(fastq_path)
+
         for read in range(1, 3):
             npattern = 'L{0}_L00{0}_R{1}_{2}.'
 
-            regex = '.*L00%d\\_R%d.*\\.gz\\Z(?ms)'
             lane = 'L00%d'
-            if(args.sequencerName.upper() == 'NEXTSEQ'):
-                lanes = 4
-            else:
-                lanes = 1
-            for l in range(1, lanes + 1):  # NextSeq has 4 lanes
+            for l in (lanes or range(1, get_lanes(args) + 1)):
                 clane = lane % l
 
-                reobj = re.compile(regex % (l, read))
-
-                files = [f for f in os.listdir(fastq_path) if reobj.match(f)]
-
-                filedirs = [f for f in os.listdir(fastq_path) if os.path.isdir(
-                    os.path.join(fastq_path, f))]
-
-                for d in filedirs:
-                    filelist = [f for f in os.listdir(
-                        os.path.join(fastq_path, d)) if reobj.match(f)]
-                    for f in filelist:
-                        files.append(os.path.join(d, f))
+                files = index.get_files(l, read)
 
                 nfiles = []
 
                 for i, f in enumerate(files):
-                    name, ext = f.split('.', 1)
+                    name, ext = os.path.basename(f).split('.', 1)
 
                     digits = len(str(i + 1))
                     if(digits == 1):
@@ -339,13 +1033,14 @@ def rename_fastq_file(args, fastq_path):
                     f_npattern = npattern.format(l, read, group)
                     nname = f_npattern + ext
 
-                    if(not os.path.islink(
-                        os.path.join(
-                            fastq_path, nname))):
-                        os.symlink(
-                            os.path.join(fastq_path, f),
-                            os.path.join(fastq_path, nname))
-                        nfiles.append(nname)
+                    # link left by an interrupted execution
+                    if(nname in index.links):
+                        os.unlink(os.path.join(fastq_path, nname))
+                    os.symlink(
+                        os.path.join(fastq_path, f),
+                        os.path.join(fastq_path, nname))
+                    index.links.add(nname)
+                    nfiles.append(nname)
 
                 if(nfiles):
                     if(clane in fastq_files):
@@ -362,10 +1057,413 @@ def rename_fastq_file(args, fastq_path):
         raise e
 
 
-def run_fastqc(args, file_status, fastq_path, logfile):
-    status = get_status_folder(file_status)
-    if(status and status in ['reported']):
-        return True
+def get_total_memory():
+    try:
+        with open('/proc/meminfo', 'r') as meminfo:
+            for line in meminfo:
+                if(line.startswith('MemTotal:')):
+                    return int(line.split()[1]) // 1024
+    except (IOError, OSError, ValueError):
+        pass
+
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return FASTQC_THREAD_MEMORY * multiprocessing.cpu_count()
+
+
+def get_sample_job(args, fastq_path, name, report, files):
+    """Job writing a sample of args.sampleReads reads of the files of a lane/read."""
+    sample_dir = os.path.join(fastq_path, SAMPLE_DIR)
+    output = os.path.join(sample_dir, '%s_001.fastq.gz' % report)
+    info = os.path.join(sample_dir, '%s.json' % report)
+    inputs = [os.path.join(fastq_path, f) for f in files]
+
+    return {
+        'name': 'sample %s' % name,
+        'cl': [sys.executable, SAMPLER_PATH, '--reads', str(args.sampleReads),
+               '--output', output, '--info', info] + inputs,
+        'shell': False,
+        'cores': 1,
+        'memory': SAMPLER_MEMORY + args.sampleReads * fastq_sampler.READ_MEMORY // (1024 * 1024),
+        'output': output,
+        'info': info,
+        'inputs': inputs}
+
+
+def get_fastqc_cl(threads, files):
+    return [FASTQC_PATH, '--extract', '--casava', '-t', str(threads)] + files
+
+
+def get_fastqc_jobs(args, fastq_path, fasta_files):
+    """Split the renamed FASTQ files in one FastQC job per lane/read.
+
+    With --casava FastQC merges every file of a lane/read in a single group
+    and analyses each group in one thread, so a job gets a single thread;
+    get_qc_jobs packs the jobs left to run in batches sharing the cores.
+    The FASTQ files are named relative to the fastq folder, where FastQC
+    runs, so the arguments stay short. The native engine splits the
+    decompression of a group, so its jobs share the cores.
+    With --sampleReads a job analyses the sample written by its 'sample'
+    job in SAMPLE_DIR, and writes its report in the fastq folder.
+    """
+    reobj = re.compile('L\\d+_(L00\\d)_(R\\d)_\\d+\\.')
+
+    groups = OrderedDict([])
+    for lane in sorted(fasta_files.keys()):
+        for f in fasta_files[lane]:
+            match = reobj.match(f)
+            if(match):
+                groups.setdefault('%s-%s' % match.groups(), []).append(f)
+
+    jobs = []
+    for name, files in groups.items():
+        threads = 1
+        report = re.sub('_\\d+\\..*$', '', files[0])
+        inputs = [os.path.join(fastq_path, f) for f in files]
+        outdir = []
+        sample = None
+
+        if(args.sampleReads):
+            sample = get_sample_job(args, fastq_path, name, report, files)
+            inputs = [sample['output']]
+            outdir = ['-o', fastq_path]
+
+        if(args.qcEngine == 'native'):
+            # fastq_qc.py decompresses a group with several processes
+            threads = max(1, args.cores // len(groups))
+
+            cl = [sys.executable, NATIVE_QC_PATH, '--casava', '-t', str(threads)] + (
+                outdir + inputs)
+
+            jobs.append({
+                'name': name,
+                'report': report,
+                'cl': cl,
+                'shell': False,
+                'cores': threads,
+                'memory': NATIVE_QC_MEMORY + NATIVE_QC_THREAD_MEMORY * threads,
+                'files': files,
+                'sample': sample,
+                'inputs': inputs})
+            continue
+
+        jobs.append({
+            'name': name,
+            'report': report,
+            'cl': get_fastqc_cl(threads, outdir + (inputs if sample else files)),
+            'cwd': fastq_path,
+            'shell': False,
+            'cores': threads,
+            'memory': FASTQC_THREAD_MEMORY * threads,
+            'files': files,
+            'sample': sample,
+            'inputs': inputs})
+
+    return jobs
+
+
+def run_jobs(jobs, cores, memory, log_dir, resources=None, run=None, metrics=None,
+             timeouts=None):
+    """Run the jobs at the same time while they fit in the cores and memory budget.
+
+    Jobs start in the given order. A job bigger than the whole budget is only
+    started when nothing else is running. With resources (a ResourcePool of
+    batch_runs.py) the budget is the one shared by all the runs instead.
+    With metrics (a stage_metrics.RunMetrics) every job is measured under its
+    stage (fastqc by default). A job running longer than the timeout of its
+    stage in timeouts is stopped, and so are the running jobs when the
+    scheduler is interrupted. A job with an error is not started and fails.
+    The on_finish callback of a job can return more jobs, which are run
+    after the pending ones.
+    Returns the names of the jobs that failed.
+    """
+    pending = list(jobs)
+    running = []
+    failed = []
+
+    free_cores = cores
+    free_memory = memory
+    group = command_runner.CommandGroup(log_dir, metrics=metrics, timeouts=timeouts)
+
+    try:
+        while(pending or running):
+            for job in list(pending):
+                if(job.get('error')):
+                    print('%s can not run, %s' % (job['name'], job['error']))
+                    pending.remove(job)
+                    failed.append(job['name'])
+                    if(job.get('on_finish')):
+                        pending.extend(job['on_finish'](job, 1) or [])
+                    continue
+
+                if(resources):
+                    if('request' not in job):
+                        job['request'] = resources.request(run, dict(
+                            STAGE_PROFILES[job.get('stage', 'fastqc')],
+                            cores=job['cores'], memory=job['memory']))
+                    if(not resources.try_grant(job['request'])):
+                        continue
+                    need_cores = need_memory = 0
+                else:
+                    need_cores = min(job['cores'], cores)
+                    need_memory = min(job['memory'], memory)
+                    if(need_cores > free_cores or need_memory > free_memory):
+                        continue
+
+                print('starting %s' % job['name'])
+
+                try:
+                    command = group.start(
+                        job['cl'], job['name'], job.get('stage', 'fastqc'),
+                        shell=job.get('shell', False), cwd=job.get('cwd'),
+                        inputs=job.get('inputs'))
+                except BaseException:
+                    if(resources):
+                        resources.release(job.pop('request'))
+                    raise
+
+                free_cores -= need_cores
+                free_memory -= need_memory
+                pending.remove(job)
+                running.append((job, command, need_cores, need_memory))
+
+            for item in list(running):
+                job, command, need_cores, need_memory = item
+                retCode = group.poll(command)
+                if(retCode is None):
+                    continue
+
+                running.remove(item)
+                free_cores += need_cores
+                free_memory += need_memory
+                if(resources):
+                    resources.release(job['request'])
+
+                if(retCode != 0):
+                    print('%s failed with exit code %s' % (job['name'], retCode))
+                    failed.append(job['name'])
+                else:
+                    print('%s finished' % job['name'])
+
+                if(job.get('on_finish')):
+                    pending.extend(job['on_finish'](job, retCode) or [])
+
+            if(running or pending):
+                group.print_progress(PROGRESS_INTERVAL)
+                # woken up as soon as a job ends
+                group.wait_any(SCHEDULER_INTERVAL)
+    except BaseException:
+        group.cancel('stopped')
+        for job, command, need_cores, need_memory in running:
+            command.wait()
+            if(resources):
+                resources.release(job['request'])
+        # the requests of the jobs not started would block the other runs
+        for job in pending:
+            if(resources and 'request' in job):
+                resources.cancel(job['request'])
+        raise
+
+    return failed
+
+
+def unlink_fastq_files(fastq_path, files):
+    index = get_fastq_index(fastq_path)
+    for f in files:
+        index.links.discard(f)
+        if(os.path.islink(os.path.join(fastq_path, f))):
+            try:
+                os.unlink(os.path.join(fastq_path, f))
+            except OSError as e:
+                'It was not possible to unlink the file \n%s. Error: %s' % (
+                    os.path.join(fastq_path, f), e)
+
+
+def get_qc_version(args):
+    """Version of the QC program, used to key the result cache."""
+    if(args.qcEngine == 'native'):
+        cl = [sys.executable, NATIVE_QC_PATH, '--version']
+    else:
+        cl = [FASTQC_PATH, '--version']
+
+    try:
+        retProcess = subprocess.Popen(
+            cl, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=False)
+        out = retProcess.communicate()[0]
+    except OSError:
+        return None
+    if(retProcess.returncode != 0):
+        return None
+
+    return '%s %s' % (args.qcEngine, out.decode('utf-8', 'replace').strip())
+
+
+def finish_fastqc_job(args, fastq_path, job, retCode, graph=None):
+    sample = job.get('sample')
+    if(sample):
+        if(retCode == 0 and os.path.exists(sample['info'])):
+            # the report tells it was made on a sample, also when it comes from the cache
+            shutil.move(sample['info'], os.path.join(
+                fastq_path, '%s_fastqc' % job['report'], fastq_sampler.SAMPLE_INFO))
+        for f in [sample['output'], sample['info']]:
+            if(os.path.exists(f)):
+                os.remove(f)
+
+    if(retCode == 0 and job.get('key')):
+        try:
+            qc_cache.store(
+                args.cacheDir, job['key'], job['report'], fastq_path,
+                args.cacheSize * 1024 * 1024)
+        except (IOError, OSError) as e:
+            print('It was not possible to cache %s. Error: %s' % (job['name'], e))
+
+    unlink_fastq_files(fastq_path, job['files'])
+
+    unit = 'fastqc:%s' % job['name']
+    if(graph is not None and unit in graph.units):
+        graph.mark(unit, retCode == 0)
+
+
+def get_cache_version(args):
+    """Version the QC results are cached under, None when they are not cached."""
+    if(args.noCache):
+        return None
+    version = get_qc_version(args)
+    if(version and args.sampleReads):
+        # the same sample is drawn every time, but it is not the whole lane
+        version = '%s sampled %d' % (version, args.sampleReads)
+    return version
+
+
+def finish_sample_job(args, fastq_path, job, retCode, graph=None):
+    """Start the QC job of a sample once it is written."""
+    if(retCode != 0):
+        finish_fastqc_job(args, fastq_path, job, retCode, graph)
+        return []
+    return [job]
+
+
+def finish_batch_job(job, retCode):
+    for member in job['members']:
+        member['on_finish'](member, retCode)
+    return []
+
+
+def plan_qc_batches(args, fastq_path, jobs):
+    """Share the cores among the QC jobs of the lanes/reads by the bytes they read.
+
+    A native job gets a number of processes in proportion to its bytes. The
+    FastQC jobs, a single thread each, are packed in batches of qc_batches,
+    one FastQC each with as many threads as its share of the cores and its
+    arguments within ARG_MAX. A job whose files alone do not fit fails with
+    its error. The biggest batches are returned first.
+    """
+    if(not jobs):
+        return []
+    sizes = [stage_metrics.get_input_bytes(job['inputs']) for job in jobs]
+
+    if(args.qcEngine == 'native'):
+        for job, threads in zip(jobs, qc_batches.split_cores(sizes, args.cores)):
+            job['cl'][job['cl'].index('-t') + 1] = str(threads)
+            job['cores'] = threads
+            job['memory'] = NATIVE_QC_MEMORY + NATIVE_QC_THREAD_MEMORY * threads
+        return [job for _, job in sorted(zip(sizes, jobs), key=lambda item: -item[0])]
+
+    batches = []
+    while(True):
+        try:
+            plan = qc_batches.plan_batches(
+                sizes, [qc_batches.get_arg_size(job['files']) for job in jobs], args.cores,
+                qc_batches.get_arg_size(get_fastqc_cl(args.cores, [])))
+            break
+        except qc_batches.ArgumentsTooLong as e:
+            # a --casava group can not be split across FastQC invocations
+            job = jobs.pop(e.index)
+            job['error'] = 'FastQC can not be given its %d files (%s...), %s' % (
+                len(job['files']), job['files'][0], e)
+            batches.append((sizes.pop(e.index), job))
+
+    for indexes, threads in plan:
+        members = [jobs[i] for i in indexes]
+        if(len(members) == 1):
+            batches.append((sizes[indexes[0]], members[0]))
+            continue
+        files = [f for member in members for f in member['files']]
+        batches.append((sum(sizes[i] for i in indexes), {
+            'name': '+'.join(member['name'] for member in members),
+            'cl': get_fastqc_cl(threads, files),
+            'cwd': fastq_path,
+            'shell': False,
+            'cores': threads,
+            'memory': FASTQC_THREAD_MEMORY * threads,
+            'files': files,
+            'inputs': [f for member in members for f in member['inputs']],
+            'members': members,
+            'on_finish': finish_batch_job}))
+
+    return [job for _, job in sorted(batches, key=lambda item: -item[0])]
+
+
+def get_qc_jobs(args, fastq_path, fasta_files, version, graph=None):
+    """Jobs of the lanes/reads of fasta_files whose report has to be made.
+
+    The QC job of a sample is started by the job writing the sample, which
+    is returned in its place. The other ones are packed in batches by
+    plan_qc_batches.
+    """
+    jobs = []
+    direct = []
+    for job in get_fastqc_jobs(args, fastq_path, fasta_files):
+        unit = 'fastqc:%s' % job['name']
+        if(graph is not None and unit in graph.units):
+            if(not graph.is_dirty(unit)):
+                print('%s up to date' % job['name'])
+                unlink_fastq_files(fastq_path, job['files'])
+                continue
+            # the old report is out of date
+            for f in qc_cache.get_outputs(fastq_path, job['report']):
+                if(os.path.isdir(os.path.join(fastq_path, f))):
+                    shutil.rmtree(os.path.join(fastq_path, f))
+                else:
+                    os.remove(os.path.join(fastq_path, f))
+
+        # Check if there already is a fastqc report for the lane/read
+        if(os.path.exists(os.path.join(fastq_path, '%s_fastqc.html' % job['report']))):
+            print('%s already analysed' % job['name'])
+            unlink_fastq_files(fastq_path, job['files'])
+            continue
+
+        if(version):
+            job['key'] = qc_cache.get_key(
+                job['report'], [os.path.join(fastq_path, f) for f in job['files']], version)
+            if(qc_cache.lookup(args.cacheDir, job['key'], fastq_path)):
+                print('%s found in the cache' % job['name'])
+                unlink_fastq_files(fastq_path, job['files'])
+                if(graph is not None and unit in graph.units):
+                    graph.mark(unit, True)
+                continue
+
+        job['on_finish'] = lambda job, retCode: finish_fastqc_job(
+            args, fastq_path, job, retCode, graph)
+
+        if(job.get('sample')):
+            if(not os.path.exists(os.path.join(fastq_path, SAMPLE_DIR))):
+                os.mkdir(os.path.join(fastq_path, SAMPLE_DIR))
+            job['sample']['on_finish'] = lambda sample, retCode, job=job: finish_sample_job(
+                args, fastq_path, job, retCode, graph)
+            jobs.append(job['sample'])
+        else:
+            direct.append(job)
+
+    return jobs + plan_qc_batches(args, fastq_path, direct)
+
+
+def run_fastqc(args, file_status, fastq_path, log_dir, graph=None):
+    if(graph is None):
+        status = get_status_folder(file_status)
+        if(status and status in ['reported']):
+            return True
 
     if(not os.path.exists(fastq_path)):
         return False
@@ -375,51 +1473,125 @@ def run_fastqc(args, file_status, fastq_path, logfile):
     if(not fasta_files):
         return False
 
-    # Check if there already is a fastq folder
-    regex = '.*\\.html\\Z(?ms)'
-    reobj = re.compile(regex)
+    jobs = get_qc_jobs(args, fastq_path, fasta_files, get_cache_version(args), graph)
 
-    paths = [f for f in os.listdir(fastq_path) if reobj.match(f)]
-    if(paths):
-        return True
+    print('running fastqc')
 
-    if(args.sequencerName.upper() == 'NEXTSEQ'):
-        lanes = 4
-    else:
-        lanes = 1
+    fs = open(file_status, 'w+')
+    fs.write('running\n')
+    fs.close()
 
-    for l in range(1, lanes + 1):
-        lane = 'L00%d' % l
-        files = fasta_files[lane]
+    failed = run_jobs(
+        jobs, args.cores, args.memory, log_dir, args.resources, args.runName, args.metrics,
+        args.timeouts)
+    shutil.rmtree(os.path.join(fastq_path, SAMPLE_DIR), ignore_errors=True)
+    if(failed):
+        fs = open(file_status, 'w+')
+        fs.write('error\n')
+        fs.close()
+        return False
 
-        fileList = [' '.join(
-            os.path.join(fastq_path, f) for f in files)]
+    fs = open(file_status, 'w+')
+    fs.write('reported\n')
+    fs.close()
 
-        cl = ['/data/runs/FastQC/FastQC/fastqc --extract --casava -t 8 ' + fileList[0]]
+    print('finished')
 
-        print('running fastqc')
+    return True
 
-        fs = open(file_status, 'w+')
-        fs.write('running\n')
-        fs.close()
 
-        retProcess = subprocess.Popen(
-            cl, 0, stdout=logfile, stderr=logfile, shell=True)
-        retCode = retProcess.wait()
-        if(retCode != 0):
-            fs = open(file_status, 'w+')
-            fs.write('error\n')
-            fs.close()
-            return False
+def get_lane_job(args, fastq_path, lane, version, graph):
+    """bcl2fastq job converting a lane of the run in a folder of its own."""
+    lanes = get_lanes(args)
+    threads = max(1, args.cores // lanes)
+    part = '%s.L00%d' % (fastq_path.rstrip('/'), lane)
+    base_calls = os.path.join(WORKING_DIR, args.runPath, 'Data', 'Intensities', 'BaseCalls')
+    if(os.path.exists(os.path.join(base_calls, 'L00%d' % lane))):
+        base_calls = os.path.join(base_calls, 'L00%d' % lane)
+
+    return {
+        'name': 'bcl2fastq L00%d' % lane,
+        'stage': 'bcl2fastq',
+        'lane': lane,
+        'part': part,
+        'cl': [
+            BCL2FASTQ_PATH,
+            '--runfolder-dir', args.runPath,
+            '--output-dir', part,
+            # the InterOp of the run is not written by every lane at once
+            '--interop-dir', os.path.join(part, 'InterOp'),
+            '--tiles', 's_%d' % lane,
+            '-p', str(threads)],
+        'shell': False,
+        'cores': threads,
+        'memory': BCL2FASTQ_LANE_MEMORY,
+        'inputs': [base_calls],
+        'on_finish': lambda job, retCode: finish_lane_job(
+            args, fastq_path, job, retCode, version, graph)}
+
+
+def finish_lane_job(args, fastq_path, job, retCode, version, graph):
+    """Merge a converted lane in the fastq folder and return its QC jobs."""
+    unit = 'bcl2fastq:L00%d' % job['lane']
+    if(retCode != 0):
+        graph.mark(unit, False)
+        return []
 
-        files = fasta_files[lane]
-        for f in files:
-            if(os.path.islink(os.path.join(fastq_path, f))):
-                try:
-                    os.unlink(os.path.join(fastq_path, f))
-                except OSError as e:
-                    'It was not possible to unlink the file \n%s. Error: %s' % (
-                        os.path.join(fastq_path, f), e)
+    bcl2fastq_output.merge_part(job['part'], fastq_path)
+    get_fastq_index(fastq_path, refresh=True)
+    graph.mark(unit, True)
+
+    return get_qc_jobs(
+        args, fastq_path, rename_fastq_file(args, fastq_path, [job['lane']]), version, graph)
+
+
+def run_pipelined(args, file_status, fastq_path, log_dir, graph):
+    """Convert every lane with its own bcl2fastq and run its QC as soon as it ends.
+
+    The lanes are converted side by side (bcl2fastq --tiles s_<lane>), each
+    in a folder next to the fastq folder, and merged in the fastq folder
+    when they end (bcl2fastq_output.merge_part). The QC jobs of a lane are
+    added to the jobs of run_jobs at that moment, so the QC of the first
+    lanes runs while the last ones are converted.
+    """
+    lanes = range(1, get_lanes(args) + 1)
+    convert = [l for l in lanes if graph.is_dirty('bcl2fastq:L00%d' % l)]
+    version = get_cache_version(args)
+
+    print('running blc2fastq and fastqc')
+
+    fs = open(file_status, 'w+')
+    fs.write('running\n')
+    fs.close()
+
+    if(not os.path.exists(fastq_path)):
+        os.makedirs(fastq_path)
+    if(len(convert) == len(lanes)):
+        # a new conversion, the reports of an old one are not merged with it
+        bcl2fastq_output.clear_reports(fastq_path)
+
+    jobs = []
+    for lane in convert:
+        job = get_lane_job(args, fastq_path, lane, version, graph)
+        # left by an interrupted execution
+        if(os.path.exists(job['part'])):
+            shutil.rmtree(job['part'])
+        jobs.append(job)
+
+    converted = [l for l in lanes if l not in convert]
+    if(converted):
+        jobs += get_qc_jobs(
+            args, fastq_path, rename_fastq_file(args, fastq_path, converted), version, graph)
+
+    failed = run_jobs(
+        jobs, args.cores, args.memory, log_dir, args.resources, args.runName, args.metrics,
+        args.timeouts)
+    shutil.rmtree(os.path.join(fastq_path, SAMPLE_DIR), ignore_errors=True)
+    if(failed):
+        fs = open(file_status, 'w+')
+        fs.write('error\n')
+        fs.close()
+        return False
 
     fs = open(file_status, 'w+')
     fs.write('reported\n')
@@ -430,18 +1602,147 @@ def run_fastqc(args, file_status, fastq_path, logfile):
     return True
 
 
-def compile_tex(args, file_status, fastq_path, logfile):
-    status = get_status_folder(file_status)
-    if(status and status in ['compiled']):
-        return True
+def get_sample_note(report_dir):
+    """Note of the section of a lane/read analysed on a sample of its reads."""
+    info = fastq_sampler.load_info(report_dir)
+    if(not info):
+        return ''
+    return ('\\textbf{Relatório por amostragem:} as figuras desta seção foram geradas '
+            'com %d reads de um total %sde %d reads da lane.\n' % (
+                info['sampled_reads'], 'estimado ' if info['estimated'] else '',
+                info['total_reads']))
+
+
+def to_text(value):
+    """Text of a value put in the report template, byte strings are utf-8."""
+    if(isinstance(value, bytes)):
+        return value.decode('utf-8')
+    return value
+
+
+def split_report_template(rel):
+    """Split the template in the text before, in and after the lane section."""
+    begin = rel.index(LANE_BEGIN)
+    end = rel.index(LANE_END, begin)
+    return rel[:begin], rel[begin:end], rel[end:]
+
+
+# pdflatex --version of this machine
+TEX_VERSIONS = {}
+
+
+def get_tex_version():
+    """First line of pdflatex --version, None if pdflatex can not run."""
+    if('pdflatex' not in TEX_VERSIONS):
+        try:
+            out = subprocess.Popen(
+                ['pdflatex', '--version'],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0]
+            TEX_VERSIONS['pdflatex'] = out.decode('utf-8', 'replace').split('\n')[0] or None
+        except OSError:
+            TEX_VERSIONS['pdflatex'] = None
+    return TEX_VERSIONS['pdflatex']
+
+
+def get_report_format(rel, group):
+    """Name of the format with the preamble of rel loaded, built when missing.
+
+    The format is dumped by mylatexformat from the text before
+    \\begin{document} and named after the hash of that text and of the
+    TeX version, so a new template or TeX installation builds a new one.
+    pdflatex is run by group, a command_runner.CommandGroup.
+    Returns None when the format can not be built.
+    """
+    version = get_tex_version()
+    if(not version or '\\begin{document}' not in rel):
+        return None
+    preamble = rel[:rel.index('\\begin{document}')]
+
+    sha = hashlib.sha1()
+    sha.update(version.encode('utf-8'))
+    sha.update(preamble.encode('utf-8'))
+    name = '%s-%s' % (REPORT_FILE.rsplit('.', 1)[0], sha.hexdigest()[:12])
+    if(os.path.exists(os.path.join(FORMAT_DIR, name + '.fmt'))):
+        return name
+
+    if(not os.path.exists(FORMAT_DIR)):
+        try:
+            os.makedirs(FORMAT_DIR)
+        except OSError:
+            if(not os.path.isdir(FORMAT_DIR)):
+                raise
+
+    # built apart and renamed, runs of a batch may build the same format
+    tmp_dir = tempfile.mkdtemp(prefix=name + '.', dir=FORMAT_DIR)
+    try:
+        tex = io.open(os.path.join(tmp_dir, name + '.tex'), 'w', encoding='utf-8')
+        tex.write(preamble)
+        tex.write(u'\\begin{document}\n\\end{document}\n')
+        tex.close()
+
+        cl = [
+            'pdflatex',
+            '-ini',
+            '-interaction=nonstopmode',
+            '-jobname=%s' % name,
+            '&pdflatex',
+            'mylatexformat.ltx',
+            name + '.tex'
+        ]
+
+        retCode = group.run(cl, name, 'pdflatex', STAGE_PROFILES['pdflatex'], cwd=tmp_dir)
+
+        fmt = os.path.join(tmp_dir, name + '.fmt')
+        if(retCode != 0 or not os.path.exists(fmt)):
+            print('could not build the tex format, compiling without it')
+            return None
+        os.rename(fmt, os.path.join(FORMAT_DIR, name + '.fmt'))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return name
+
+
+def compile_report(filename, report_dir, group, fmt=None):
+    cl = [
+        'pdflatex',
+        '-interaction=nonstopmode',
+        '-output-directory',
+        report_dir,
+        '--jobname=%s' % filename,
+        os.path.join(report_dir, REPORT_FILE)
+    ]
+
+    env = None
+    if(fmt):
+        # the preamble of the report is skipped, it is in the format
+        cl.insert(1, '-fmt=%s' % fmt)
+        env = dict(os.environ)
+        env['TEXFORMATS'] = FORMAT_DIR + os.pathsep
+
+    retCode, reason = group.run_command(
+        cl, filename, 'pdflatex', STAGE_PROFILES['pdflatex'],
+        inputs=[os.path.join(report_dir, REPORT_FILE)], env=env)
+
+    if(retCode != 0 and fmt and not reason):
+        # a broken format must not cost the report, a timeout is not the format
+        print('%s failed with the tex format, compiling without it' % filename)
+        return compile_report(filename, report_dir, group)
+
+    return filename, retCode
+
+
+def compile_tex(args, file_status, fastq_path, log_dir, graph=None):
+    if(graph is None):
+        status = get_status_folder(file_status)
+        if(status and status in ['compiled']):
+            return True
 
     images_dir = []
     reports_dir = []
 
-    regex = '.*\\.html\\Z(?ms)'
-    reobj = re.compile(regex)
-
-    paths = [f for f in os.listdir(fastq_path) if reobj.match(f)]
+    # FastQC wrote its reports since the last scan
+    paths = get_fastq_index(fastq_path, refresh=True).html
 
     for path in paths:
         path_fastqc = path.split('.', 1)[0]
@@ -456,66 +1757,120 @@ def compile_tex(args, file_status, fastq_path, logfile):
         images_dir.append(s_image)
         reports_dir.append(report_dir)
 
-    tex = open(os.path.join(WORKING_DIR, REPORT_FILE), 'r')
+    # text on Python 2 and 3, the values put in it are decoded by to_text
+    tex = io.open(os.path.join(WORKING_DIR, REPORT_FILE), 'r', encoding='utf-8')
     rel = tex.read()
     tex.close()
 
-    if(os.path.exists(os.path.join(WORKING_DIR, args.runPath, REPORTS_PATH))):
-        shutil.rmtree(os.path.join(WORKING_DIR, args.runPath, REPORTS_PATH))
+    if(graph is None):
+        if(os.path.exists(os.path.join(WORKING_DIR, args.runPath, REPORTS_PATH))):
+            shutil.rmtree(os.path.join(WORKING_DIR, args.runPath, REPORTS_PATH))
 
-    os.mkdir(os.path.join(WORKING_DIR, args.runPath, REPORTS_PATH))
+    if(not os.path.exists(os.path.join(WORKING_DIR, args.runPath, REPORTS_PATH))):
+        os.mkdir(os.path.join(WORKING_DIR, args.runPath, REPORTS_PATH))
 
     data = get_run_details(args)
     tex_columns_table, tex_table_run_details = build_run_details_tex_table(args, data)
 
     tex_table_bcl2fastq_report = build_bcl2fastq_report_tex_table(args, fastq_path)
 
+    # the sections shared by all the lanes are rendered once
+    rel = rel.replace("$EQUIPAMENTO$", to_text(args.sequencerName))
+    rel = rel.replace("$TABLECOLUMNS$", to_text(tex_columns_table))
+    rel = rel.replace("$TABLECONTENTS$", to_text(tex_table_run_details))
+    for i, key in enumerate(tex_table_bcl2fastq_report.keys()):
+        char = chr(i + ord('A'))
+        tex = tex_table_bcl2fastq_report.get(key)
+        rel = rel.replace("$TABLE%sHEADER$" % char, to_text(key))
+        rel = rel.replace("$TABLE%sCONTENTS$" % char, to_text(tex))
+    head, section, tail = split_report_template(rel)
+
+    lanes = []
     for image_dir, report_dir in zip(images_dir, reports_dir):
-        new_rel = rel.replace("$PATH$", image_dir)
-        new_rel = new_rel.replace("$EQUIPAMENTO$", args.sequencerName)
-        new_rel = new_rel.replace("$TABLECOLUMNS$", tex_columns_table)
-        new_rel = new_rel.replace("$TABLECONTENTS$", tex_table_run_details)
         lane = report_dir.rsplit('_', 3)[1][-1]
-        new_rel = new_rel.replace("$LANE$", lane)
         read = report_dir.rsplit('_', 2)[1]  # R1 or R2
-        new_rel = new_rel.replace("$READ$", read)
-
-        for i, key in enumerate(tex_table_bcl2fastq_report.keys()):
-            char = chr(i + ord('A'))
-            tex = tex_table_bcl2fastq_report.get(key)
-            new_rel = new_rel.replace("$TABLE%sHEADER$" % char, key.encode('utf-8'))
-            new_rel = new_rel.replace("$TABLE%sCONTENTS$" % char, tex.encode('utf-8'))
-
-        os.mkdir(os.path.join(WORKING_DIR, args.runPath, REPORTS_PATH, report_dir))
-        tex = open(
-            os.path.join(WORKING_DIR, args.runPath, REPORTS_PATH, report_dir, REPORT_FILE), 'w+')
-        tex.write(new_rel)
+        new_section = section.replace("$PATH$", to_text(image_dir))
+        new_section = new_section.replace("$LANE$", to_text(lane))
+        new_section = new_section.replace("$READ$", to_text(read))
+        new_section = new_section.replace(
+            "$SAMPLED$", to_text(get_sample_note(os.path.dirname(image_dir))))
+        lanes.append(('L00%s-%s' % (lane, read), report_dir, new_section))
+    lanes.sort(key=lambda lane: lane[0])
+
+    if(args.singleReport):
+        # one document with a section per lane/read, compiled once
+        report_dir = os.path.join(WORKING_DIR, args.runPath, REPORTS_PATH, SINGLE_REPORT)
+        documents = [(SINGLE_REPORT, report_dir,
+                      u'\n\\pagebreak\n\n'.join(lane[2] for lane in lanes))]
+    else:
+        documents = lanes
+
+    reports = []
+
+    for unit, report_dir, sections in documents:
+        filename = '{0}-{1}'.format(REPORT_FILE.rsplit('.', 1)[0], unit)
+
+        if(graph is not None and 'tex:%s' % unit in graph.units):
+            if(graph.is_dirty('pdf:%s' % unit)):
+                reports.append((filename, report_dir, unit))
+            if(not graph.is_dirty('tex:%s' % unit)):
+                continue
+            if(os.path.exists(report_dir)):
+                shutil.rmtree(report_dir)
+
+        os.mkdir(report_dir)
+        tex = io.open(os.path.join(report_dir, REPORT_FILE), 'w', encoding='utf-8')
+        tex.write(head)
+        tex.write(sections)
+        tex.write(tail)
         tex.close()
 
-        filename = '{0}-L00{1}-{2}'.format(REPORT_FILE.rsplit('.', 1)[0], lane, read)
+        if(graph is not None and 'tex:%s' % unit in graph.units):
+            graph.mark('tex:%s' % unit, True)
+        else:
+            reports.append((filename, report_dir, unit))
 
-        cl = [
-            'pdflatex',
-            '-output-directory',
-            os.path.join(WORKING_DIR, args.runPath, REPORTS_PATH, report_dir),
-            '--jobname=%s' % filename,
-            os.path.join(WORKING_DIR, args.runPath, REPORTS_PATH, report_dir, REPORT_FILE)
-        ]
+    print('compiling tex')
+
+    fs = open(file_status, 'w+')
+    fs.write('running\n')
+    fs.close()
 
-        print('compiling tex')
+    # at most texWorkers pdflatex at the same time
+    group = command_runner.CommandGroup(
+        log_dir, args.texWorkers, args.metrics, args.timeouts, args.resources, args.runName)
 
+    pool = ThreadPool(max(1, len(reports)))
+    try:
+        fmt = None
+        if(reports):
+            fmt = get_report_format(head, group)
+        results = list(pool.imap(
+            lambda report: compile_report(report[0], report[1], group, fmt), reports))
+    except BaseException:
+        group.cancel('stopped')
+        raise
+    finally:
+        pool.close()
+        pool.join()
+
+    if(graph is not None):
+        for (filename, report_dir, unit), (_, retCode) in zip(reports, results):
+            if('pdf:%s' % unit in graph.units):
+                graph.mark('pdf:%s' % unit, retCode == 0)
+
+    failed = [filename for filename, retCode in results if retCode != 0]
+    if(failed):
+        for filename, retCode in results:
+            if(retCode != 0):
+                print('%s failed with exit code %s' % (filename, retCode))
+        # the first line keeps the status, the next ones name the failed reports
         fs = open(file_status, 'w+')
-        fs.write('running\n')
+        fs.write('error\n')
+        for filename in failed:
+            fs.write('%s\n' % filename)
         fs.close()
-
-        retProcess = subprocess.Popen(
-            cl, 0, stdout=logfile, stderr=logfile, shell=False)
-        retCode = retProcess.wait()
-        if(retCode != 0):
-            fs = open(file_status, 'w+')
-            fs.write('error\n')
-            fs.close()
-            return False
+        return False
 
     fs = open(file_status, 'w+')
     fs.write('compiled\n')
@@ -526,11 +1881,120 @@ def compile_tex(args, file_status, fastq_path, logfile):
     return True
 
 
+def write_metrics_store(args, fastq_path, graph=None):
+    """Save the modules of every fastqc_data.txt of the run in METRICS_FILE."""
+    if(not fastqc_metrics):
+        print('NumPy is not installed, FastQC metrics not saved')
+        return True
+    if(graph is not None and 'metrics:run' in graph.units and not graph.is_dirty('metrics:run')):
+        return True
+
+    units = OrderedDict([])
+    for unit, lane, read, folder in html_report.get_lanes(
+            fastq_path, get_fastq_index(fastq_path, refresh=True).html):
+        data = os.path.join(folder, 'fastqc_data.txt')
+        if(os.path.exists(data)):
+            units[unit] = fastqc_metrics.parse_fastqc_data(data)
+
+    fastqc_metrics.write_store(os.path.join(WORKING_DIR, args.runPath, METRICS_FILE), units)
+
+    if(graph is not None and 'metrics:run' in graph.units):
+        graph.mark('metrics:run', True)
+
+    return True
+
+
+def record_history(args, fastq_path, graph=None):
+    """Add the FastQC and demultiplexing metrics of the run to the history."""
+    if(graph is not None and 'history:run' in graph.units and not graph.is_dirty('history:run')):
+        return True
+
+    lanes = {}
+    q30 = get_read_q30(fastq_path)
+    metrics = os.path.join(WORKING_DIR, args.runPath, METRICS_FILE)
+    if(fastqc_metrics and os.path.exists(metrics)):
+        for unit, tables in fastqc_metrics.load_store(metrics).items():
+            lane, read = unit.split('-')
+            key = (int(lane[1:]), read)
+            lanes[key] = qc_history.get_lane_metrics(tables, q30.get(key))
+
+    ncolums, bcl2fastq = get_bcl2fastq_report(args, fastq_path)
+
+    qc_history.record_run(
+        args.historyDb, args.runName, args.sequencerName, lanes,
+        qc_history.get_sample_rows(bcl2fastq))
+
+    if(graph is not None and 'history:run' in graph.units):
+        graph.mark('history:run', True)
+
+    return True
+
+
+def write_html_report(args, fastq_path, graph=None):
+    """Write the report as a self-contained html page and a json document."""
+    if(graph is not None and 'html:run' in graph.units and not graph.is_dirty('html:run')):
+        return True
+
+    start = time.time()
+
+    # FastQC wrote its reports since the last scan
+    lanes = html_report.get_lanes(fastq_path, get_fastq_index(fastq_path, refresh=True).html)
+    ncolums, bcl2fastq = get_bcl2fastq_report(args, fastq_path)
+    metrics = html_report.build_metrics(
+        args.runName, args.sequencerName, get_run_details(args), bcl2fastq, lanes)
+    page = html_report.render_html(metrics, lanes, os.path.join(WORKING_DIR, html_report.LOGO))
+    paths = html_report.write_report(
+        os.path.join(WORKING_DIR, args.runPath, REPORTS_PATH), HTML_REPORT, metrics, page)
+
+    if(graph is not None and 'html:run' in graph.units):
+        graph.mark('html:run', True)
+
+    print('%s written in %.0f ms' % (', '.join(os.path.basename(p) for p in paths),
+                                    (time.time() - start) * 1000))
+    return True
+
+
+def run_stage(args, stage, function, *params):
+    """Run the function of a stage and record its measures in args.metrics.
+
+    stage can be a tuple of the stages the function runs at the same time.
+    """
+    tokens = [args.metrics.begin(name) for name in (
+        stage if isinstance(stage, tuple) else (stage,))]
+    ok = False
+    try:
+        ok = function(*params)
+    finally:
+        for token in tokens:
+            args.metrics.end(token, bool(ok))
+    return ok
+
+
+def write_run_metrics(args):
+    """Save the measures of the run as json and as a Prometheus textfile."""
+    try:
+        args.metrics.write_json(os.path.join(WORKING_DIR, args.runPath, RUN_METRICS_FILE))
+        if(args.metricsDir):
+            args.metrics.write_prometheus(args.metricsDir)
+    except (IOError, OSError) as e:
+        print('It was not possible to save the run metrics. Error: %s' % e)
+
+
 def send_email():
     pass
 
 
-def main():
+def get_run_name(runPath):
+    if(runPath.endswith('/')):
+        return os.path.join(WORKING_DIR, runPath).rsplit('/', 2)[-2]
+    elif('/' in runPath):
+        return os.path.join(WORKING_DIR, runPath).rsplit('/', 1)[-1]
+    else:
+        return os.path.join(WORKING_DIR, runPath)
+
+
+def get_args(argv=None, resources=None):
+    """Options of a run, as main uses them."""
 
     parser = argparse.ArgumentParser(description='Generate a PDF report with FastQC analysis')
 
@@ -546,20 +2010,117 @@ def main():
     parser.add_argument(
         '--runName', '-r',
         default=None, help='Name of the run (default: %(default)s)')
+    parser.add_argument(
+        '--cores', '-c', type=int,
+        default=multiprocessing.cpu_count(),
+        help='Cores shared by the FastQC jobs (default: %(default)s)')
+    parser.add_argument(
+        '--memory', '-m', type=int,
+        default=get_total_memory(),
+        help='Memory in MB shared by the FastQC jobs (default: %(default)s)')
+    parser.add_argument(
+        '--qcEngine', '-q',
+        default='fastqc',
+        choices=['fastqc', 'native'],
+        help='Program that creates the quality plots: FastQC or the NumPy '
+             'implementation in fastq_qc.py (default: %(default)s)')
+    parser.add_argument(
+        '--cacheDir',
+        default=CACHE_DIR,
+        help='Folder of the FastQC result cache (default: %(default)s)')
+    parser.add_argument(
+        '--cacheSize', type=int,
+        default=2048,
+        help='Size limit of the FastQC result cache in MB (default: %(default)s)')
+    parser.add_argument(
+        '--noCache', action='store_true',
+        help='Do not reuse nor store FastQC results')
+    parser.add_argument(
+        '--pipelined', action='store_true',
+        help='Convert every lane with its own bcl2fastq and start its QC as soon '
+             'as it is converted, instead of after the whole run')
+    parser.add_argument(
+        '--shardBy',
+        default=None,
+        choices=['lane', 'surface', 'swath'],
+        help='Convert the run in shards of a lane or of the tiles of a surface or '
+             'swath of a lane, run by workers claiming them from a queue in the '
+             'run folder (shard_queue.py)')
+    parser.add_argument(
+        '--shardWorkers', type=int,
+        default=2,
+        help='Local workers of --shardBy, workers of other hosts can join them '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--sampleReads', '-n', type=int,
+        default=0,
+        help='Run the QC on a sample of this many reads of each lane/read, spread '
+             'across its files, for a quick-look report labelled as sampled, as '
+             '2000000 (default: %(default)s, every read)')
+    parser.add_argument(
+        '--texWorkers', '-w', type=int,
+        default=min(4, multiprocessing.cpu_count()),
+        help='Number of reports compiled at the same time (default: %(default)s)')
+    parser.add_argument(
+        '--reportFormat', '-f',
+        default='pdf',
+        choices=['pdf', 'html', 'both'],
+        help='pdf compiles the LaTeX reports, html writes a self-contained html '
+             'page and a json document without TeX (default: %(default)s)')
+    parser.add_argument(
+        '--historyDb',
+        default=HISTORY_DB,
+        help='SQLite database the metrics of the run are added to, empty to '
+             'not record them (default: %(default)s)')
+    parser.add_argument(
+        '--metricsDir',
+        default=METRICS_DIR,
+        help='Folder of the Prometheus textfile with the time, CPU and memory of '
+             'the stages, empty to not write it (default: %(default)s)')
+    parser.add_argument(
+        '--singleReport', action='store_true',
+        help='Write one report with a section for each lane/read instead of '
+             'one report per lane/read')
+    parser.add_argument(
+        '--timeout', action='append', default=[], metavar='STAGE=SECONDS',
+        help='Stop a program of the stage (bcl2fastq, fastqc or pdflatex) running '
+             'longer than this, as fastqc=7200, 0 for no limit (default: %s)' % ', '.join(
+                 '%s=%d' % item for item in sorted(STAGE_TIMEOUTS.items())))
+    parser.add_argument(
+        '--dryRun', '--dry-run', action='store_true',
+        help='Print the units that would run and exit')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
-    args.sequencerName = args.sequencerName.upper()
+    if(args.pipelined and args.shardBy):
+        parser.error('--pipelined can not be used with --shardBy')
 
-    file_status = os.path.join(WORKING_DIR, args.runPath, STATUS_FILE)
+    timeouts = dict(STAGE_TIMEOUTS)
+    for timeout in args.timeout:
+        stage, _, seconds = timeout.partition('=')
+        if(stage not in STAGE_PROFILES or not seconds.isdigit()):
+            parser.error('--timeout expects STAGE=SECONDS, not %s' % timeout)
+        timeouts[stage] = int(seconds)
+    args.timeouts = dict((stage, seconds) for stage, seconds in timeouts.items() if seconds)
+
+    # budget shared with other runs, see batch_runs.py
+    args.resources = resources
+
+    args.sequencerName = args.sequencerName.upper()
 
     if(not args.runName):
-        if(args.runPath.endswith('/')):
-            args.runName = os.path.join(WORKING_DIR, args.runPath).rsplit('/', 2)[-2]
-        elif('/' in args.runPath):
-            args.runName = os.path.join(WORKING_DIR, args.runPath).rsplit('/', 1)[-1]
-        else:
-            args.runName = os.path.join(WORKING_DIR, args.runPath)
+        args.runName = get_run_name(args.runPath)
+
+    args.metrics = stage_metrics.RunMetrics(args.runName, args.sequencerName)
+
+    return args
+
+
+def main(argv=None, resources=None):
+
+    args = get_args(argv, resources)
+
+    file_status = os.path.join(WORKING_DIR, args.runPath, STATUS_FILE)
 
     if(not os.path.exists(os.path.join(WORKING_DIR, args.runPath))):
         raise Exception(
@@ -567,6 +2128,17 @@ def main():
 
     print('path exist')
 
+    fastq_path = ''
+
+    fastq_path = os.path.join(WORKING_DIR, args.runPath, '%s_fastq/' % args.runName)
+
+    graph = build_unit_graph(args, fastq_path)
+    graph.plan()
+
+    if(args.dryRun):
+        graph.print_plan()
+        return
+
     if(not check_analysed_folder(args, file_status)):
         raise Exception(
             'The folder has the status "%s". Execution aborted.' %
@@ -574,25 +2146,49 @@ def main():
 
     print('path checked')
 
-    fastq_path = ''
+    log_dir = get_log_dir(args.runName)
+    print('logs in %s' % log_dir)
 
-    logfile = getLogfile()
+    try:
+        if(args.pipelined):
+            if(not run_stage(args, ('bcl2fastq', 'fastqc'), run_pipelined,
+                             args, file_status, fastq_path, log_dir, graph)):
+                raise Exception("Error on bcl2fastq or fastqc. Execution aborted.")
+        else:
+            convert = run_sharded_blc2fastq if args.shardBy else run_blc2fastq
+            if(not run_stage(args, 'bcl2fastq', convert,
+                             args, file_status, fastq_path, log_dir, graph)):
+                raise Exception("Error on bcl2fastq. Execution aborted.")
 
-    fastq_path = os.path.join(WORKING_DIR, args.runPath, '%s_fastq/' % args.runName)
-    if(not run_blc2fastq(args, file_status, fastq_path, logfile)):
-        raise Exception("Error on bcl2fastq. Execution aborted.")
+            print('converted')
+
+            if(not run_stage(args, 'fastqc', run_fastqc,
+                             args, file_status, fastq_path, log_dir, graph)):
+                raise Exception("Error on fastqc. Execution aborted.")
+
+        print('reported')
 
-    print('converted')
+        run_stage(args, 'metrics', write_metrics_store, args, fastq_path, graph)
 
-    if(not run_fastqc(args, file_status, fastq_path, logfile)):
-        raise Exception("Error on fastqc. Execution aborted.")
+        if(args.reportFormat != 'html'):
+            if(not run_stage(args, 'pdflatex', compile_tex,
+                             args, file_status, fastq_path, log_dir, graph)):
+                raise Exception("Error on compile tex. Execution aborted.")
 
-    print('reported')
+            print('generated pdf')
 
-    if(not compile_tex(args, file_status, fastq_path, logfile)):
-        raise Exception("Error on compile tex. Execution aborted.")
+        if(args.reportFormat != 'pdf'):
+            if(not run_stage(args, 'html', write_html_report, args, fastq_path, graph)):
+                raise Exception("Error on html report. Execution aborted.")
 
-    print('generated pdf')
+            print('generated html')
+
+        if(args.historyDb):
+            run_stage(args, 'history', record_history, args, fastq_path, graph)
+
+            print('recorded in history')
+    finally:
+        write_run_metrics(args)
 
     build_bcl2fastq_report_tex_table(args, fastq_path)
 
@@ -601,6 +2197,5 @@ def main():
     except Exception as e:
         raise e
 
-
 if __name__ == '__main__':
     main()
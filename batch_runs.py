@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Processes several runs at the same time on one shared budget of cores,
+# memory and disk I/O.
+#
+# Every run goes through RunFastQC.main in its own thread. Before starting
+# an external program, a stage asks the shared ResourcePool for the
+# resources of its profile (RunFastQC.STAGE_PROFILES: bcl2fastq is I/O
+# heavy, FastQC is CPU and heap heavy, pdflatex is light) and waits until
+# they are free. When several requests fit, the run holding the fewest cores
+# goes first, so a big run can not starve the others. At the end the time
+# each run waited for resources and its total run time are printed.
+#
+# Execution:
+#   python batch_runs.py --cores 32 --memory 65536 RUN_A RUN_B:nextseq ...
+# Options not known here are passed to RunFastQC for every run.
+
+import argparse
+import multiprocessing
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+import RunFastQC
+import watch_runs
+
+
+RESOURCES = ['cores', 'memory', 'io']
+
+
+class Request(object):
+
+    __slots__ = ('run', 'need', 'since')
+
+    def __init__(self, run, need):
+        self.run = run
+        self.need = need
+        self.since = time.time()
+
+
+class ResourcePool(object):
+    """Cores, memory (MB) and I/O slots shared by the runs of a batch."""
+
+    def __init__(self, cores, memory, io):
+        self.capacity = {'cores': cores, 'memory': memory, 'io': io}
+        self.free = dict(self.capacity)
+        self.held = {}
+        self.waited = {}
+        self.waiting = []
+        self.condition = threading.Condition()
+
+    def request(self, run, profile):
+        """Register a request for the resources of a stage profile."""
+        need = dict((k, min(profile.get(k, 0), self.capacity[k])) for k in RESOURCES)
+        request = Request(run, need)
+        with self.condition:
+            self.waiting.append(request)
+        return request
+
+    def _fits(self, request):
+        return all(request.need[k] <= self.free[k] for k in RESOURCES)
+
+    def _next(self):
+        """The fitting request of the run holding fewer cores, oldest first."""
+        fitting = [r for r in self.waiting if self._fits(r)]
+        if(not fitting):
+            return None
+        return min(fitting, key=lambda r: (self.held.get(r.run, 0), r.since))
+
+    def try_grant(self, request):
+        """Give the resources to the request if it is its turn. Never blocks."""
+        with self.condition:
+            if(self._next() is not request):
+                return False
+            self.waiting.remove(request)
+            for k in RESOURCES:
+                self.free[k] -= request.need[k]
+            self.held[request.run] = self.held.get(request.run, 0) + request.need['cores']
+            self.waited[request.run] = self.waited.get(request.run, 0) + (
+                time.time() - request.since)
+            return True
+
+    def acquire(self, run, profile):
+        """Wait for the resources of a profile and return the granted request."""
+        request = self.request(run, profile)
+        try:
+            with self.condition:
+                while(not self.try_grant(request)):
+                    self.condition.wait(RunFastQC.SCHEDULER_INTERVAL)
+        except BaseException:
+            self.cancel(request)
+            raise
+        return request
+
+    def cancel(self, request):
+        """Withdraw a request not granted yet, its run does not wait for it anymore.
+
+        Left waiting, the oldest request of a run holding nothing would be
+        the next one forever and no other run would be granted anything.
+        """
+        with self.condition:
+            if(request in self.waiting):
+                self.waiting.remove(request)
+            self.condition.notify_all()
+
+    def release(self, request):
+        with self.condition:
+            for k in RESOURCES:
+                self.free[k] += request.need[k]
+            self.held[request.run] -= request.need['cores']
+            self.condition.notify_all()
+
+
+def run_batch(runs, pool, options):
+    """Process the (run path, sequencer) pairs and return their times."""
+    report = OrderedDict([])
+    threads = []
+
+    def process(run_path, sequencer):
+        argv = ['--runPath', run_path, '--sequencerName', sequencer] + options
+        start = time.time()
+        status = 'done'
+        try:
+            RunFastQC.main(argv, pool)
+        except Exception:
+            status = 'failed'
+            traceback.print_exc()
+        report[run_path]['run'] = time.time() - start
+        report[run_path]['status'] = status
+
+    for run_path, sequencer in runs:
+        report[run_path] = {'status': 'running'}
+        thread = threading.Thread(target=process, args=(run_path, sequencer))
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    for run_path, sequencer in runs:
+        report[run_path]['wait'] = pool.waited.get(RunFastQC.get_run_name(run_path), 0)
+
+    return report
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Process several runs on a shared budget of resources')
+
+    parser.add_argument(
+        'runs', nargs='+',
+        help='Run folders, optionally followed by :miseq or :nextseq')
+    parser.add_argument(
+        '--cores', '-c', type=int,
+        default=multiprocessing.cpu_count(),
+        help='Cores shared by all runs (default: %(default)s)')
+    parser.add_argument(
+        '--memory', '-m', type=int,
+        default=RunFastQC.get_total_memory(),
+        help='Memory in MB shared by all runs (default: %(default)s)')
+    parser.add_argument(
+        '--io', type=float,
+        default=2,
+        help='Disk I/O slots shared by all runs; bcl2fastq takes a whole '
+             'slot (default: %(default)s)')
+
+    args, options = parser.parse_known_args()
+
+    runs = []
+    for run in args.runs:
+        run_path, _, sequencer = run.partition(':')
+        if(not run_path.endswith('/')):
+            run_path += '/'
+        sequencer = sequencer or watch_runs.get_sequencer(run_path)
+        if(not sequencer):
+            parser.error('unknown sequencer of %s, use %s:miseq or %s:nextseq' % (
+                run_path, run_path, run_path))
+        runs.append((run_path, sequencer))
+
+    pool = ResourcePool(args.cores, args.memory, args.io)
+    report = run_batch(runs, pool, options)
+
+    print('%-50s %-8s %12s %12s' % ('run', 'status', 'queue wait', 'run time'))
+    for run_path, times in report.items():
+        print('%-50s %-8s %11.0fs %11.0fs' % (
+            run_path, times['status'], times['wait'], times['run']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+# Merge of the bcl2fastq outputs of parts of a run.
+#
+# When the lanes of a run are converted by separate bcl2fastq executions
+# (--pipelined), each one writes a complete output folder: the FASTQ files
+# in project folders, Reports/html and Stats/Stats.json. merge_part moves
+# the FASTQ files of a part into the fastq folder of the run and merges its
+# reports into the ones already there, so the fastq folder ends as if a
+# single bcl2fastq had converted the run:
+#   - Stats.json: the per lane lists (ConversionResults, UnknownBarcodes,
+#     ReadInfosForLanes) of the part replace the ones of its lanes;
+#   - Reports/html: the pages of the part are added, and in the summary
+#     pages (laneBarcode.html, lane.html) the rows of its lanes replace
+#     the old ones and the Flowcell Summary is added up.
+#
+# A lane split in tile ranges (--shardBy surface/swath) is merged by
+# merge_shard: the gzipped FASTQ files of its shards are concatenated (a
+# file of several gzip members is still a gzip file) and the counts of their
+# Stats.json added up. The summary tables of Reports/html can not be added
+# up (their percentages would need the counts behind them), so the Reports
+# of the shards are kept in Reports/shards and the report is read from the
+# merged Stats.json.
+
+import io
+import json
+import os
+import shutil
+from collections import OrderedDict
+
+from bs4 import BeautifulSoup
+
+
+STATS = os.path.join('Stats', 'Stats.json')
+REPORTS = 'Reports'
+# folders of a part that are not FASTQ files
+PART_DIRS = ['Reports', 'Stats', 'InterOp']
+# lists of Stats.json with an item per lane, and the key with the lane
+LANE_LISTS = [
+    ('ConversionResults', 'LaneNumber'),
+    ('UnknownBarcodes', 'Lane'),
+    ('ReadInfosForLanes', 'LaneNumber'),
+]
+# summary pages of Reports/html with rows of every lane
+SUMMARY_PAGES = ['laneBarcode.html', 'lane.html']
+# numbers of Stats.json that are not counts, they are not added up
+ID_KEYS = ['LaneNumber', 'Lane', 'ReadNumber', 'RunNumber']
+# lists of Stats.json items and the key identifying an item
+ITEM_KEYS = ['SampleId', 'IndexSequence', 'ReadNumber']
+# folder of Reports with the reports of the tile shards
+SHARD_REPORTS = 'shards'
+COPY_SIZE = 1024 * 1024
+
+
+def move_fastq(part, fastq_path, append=False):
+    """Move the FASTQ files of a part, in their project folders, to fastq_path.
+
+    With append the files already in fastq_path get the part added at their end.
+    """
+    moved = []
+    for root, dirs, files in os.walk(part):
+        relative = os.path.relpath(root, part)
+        if(relative == '.'):
+            dirs[:] = [d for d in dirs if d not in PART_DIRS]
+            relative = ''
+        target = os.path.join(fastq_path, relative)
+        if(not os.path.exists(target)):
+            os.makedirs(target)
+        for f in files:
+            if(append and os.path.exists(os.path.join(target, f))):
+                with open(os.path.join(target, f), 'ab') as out:
+                    with open(os.path.join(root, f), 'rb') as src:
+                        shutil.copyfileobj(src, out, COPY_SIZE)
+                os.remove(os.path.join(root, f))
+            else:
+                os.rename(os.path.join(root, f), os.path.join(target, f))
+            moved.append(os.path.join(relative, f))
+    return moved
+
+
+def get_item_key(item):
+    for key in ITEM_KEYS:
+        if(key in item):
+            return key, item[key]
+    return None
+
+
+def add_counts(item, other):
+    """Add the counts of other, the same Stats.json object of another shard, to item."""
+    for key, value in other.items():
+        if(key not in item):
+            item[key] = value
+        elif(isinstance(value, dict)):
+            add_counts(item[key], value)
+        elif(isinstance(value, list)):
+            items = dict((get_item_key(i), i) for i in item[key] if isinstance(i, dict))
+            for i in value:
+                if(isinstance(i, dict) and get_item_key(i) in items):
+                    add_counts(items[get_item_key(i)], i)
+                else:
+                    item[key].append(i)
+        elif(isinstance(value, (int, float)) and not isinstance(value, bool) and
+             key not in ID_KEYS):
+            item[key] += value
+
+
+def merge_stats(paths, out, add=False):
+    """Merge the Stats.json files in paths in out, the later ones replace the lanes
+    of the ones before, or add their counts to them with add. Returns False when
+    none exists."""
+    merged = None
+    for path in paths:
+        if(not os.path.exists(path)):
+            continue
+        with io.open(path, 'r', encoding='utf-8') as f:
+            stats = json.load(f, object_pairs_hook=OrderedDict)
+        if(merged is None):
+            merged = stats
+            continue
+        for key, lane_key in LANE_LISTS:
+            if(key not in stats):
+                continue
+            items = stats[key] or []
+            if(add):
+                lanes = dict((item.get(lane_key), item) for item in merged.get(key) or [])
+                for item in items:
+                    if(item.get(lane_key) not in lanes):
+                        lanes[item.get(lane_key)] = item
+                    elif(key != 'ReadInfosForLanes'):
+                        add_counts(lanes[item.get(lane_key)], item)
+                merged[key] = sorted(lanes.values(), key=lambda item: item.get(lane_key))
+                continue
+            lanes = set(item.get(lane_key) for item in items)
+            merged[key] = sorted(
+                [item for item in merged.get(key) or [] if item.get(lane_key) not in lanes] +
+                items, key=lambda item: item.get(lane_key))
+
+    if(merged is None):
+        return False
+
+    if(not os.path.exists(os.path.dirname(out))):
+        os.makedirs(os.path.dirname(out))
+    tmp = '%s.%d' % (out, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(merged, f, indent=2)
+    os.rename(tmp, out)
+    return True
+
+
+def to_int(value):
+    try:
+        return int(value.replace(',', ''))
+    except ValueError:
+        return None
+
+
+def merge_table(table, part_table):
+    """Add the rows of a ReportTable of a part to the same table of the run."""
+    rows = table.find_all('tr')
+    part_rows = [row for row in part_table.find_all('tr') if row.find('td')]
+    if(not rows or not part_rows):
+        return
+    heads = [th.get_text().strip() for th in rows[0].find_all('th')]
+
+    if(heads and heads[0] == 'Lane'):
+        # a row per lane and sample/barcode, the rows of the lanes of the part are replaced
+        lanes = set(row.find('td').get_text().strip() for row in part_rows)
+        kept = [row for row in rows[1:] if row.find('td') and
+                row.find('td').get_text().strip() not in lanes]
+        for row in rows[1:]:
+            row.extract()
+        for row in sorted(kept + part_rows,
+                          key=lambda row: to_int(row.find('td').get_text().strip()) or 0):
+            rows[0].parent.append(row)
+        return
+
+    # Flowcell Summary, the counts of the part are added
+    for row, part_row in zip([row for row in rows if row.find('td')], part_rows):
+        for td, part_td in zip(row.find_all('td'), part_row.find_all('td')):
+            value, part_value = to_int(td.get_text().strip()), to_int(part_td.get_text().strip())
+            if(value is not None and part_value is not None):
+                td.string = '{:,}'.format(value + part_value)
+
+
+def merge_page(path, part_path):
+    """Merge the ReportTable tables of the page of a part in the page at path."""
+    with io.open(path, 'r', encoding='utf-8') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+    with io.open(part_path, 'r', encoding='utf-8') as f:
+        part = BeautifulSoup(f.read(), 'html.parser')
+
+    for table, part_table in zip(soup.find_all(id='ReportTable'),
+                                 part.find_all(id='ReportTable')):
+        merge_table(table, part_table)
+
+    tmp = '%s.%d' % (path, os.getpid())
+    with io.open(tmp, 'w', encoding='utf-8') as f:
+        f.write(u'%s' % soup)
+    os.rename(tmp, path)
+
+
+def merge_reports(part, reports):
+    """Merge the Reports folder of a part in the Reports folder of the run."""
+    for root, dirs, files in os.walk(part):
+        target = os.path.join(reports, os.path.relpath(root, part))
+        if(not os.path.exists(target)):
+            os.makedirs(target)
+        for f in files:
+            if(f in SUMMARY_PAGES and os.path.exists(os.path.join(target, f))):
+                merge_page(os.path.join(target, f), os.path.join(root, f))
+            else:
+                shutil.copy2(os.path.join(root, f), os.path.join(target, f))
+
+
+def clear_reports(fastq_path):
+    """Remove the reports of an old conversion, so the parts do not merge with them."""
+    if(os.path.exists(os.path.join(fastq_path, STATS))):
+        os.remove(os.path.join(fastq_path, STATS))
+    if(os.path.exists(os.path.join(fastq_path, REPORTS))):
+        shutil.rmtree(os.path.join(fastq_path, REPORTS))
+
+
+def merge_part(part, fastq_path):
+    """Move the output of a part of the run in fastq_path and remove the part.
+
+    Returns the FASTQ files moved, relative to fastq_path.
+    """
+    if(not os.path.exists(fastq_path)):
+        os.makedirs(fastq_path)
+
+    moved = move_fastq(part, fastq_path)
+    merge_stats([os.path.join(fastq_path, STATS), os.path.join(part, STATS)],
+                os.path.join(fastq_path, STATS))
+    if(os.path.exists(os.path.join(part, REPORTS))):
+        merge_reports(os.path.join(part, REPORTS), os.path.join(fastq_path, REPORTS))
+
+    shutil.rmtree(part)
+    return moved
+
+
+def merge_shard(part, fastq_path, name, first):
+    """Add the output of a shard with some of the tiles of a lane to fastq_path and
+    remove it. first is the first shard of its lane, its files replace the old ones.
+
+    Returns the FASTQ files moved, relative to fastq_path.
+    """
+    if(not os.path.exists(fastq_path)):
+        os.makedirs(fastq_path)
+
+    moved = move_fastq(part, fastq_path, append=not first)
+    merge_stats([os.path.join(fastq_path, STATS), os.path.join(part, STATS)],
+                os.path.join(fastq_path, STATS), add=not first)
+    if(os.path.exists(os.path.join(part, REPORTS))):
+        target = os.path.join(fastq_path, REPORTS, SHARD_REPORTS, name)
+        if(os.path.exists(target)):
+            shutil.rmtree(target)
+        if(not os.path.exists(os.path.dirname(target))):
+            os.makedirs(os.path.dirname(target))
+        shutil.move(os.path.join(part, REPORTS), target)
+
+    shutil.rmtree(part)
+    return moved
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Throughput benchmark of RunFastQC.py on synthetic runs.
+#
+# For each run size a synthetic run folder is written (synthetic_run.py)
+# in a temporary working folder, and the stages and functions of
+# RunFastQC are timed on it with the stand-ins of benchmark/bin in place of
+# bcl2fastq, FastQC and pdflatex (their latency is set with --latency or
+# the BENCH_*_LATENCY variables). Functions without side effects are run
+# --repeat times and the best time is kept. The times are printed and can
+# be appended as json lines to a file to follow the scaling over time.
+#
+# Execution:
+#   python benchmark/run_benchmark.py --sequencer nextseq --samples 12,96,384 --reads 1000
+#   python benchmark/run_benchmark.py --samples 1000 --output benchmark.jsonl
+#   python benchmark/run_benchmark.py --reads 100000 --sampleReads 10000
+#   python benchmark/run_benchmark.py --sequencer nextseq --shardBy swath --shardWorkers 4
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import RunFastQC  # noqa: E402
+import samplesheet  # noqa: E402
+import synthetic_run  # noqa: E402
+
+
+STAND_INS = os.path.join(BENCH_DIR, 'bin')
+TOOLS = ['bcl2fastq', 'fastqc', 'pdflatex']
+
+
+def best_time(repeat, function, *params):
+    """Best wall time of repeat calls of the function, and its result."""
+    best = None
+    result = None
+    for _ in range(max(1, repeat)):
+        start = time.time()
+        result = function(*params)
+        elapsed = time.time() - start
+        if(best is None or elapsed < best):
+            best = elapsed
+    return best, result
+
+
+def setup(root):
+    """Point RunFastQC at the working folder root and at the stand-ins."""
+    shutil.copy2(os.path.join(os.path.dirname(BENCH_DIR), RunFastQC.REPORT_FILE), root)
+    RunFastQC.WORKING_DIR = root
+    RunFastQC.BCL2FASTQ_PATH = os.path.join(STAND_INS, 'bcl2fastq')
+    RunFastQC.FASTQC_PATH = os.path.join(STAND_INS, 'fastqc')
+    RunFastQC.CACHE_DIR = os.path.join(root, 'fastqc_cache')
+    RunFastQC.FORMAT_DIR = os.path.join(root, 'tex_formats')
+    RunFastQC.HISTORY_DB = os.path.join(root, 'qc_history.sqlite')
+    RunFastQC.METRICS_DIR = os.path.join(root, 'metrics')
+    RunFastQC.LOG_DIR = os.path.join(root, 'logs')
+    RunFastQC.SCHEDULER_INTERVAL = 0.05
+    if(not os.environ.get('PATH', '').startswith(STAND_INS)):
+        os.environ['PATH'] = STAND_INS + os.pathsep + os.environ.get('PATH', '')
+
+
+def bench_run(options, samples):
+    """Time the stages and functions of RunFastQC on a run of that size."""
+    root = tempfile.mkdtemp(prefix='fastqc-bench-')
+    times = OrderedDict([])
+    cwd = os.getcwd()
+    try:
+        setup(root)
+        # RunFastQC is run from its folder, the run paths are relative to it
+        os.chdir(root)
+        start = time.time()
+        run_dir = synthetic_run.make_run(
+            root, options.sequencer, samples, options.reads, options.readLength)
+        times['make_run'] = time.time() - start
+
+        name = os.path.basename(run_dir)
+        argv = [
+            '--runPath', name + '/', '--sequencerName', options.sequencer,
+            '--cores', str(options.cores), '--sampleReads', str(options.sampleReads),
+            '--noCache', '--historyDb', '', '--metricsDir', '']
+        if(options.shardBy):
+            argv += ['--shardBy', options.shardBy,
+                     '--shardWorkers', str(options.shardWorkers)]
+        args = RunFastQC.get_args(argv)
+        file_status = os.path.join(run_dir, RunFastQC.STATUS_FILE)
+        fastq_path = os.path.join(run_dir, '%s_fastq/' % args.runName)
+        log_dir = RunFastQC.get_log_dir(args.runName)
+        repeat = options.repeat
+
+        def cold_run_details():
+            samplesheet.SHEETS.clear()
+            return RunFastQC.get_run_details(args)
+
+        def cold_bcl2fastq_report():
+            RunFastQC.BCL2FASTQ_REPORTS.clear()
+            return RunFastQC.get_bcl2fastq_report(args, fastq_path)
+
+        if(options.pipelined):
+            graph = RunFastQC.build_unit_graph(args, fastq_path)
+            graph.plan()
+            convert = [('run_pipelined', 1, RunFastQC.run_pipelined,
+                        (args, file_status, fastq_path, log_dir, graph))]
+        elif(options.shardBy):
+            graph = RunFastQC.build_unit_graph(args, fastq_path)
+            graph.plan()
+            convert = [('run_sharded_blc2fastq', 1, RunFastQC.run_sharded_blc2fastq,
+                        (args, file_status, fastq_path, log_dir, graph))]
+        else:
+            convert = [('run_blc2fastq', 1, RunFastQC.run_blc2fastq,
+                        (args, file_status, fastq_path, log_dir))]
+
+        stages = convert + [
+            ('get_fastq_index', repeat, RunFastQC.get_fastq_index, (fastq_path, True)),
+            ('rename_fastq_file', repeat, RunFastQC.rename_fastq_file, (args, fastq_path)),
+            ('get_run_details', repeat, cold_run_details, ()),
+            ('get_bcl2fastq_stats_report', repeat, RunFastQC.get_bcl2fastq_stats_report,
+             (args, fastq_path)),
+            ('get_bcl2fastq_html_report', repeat, RunFastQC.get_bcl2fastq_html_report,
+             (args, fastq_path)),
+            ('get_bcl2fastq_report', repeat, cold_bcl2fastq_report, ()),
+            ('build_run_details_tex_table', repeat, RunFastQC.build_run_details_tex_table,
+             (args, RunFastQC.get_run_details(args))),
+            ('build_bcl2fastq_report_tex_table', repeat,
+             RunFastQC.build_bcl2fastq_report_tex_table, (args, fastq_path)),
+        ]
+        if(options.shardBy in ['surface', 'swath']):
+            # the summary pages of tile shards are not merged, only Stats.json
+            stages = [s for s in stages if s[0] != 'get_bcl2fastq_html_report']
+        if(not options.pipelined):
+            stages.append(
+                ('run_fastqc', 1, RunFastQC.run_fastqc, (args, file_status, fastq_path, log_dir)))
+        stages += [
+            ('write_metrics_store', 1, RunFastQC.write_metrics_store, (args, fastq_path)),
+            ('compile_tex', 1, RunFastQC.compile_tex, (args, file_status, fastq_path, log_dir)),
+            ('write_html_report', 1, RunFastQC.write_html_report, (args, fastq_path)),
+        ]
+
+        for label, calls, function, params in stages:
+            elapsed, result = best_time(calls, function, *params)
+            times[label] = elapsed
+            if(result is False):
+                raise Exception('%s failed on the run with %d samples' % (label, samples))
+    finally:
+        os.chdir(cwd)
+        if(options.keep):
+            print('run kept in %s' % root)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    return times
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Time RunFastQC on synthetic runs')
+
+    parser.add_argument(
+        '--sequencer', '-s', default='miseq', choices=sorted(synthetic_run.LANES.keys()))
+    parser.add_argument(
+        '--samples', '-n', default='12,96,384',
+        help='Comma separated numbers of samples of the runs (default: %(default)s)')
+    parser.add_argument(
+        '--reads', '-r', type=int, default=1000,
+        help='Reads per sample, lane and read (default: %(default)s)')
+    parser.add_argument('--readLength', '-l', type=int, default=150)
+    parser.add_argument('--cores', '-c', type=int, default=4)
+    parser.add_argument(
+        '--pipelined', action='store_true',
+        help='Time run_pipelined (a bcl2fastq per lane, overlapped with FastQC) '
+             'instead of run_blc2fastq and run_fastqc')
+    parser.add_argument(
+        '--shardBy', choices=['lane', 'surface', 'swath'],
+        help='Time run_sharded_blc2fastq (shards claimed from a work queue by '
+             '--shardWorkers processes) instead of run_blc2fastq')
+    parser.add_argument('--shardWorkers', type=int, default=2)
+    parser.add_argument(
+        '--sampleReads', type=int, default=0,
+        help='Reads sampled of each lane/read for the QC, 0 for all (default: %(default)s)')
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='Calls of the functions without side effects, the best is kept '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--latency', action='append', default=[], metavar='TOOL=SECONDS',
+        help='Latency of a stand-in (%s), as fastqc=2' % ', '.join(TOOLS))
+    parser.add_argument('--output', '-o', help='File the results are appended to as json lines')
+    parser.add_argument('--keep', action='store_true', help='Keep the synthetic runs')
+
+    options = parser.parse_args()
+
+    for latency in options.latency:
+        tool, _, seconds = latency.partition('=')
+        if(tool not in TOOLS):
+            parser.error('unknown stand-in %s' % tool)
+        os.environ['BENCH_%s_LATENCY' % tool.upper()] = seconds
+
+    sizes = [int(n) for n in options.samples.split(',') if n]
+    results = OrderedDict((n, bench_run(options, n)) for n in sizes)
+
+    names = list(results[sizes[0]].keys())
+    print('')
+    print('%-34s %s' % ('samples', ' '.join('%10d' % n for n in sizes)))
+    for name in names:
+        print('%-34s %s' % (name, ' '.join('%9.3fs' % results[n][name] for n in sizes)))
+
+    if(options.output):
+        with open(options.output, 'a') as f:
+            for n in sizes:
+                f.write(json.dumps(OrderedDict([
+                    ('date', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                    ('sequencer', options.sequencer),
+                    ('samples', n),
+                    ('reads', options.reads),
+                    ('read_length', options.readLength),
+                    ('sample_reads', options.sampleReads),
+                    ('pipelined', options.pipelined),
+                    ('shard_by', options.shardBy),
+                    ('shard_workers', options.shardWorkers if options.shardBy else 0),
+                    ('times', results[n])])) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Synthetic MiSeq/NextSeq run folders for the benchmarks.
+#
+# make_run writes a run folder (RunInfo.xml, RTAComplete.txt and a
+# SampleSheet.csv with the given number of samples) and a bench.json with
+# its parameters. make_fastq_output writes what bcl2fastq would for that
+# run: the gzipped FASTQ of every sample/lane/read in project folders, the
+# Undetermined files, Reports/html with laneBarcode.html and Stats.json.
+# It is called by the bcl2fastq stand-in in benchmark/bin.
+#
+# Execution:
+#   python synthetic_run.py --sequencer nextseq --samples 96 --reads 10000 OUTDIR
+
+import argparse
+import gzip
+import json
+import os
+import random
+
+
+BENCH_FILE = 'bench.json'
+INSTRUMENTS = {'miseq': 'M01234', 'nextseq': 'NB501279'}
+LANES = {'miseq': 1, 'nextseq': 4}
+# (surfaces, swaths) of the flowcells
+LAYOUTS = {'miseq': (2, 1), 'nextseq': (2, 3)}
+BASES = 'ACGT'
+
+
+def get_run_name(sequencer, number):
+    return '160101_%s_%04d_%s' % (
+        INSTRUMENTS[sequencer], number, 'AH%07dBGXX' % number if sequencer == 'nextseq'
+        else '000000000-A%04d' % number)
+
+
+def get_barcode(i, length=8):
+    """A distinct barcode per sample."""
+    barcode = ''
+    for _ in range(length):
+        barcode += BASES[i % 4]
+        i //= 4
+    return barcode
+
+
+def get_samples(n):
+    """(Sample_ID, index, Sample_Project) of n samples, 48 per project."""
+    return [('Sample_%d' % (i + 1), get_barcode(i), 'Project_%d' % (i // 48 + 1))
+            for i in range(n)]
+
+
+def make_run(root, sequencer='miseq', samples=12, reads=1000, read_length=150, number=1):
+    """Write a run folder in root and return its path."""
+    name = get_run_name(sequencer, number)
+    run_dir = os.path.join(root, name)
+    os.makedirs(os.path.join(run_dir, 'Data', 'Intensities', 'BaseCalls'))
+
+    with open(os.path.join(run_dir, 'RunInfo.xml'), 'w') as f:
+        f.write('<?xml version="1.0"?>\n<RunInfo><Run Id="%s" Number="%d">'
+                '<Instrument>%s</Instrument><FlowcellLayout LaneCount="%d" SurfaceCount="%d" '
+                'SwathCount="%d" TileCount="12"/></Run></RunInfo>\n' % (
+                    name, number, INSTRUMENTS[sequencer], LANES[sequencer],
+                    LAYOUTS[sequencer][0], LAYOUTS[sequencer][1]))
+    open(os.path.join(run_dir, 'RTAComplete.txt'), 'w').close()
+
+    with open(os.path.join(run_dir, 'SampleSheet.csv'), 'w') as f:
+        f.write('[Header]\nIEMFileVersion,4\nExperiment_Name,Benchmark_%d\n'
+                'Date,1/1/2016\nWorkflow,GenerateFASTQ\n\n'
+                '[Reads]\n%d\n%d\n\n'
+                '[Settings]\nAdapter,CTGTCTCTTATACACATCT\n\n'
+                '[Data]\nSample_ID,Sample_Name,Sample_Plate,Sample_Well,I7_Index_ID,index,'
+                'Sample_Project,Description\n' % (number, read_length, read_length))
+        for sample_id, index, project in get_samples(samples):
+            f.write('%s,%s,,,N%s,%s,%s,\n' % (sample_id, sample_id, index, index, project))
+
+    # input of bcl2fastq, growing with the samples as the BCL files would
+    with open(os.path.join(run_dir, 'Data', 'Intensities', 'BaseCalls', 'bcl.bin'), 'wb') as f:
+        f.write(b'\0' * (1024 * samples))
+
+    with open(os.path.join(run_dir, BENCH_FILE), 'w') as f:
+        json.dump({'sequencer': sequencer, 'samples': samples, 'reads': reads,
+                   'read_length': read_length, 'number': number, 'name': name}, f)
+
+    return run_dir
+
+
+def write_fastq(path, reads, read_length, rnd):
+    """gzipped FASTQ of reads records, built from a few random blocks."""
+    blocks = []
+    for _ in range(16):
+        seq = ''.join(rnd.choice(BASES) for _ in range(read_length))
+        qual = ''.join(chr(33 + rnd.randint(2, 40)) for _ in range(read_length))
+        blocks.append((seq, qual))
+
+    f = gzip.open(path, 'wb', 1)
+    try:
+        for i in range(reads):
+            seq, qual = blocks[i % len(blocks)]
+            f.write(('@R%d 1:N:0:1\n%s\n+\n%s\n' % (i, seq, qual)).encode('ascii'))
+    finally:
+        f.close()
+
+
+def write_reports(fastq_path, name, lanes, samples, reads):
+    """Reports/html of the lanes, a list of lane numbers."""
+    report = os.path.join(fastq_path, 'Reports', 'html', name, 'all', 'all', 'all')
+    os.makedirs(report)
+    with open(os.path.join(fastq_path, 'Reports', 'html', 'index.html'), 'w') as f:
+        f.write('<html><frameset><frame src="%s/all/all/all/lane.html"></frameset></html>' % name)
+
+    rows = []
+    for lane in lanes:
+        for sample_id, index, project in samples:
+            rows.append(
+                '<tr><td>%d</td><td>%s</td><td>%s</td><td>%s</td><td>{:,}</td><td>%.2f</td>'
+                '<td>100.00</td><td>0.00</td><td>%d</td><td>100.00</td><td>92.00</td>'
+                '<td>35.50</td></tr>'.format(reads) % (
+                    lane, project, sample_id, index, 100.0 / len(samples), reads // 1000))
+    head = ''.join('<th>%s</th>' % h for h in [
+        'Lane', 'Project', 'Sample', 'Barcode sequence', 'PF Clusters', '% of the<br>lane',
+        '% Perfect<br>barcode', '% One mismatch<br>barcode', 'Yield (Mbases)',
+        '% PF<br>Clusters', '% &gt;= Q30<br>bases', 'Mean Quality<br>Score'])
+    total = reads * len(samples) * len(lanes)
+
+    with open(os.path.join(report, 'laneBarcode.html'), 'w') as f:
+        f.write('<html><h2>Flowcell Summary</h2><table id="ReportTable"><tr><th>Clusters (Raw)'
+                '</th><th>Clusters(PF)</th><th>Yield (MBases)</th></tr><tr><td>{:,}</td>'
+                '<td>{:,}</td><td>{:,}</td></tr></table>'.format(
+                    total * 5 // 4, total, total // 1000))
+        f.write('<h2>Lane Summary</h2><table id="ReportTable"><tr>%s</tr>%s</table>' % (
+            head, ''.join(rows)))
+        f.write('<h2>Top Unknown Barcodes</h2><table id="ReportTable"><tr><th>Lane</th>'
+                '<th>Count</th><th>Sequence</th></tr>%s</table></html>' % ''.join(
+                    '<tr><td>%d</td><td>10</td><td>GGGGGGGG</td></tr>' % lane for lane in lanes))
+
+
+def write_stats(fastq_path, name, lanes, samples, reads, read_length):
+    os.makedirs(os.path.join(fastq_path, 'Stats'))
+    results = []
+    for lane in lanes:
+        demux = []
+        for sample_id, index, project in samples:
+            yield_bases = reads * read_length * 2
+            demux.append({
+                'SampleId': sample_id, 'SampleName': sample_id,
+                'IndexMetrics': [{'IndexSequence': index,
+                                  'MismatchCounts': {'0': reads, '1': 0}}],
+                'NumberReads': reads, 'Yield': yield_bases,
+                'ReadMetrics': [{'ReadNumber': r, 'Yield': yield_bases // 2,
+                                 'YieldQ30': yield_bases * 46 // 100,
+                                 'QualityScoreSum': yield_bases * 35 // 2,
+                                 'TrimmedBases': 0} for r in (1, 2)]})
+        results.append({
+            'LaneNumber': lane,
+            'TotalClustersRaw': reads * len(samples) * 5 // 4,
+            'TotalClustersPF': reads * len(samples),
+            'Yield': reads * len(samples) * read_length * 2,
+            'DemuxResults': demux,
+            'Undetermined': {'NumberReads': 0, 'Yield': 0, 'ReadMetrics': []}})
+
+    with open(os.path.join(fastq_path, 'Stats', 'Stats.json'), 'w') as f:
+        json.dump({'Flowcell': name, 'RunNumber': 1, 'RunId': name,
+                   'ConversionResults': results,
+                   'UnknownBarcodes': [{'Lane': lane, 'Barcodes': {'GGGGGGGG': 10}}
+                                       for lane in lanes]}, f)
+
+
+def make_fastq_output(run_dir, fastq_path, lanes=None, share=1.0):
+    """Write in fastq_path the bcl2fastq output of a run made by make_run,
+    of the given lanes or of all of them, and of a share of their tiles."""
+    with open(os.path.join(run_dir, BENCH_FILE), 'r') as f:
+        bench = json.load(f)
+
+    lanes = lanes or list(range(1, LANES[bench['sequencer']] + 1))
+    samples = get_samples(bench['samples'])
+    reads = int(round(bench['reads'] * share))
+    rnd = random.Random(bench['number'])
+
+    if(not os.path.exists(fastq_path)):
+        os.makedirs(fastq_path)
+    for project in sorted(set(s[2] for s in samples)):
+        os.mkdir(os.path.join(fastq_path, project))
+
+    for lane in lanes:
+        for read in (1, 2):
+            write_fastq(os.path.join(
+                fastq_path, 'Undetermined_S0_L%03d_R%d_001.fastq.gz' % (lane, read)),
+                reads // 10, bench['read_length'], rnd)
+            for i, (sample_id, index, project) in enumerate(samples):
+                write_fastq(os.path.join(
+                    fastq_path, project, '%s_S%d_L%03d_R%d_001.fastq.gz' % (
+                        sample_id, i + 1, lane, read)),
+                    reads, bench['read_length'], rnd)
+
+    write_reports(fastq_path, bench['name'], lanes, samples, reads)
+    write_stats(fastq_path, bench['name'], lanes, samples, reads, bench['read_length'])
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Write a synthetic run folder')
+
+    parser.add_argument('root', help='Folder where the run is written')
+    parser.add_argument('--sequencer', '-s', default='miseq', choices=sorted(LANES.keys()))
+    parser.add_argument('--samples', '-n', type=int, default=12)
+    parser.add_argument('--reads', '-r', type=int, default=1000,
+                        help='Reads per sample, lane and read (default: %(default)s)')
+    parser.add_argument('--readLength', '-l', type=int, default=150)
+    parser.add_argument('--number', type=int, default=1, help='Run number')
+    parser.add_argument('--fastq', action='store_true',
+                        help='Also write the bcl2fastq output')
+
+    args = parser.parse_args()
+
+    run_dir = make_run(args.root, args.sequencer, args.samples, args.reads,
+                       args.readLength, args.number)
+    if(args.fastq):
+        make_fastq_output(run_dir, os.path.join(
+            run_dir, '%s_fastq' % os.path.basename(run_dir)))
+    print(run_dir)
+
+
+if __name__ == '__main__':
+    main()
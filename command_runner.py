@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+# External programs run without blocking the pipeline.
+#
+# The pipeline also runs on Python 2, which has no asyncio, so the event loop
+# is made of threads. A Command is a started program whose output (stdout
+# and stderr together) is read by a thread of its own, a line at a time, and
+# written to a log file of its own, so a program never blocks on a full pipe
+# and programs running together do not mix their lines. Its last TAIL_LINES
+# lines are also kept in memory and printed when it fails, so the error of
+# the right program is shown at once. A timer cancels a program running
+# longer than its timeout and cancel stops it from any thread: SIGTERM to its
+# process group (the shell of a command line goes with the java of FastQC
+# it started), SIGKILL KILL_GRACE seconds later. The last percentage a
+# program printed (FastQC prints "Approx 45% complete") is its progress.
+#
+# A CommandGroup starts the programs of a stage with the log folder, measures
+# (stage_metrics) and timeouts of the run, each program logging to a file
+# named after it. run blocks the thread calling it until its program ends,
+# with at most limit programs running at the same time (a semaphore) and
+# the resources of the stage taken from a shared pool (batch_runs.py) while
+# it runs; start returns at once, for schedulers like RunFastQC.run_jobs
+# that wake up with wait_any when any program ends. The group prints the
+# progress of its programs and cancels all of them when the pipeline stops.
+
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+
+
+# seconds between the SIGTERM and the SIGKILL of a cancelled program
+KILL_GRACE = 10
+# seconds the output of an ended program is still read, its children may keep the pipe
+READ_GRACE = 5
+PERCENT = re.compile(b'(\\d+(?:\\.\\d+)?)%')
+# exit code of a program not started because its group was cancelled
+CANCELLED = -signal.SIGTERM
+# lines of the output of a program kept in memory
+TAIL_LINES = 20
+
+
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    if(minutes >= 60):
+        return '%dh%02dm' % divmod(minutes, 60)
+    return '%dm%02ds' % (minutes, seconds)
+
+
+class Command(object):
+    """A started program with its output streamed to the file log."""
+
+    def __init__(self, cl, name, log, shell=False, cwd=None, env=None, timeout=None,
+                 metrics=None, stage=None, inputs=None, on_exit=None):
+        self.name = name
+        self.log = log
+        self.on_exit = on_exit
+        self.reason = None
+        self.percent = None
+        self.tail = deque(maxlen=TAIL_LINES)
+        self.start = time.time()
+        self.timers = []
+
+        # in a process group of its own, cancel stops its children too
+        self.process = subprocess.Popen(
+            cl, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=shell,
+            cwd=cwd, env=env, preexec_fn=os.setsid)
+        self.waiter = self.process
+        if(metrics):
+            # reaped by stage_metrics, which keeps its CPU and memory
+            self.waiter = metrics.command(stage, name, self.process, inputs)
+
+        self.reader = threading.Thread(target=self.read)
+        self.reader.daemon = True
+        self.reader.start()
+        if(timeout):
+            self.add_timer(timeout, self.cancel, 'timed out after %s' % format_seconds(timeout))
+
+    def read(self):
+        # appended, a program run again (a retried compile) keeps the first output
+        with open(self.log, 'ab') as log:
+            for line in iter(self.process.stdout.readline, b''):
+                log.write(line)
+                log.flush()
+                self.tail.append(line.rstrip().decode('utf-8', 'replace'))
+                percents = PERCENT.findall(line)
+                if(percents):
+                    self.percent = float(percents[-1])
+        self.process.stdout.close()
+        if(self.on_exit):
+            self.on_exit(self)
+
+    def add_timer(self, seconds, function, *params):
+        timer = threading.Timer(seconds, function, params)
+        timer.daemon = True
+        timer.start()
+        self.timers.append(timer)
+
+    def send(self, sig):
+        try:
+            os.killpg(self.process.pid, sig)
+        except OSError:
+            pass
+
+    def cancel(self, reason='cancelled'):
+        """Stop the program, from any thread."""
+        if(self.reason or self.process.returncode is not None):
+            return
+        self.reason = reason
+        self.send(signal.SIGTERM)
+        self.add_timer(KILL_GRACE, self.send, signal.SIGKILL)
+
+    def finish(self):
+        for timer in self.timers:
+            timer.cancel()
+            if(timer is not threading.current_thread()):
+                timer.join()
+        if(self.reason):
+            # children of a stopped program that outlived it
+            self.send(signal.SIGKILL)
+        self.reader.join(READ_GRACE)
+
+    def poll(self):
+        """Exit code of the program, None while it runs."""
+        retCode = self.waiter.poll()
+        if(retCode is not None):
+            self.finish()
+        return retCode
+
+    def wait(self):
+        """Wait for the program and return its exit code, it is stopped if the wait is."""
+        try:
+            retCode = self.waiter.wait()
+        except BaseException:
+            self.cancel('stopped')
+            raise
+        self.finish()
+        return retCode
+
+    def describe(self):
+        progress = format_seconds(time.time() - self.start)
+        if(self.percent is not None):
+            progress = '%.0f%%, %s' % (self.percent, progress)
+        return '%s (%s)' % (self.name, progress)
+
+
+class CommandGroup(object):
+    """Programs of a stage, run by one or more threads, with their logs in log_dir."""
+
+    def __init__(self, log_dir, limit=None, metrics=None, timeouts=None, resources=None,
+                 run_name=None):
+        self.log_dir = log_dir
+        self.metrics = metrics
+        self.timeouts = timeouts or {}
+        self.resources = resources
+        self.run_name = run_name
+        self.slots = threading.BoundedSemaphore(limit) if limit else None
+        self.running = []
+        self.lock = threading.Lock()
+        self.exited = threading.Event()
+        self.cancelled = None
+        self.last_progress = time.time()
+
+    def start(self, cl, name, stage, **options):
+        """Start a program of the stage and return its Command."""
+        command = Command(
+            cl, name, self.get_log(name), timeout=self.timeouts.get(stage), metrics=self.metrics,
+            stage=stage, on_exit=lambda command: self.exited.set(), **options)
+        with self.lock:
+            self.running.append(command)
+        return command
+
+    def get_log(self, name):
+        return os.path.join(self.log_dir, '%s.log' % re.sub('[^\\w.-]+', '_', name))
+
+    def done(self, command, retCode):
+        with self.lock:
+            if(command in self.running):
+                self.running.remove(command)
+        if(command.reason):
+            print('%s %s' % (command.name, command.reason))
+        if(retCode != 0 and command.tail):
+            print('end of %s:' % command.log)
+            for line in command.tail:
+                print('    %s' % line)
+        return retCode
+
+    def poll(self, command):
+        """Exit code of a started program, None while it runs."""
+        retCode = command.poll()
+        if(retCode is None):
+            return None
+        return self.done(command, retCode)
+
+    def wait_any(self, timeout):
+        """Wait until a program ends its output or for timeout seconds."""
+        self.exited.wait(timeout)
+        self.exited.clear()
+
+    def run(self, cl, name, stage, profile=None, **options):
+        """Run a program of the stage in a free slot and return its exit code.
+
+        profile is what it asks of the shared resources, if there are any.
+        """
+        return self.run_command(cl, name, stage, profile, **options)[0]
+
+    def run_command(self, cl, name, stage, profile=None, **options):
+        """Run a program as run does and return its exit code and the reason it
+        was stopped (timed out, cancelled), None when it exited by itself."""
+        if(self.slots):
+            self.slots.acquire()
+        try:
+            request = None
+            if(self.resources and profile):
+                request = self.resources.acquire(self.run_name, profile)
+            try:
+                if(self.cancelled):
+                    print('%s not started, %s' % (name, self.cancelled))
+                    return CANCELLED, self.cancelled
+                command = self.start(cl, name, stage, **options)
+                return self.done(command, command.wait()), command.reason
+            finally:
+                if(request):
+                    self.resources.release(request)
+        finally:
+            if(self.slots):
+                self.slots.release()
+
+    def cancel(self, reason='cancelled'):
+        """Stop the running programs, the ones not started yet will not start."""
+        self.cancelled = reason
+        with self.lock:
+            running = list(self.running)
+        for command in running:
+            command.cancel(reason)
+
+    def print_progress(self, interval):
+        """Print the running programs every interval seconds."""
+        if(time.time() - self.last_progress < interval):
+            return
+        self.last_progress = time.time()
+        with self.lock:
+            running = list(self.running)
+        if(running):
+            print('running %s' % ', '.join(command.describe() for command in running))
@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Native replacement for the three FastQC modules used by the report:
+#   - Per base sequence quality   (Images/per_base_quality.png)
+#   - Per sequence quality scores (Images/per_sequence_quality.png)
+#   - Per base sequence content   (Images/per_base_sequence_content.png)
+#
+# The gzipped FASTQ files are streamed in batches of records (decompressed
+# with several processes by fastq_reader when possible) and every batch
+# is turned into NumPy arrays, so the memory used does not depend on the size
+# of the files. The output folder follows the FastQC layout
+# (<name>_fastqc.html and <name>_fastqc/{Images,fastqc_data.txt}) so
+# compile_tex can use it without changes. The modules are graded pass, warn
+# or fail with the default thresholds of FastQC (its limits.txt).
+#
+# Execution:
+#   python fastq_qc.py --casava -t 4 -o OUTDIR L1_L001_R1_001.fastq.gz ...
+
+import argparse
+import os
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+from fastq_reader import iter_chunks
+
+
+ENGINE_VERSION = 'native-0.1'
+# number of records analysed at once
+BATCH_SIZE = 50000
+PHRED_OFFSET = 33
+# Phred scores above this value are counted as this value
+MAX_QUALITY = 60
+BASES = 'GATC'
+# (warn, error) thresholds of FastQC limits.txt for the modules written
+QUALITY_BASE_LOWER = (10, 5)
+QUALITY_BASE_MEDIAN = (25, 20)
+QUALITY_SEQUENCE = (27, 20)
+SEQUENCE_CONTENT = (10, 20)
+STATUSES = ['pass', 'warn', 'fail']
+# FastQC background colours for the quality plot
+QUALITY_BANDS = [(0, 20, '#e6afaf'), (20, 28, '#e6dcaf'), (28, MAX_QUALITY, '#afe6af')]
+
+# A, C, G, T map to their index in BASES, everything else is an N (4)
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for i, base in enumerate(BASES):
+    BASE_CODES[ord(base)] = i
+    BASE_CODES[ord(base.lower())] = i
+
+
+def iter_batches(paths, batch_size=BATCH_SIZE, workers=1):
+    """Yield (sequences, qualities) lists of at most batch_size records."""
+    sequences = []
+    qualities = []
+    pending = []
+
+    for path in paths:
+        for lines in iter_chunks(path, workers):
+            if(pending):
+                lines = pending + lines
+            complete = len(lines) - len(lines) % 4
+            pending = lines[complete:]
+
+            sequences.extend(lines[1:complete:4])
+            qualities.extend(lines[3:complete:4])
+
+            while(len(sequences) >= batch_size):
+                yield sequences[:batch_size], qualities[:batch_size]
+                sequences = sequences[batch_size:]
+                qualities = qualities[batch_size:]
+
+    if(sequences):
+        yield sequences, qualities
+
+
+def to_matrices(sequences, qualities):
+    """Group the records by length and yield (bases, phred) uint8 matrices."""
+    lengths = OrderedDict([])
+    for i, quality in enumerate(qualities):
+        lengths.setdefault(len(quality), []).append(i)
+
+    for length, index in lengths.items():
+        if(length == 0):
+            continue
+        if(len(index) == len(qualities)):
+            seqs, quals = sequences, qualities
+        else:
+            seqs = [sequences[i] for i in index]
+            quals = [qualities[i] for i in index]
+
+        phred = np.frombuffer(b''.join(quals), dtype=np.uint8).reshape(len(index), length)
+        bases = np.frombuffer(b''.join(seqs), dtype=np.uint8).reshape(len(index), length)
+
+        yield BASE_CODES[bases], phred - PHRED_OFFSET
+
+
+class QualityStats(object):
+    """Per position quality and base counts of a group of FASTQ files."""
+
+    def __init__(self):
+        self.reads = 0
+        self.min_length = 0
+        self.max_length = 0
+        self.quality = np.zeros((0, MAX_QUALITY + 1), dtype=np.int64)
+        self.bases = np.zeros((0, len(BASES) + 1), dtype=np.int64)
+        self.mean_quality = np.zeros(MAX_QUALITY + 1, dtype=np.int64)
+
+    def _grow(self, length):
+        if(length <= self.quality.shape[0]):
+            return
+        extra = length - self.quality.shape[0]
+        self.quality = np.vstack([
+            self.quality, np.zeros((extra, self.quality.shape[1]), dtype=np.int64)])
+        self.bases = np.vstack([
+            self.bases, np.zeros((extra, self.bases.shape[1]), dtype=np.int64)])
+
+    def add(self, sequences, qualities):
+        for bases, phred in to_matrices(sequences, qualities):
+            nreads, length = phred.shape
+            self._grow(length)
+
+            phred = np.minimum(phred, MAX_QUALITY).astype(np.intp)
+            position = np.arange(length, dtype=np.intp) * (MAX_QUALITY + 1)
+            counts = np.bincount(
+                (phred + position).ravel(), minlength=length * (MAX_QUALITY + 1))
+            self.quality[:length] += counts.reshape(length, MAX_QUALITY + 1)
+
+            position = np.arange(length, dtype=np.intp) * (len(BASES) + 1)
+            counts = np.bincount(
+                (bases.astype(np.intp) + position).ravel(), minlength=length * (len(BASES) + 1))
+            self.bases[:length] += counts.reshape(length, len(BASES) + 1)
+
+            means = phred.mean(axis=1).astype(np.intp)
+            self.mean_quality += np.bincount(means, minlength=MAX_QUALITY + 1)
+
+            if(not self.reads or length < self.min_length):
+                self.min_length = length
+            self.max_length = max(self.max_length, length)
+            self.reads += nreads
+
+    def percentiles(self, fractions):
+        """Per position quality at the given fractions of the distribution."""
+        cumulative = np.cumsum(self.quality, axis=1)
+        total = cumulative[:, -1:].astype(np.float64)
+        total[total == 0] = 1
+        result = []
+        for fraction in fractions:
+            result.append(np.argmax(cumulative / total >= fraction, axis=1))
+        return result
+
+    def mean_per_position(self):
+        total = self.quality.sum(axis=1).astype(np.float64)
+        total[total == 0] = 1
+        return (self.quality * np.arange(MAX_QUALITY + 1)).sum(axis=1) / total
+
+    def base_content(self):
+        """Percentage of G, A, T and C per position, ignoring the Ns."""
+        acgt = self.bases[:, :len(BASES)].astype(np.float64)
+        total = acgt.sum(axis=1)
+        total[total == 0] = 1
+        return 100.0 * acgt / total[:, None]
+
+    def gc_content(self):
+        acgt = self.bases[:, :len(BASES)].sum()
+        if(not acgt):
+            return 0
+        return int(round(
+            100.0 * (self.bases[:, BASES.index('G')].sum() +
+                     self.bases[:, BASES.index('C')].sum()) / acgt))
+
+
+def worst(*statuses):
+    return max(statuses, key=STATUSES.index)
+
+
+def grade_below(value, limits):
+    """Status of a value that warns or fails below its limits."""
+    warn, error = limits
+    if(value < error):
+        return 'fail'
+    if(value < warn):
+        return 'warn'
+    return 'pass'
+
+
+def get_statuses(stats):
+    """Status of each module, graded as FastQC does.
+
+    Per base sequence quality: the lowest lower quartile and median of the
+    positions. Per sequence quality scores: the most frequent mean quality,
+    failing at the error threshold too. Per base sequence content: the
+    largest difference between A and T or G and C at a position. A group
+    without reads fails them.
+    """
+    statuses = OrderedDict([('Basic Statistics', 'pass')])
+    if(not stats.reads):
+        for module in ['Per base sequence quality', 'Per sequence quality scores',
+                       'Per base sequence content']:
+            statuses[module] = 'fail'
+        return statuses
+
+    p25, p50 = stats.percentiles([0.25, 0.5])
+    statuses['Per base sequence quality'] = worst(
+        grade_below(p25[:stats.max_length].min(), QUALITY_BASE_LOWER),
+        grade_below(p50[:stats.max_length].min(), QUALITY_BASE_MEDIAN))
+
+    mode = int(np.argmax(stats.mean_quality))
+    warn, error = QUALITY_SEQUENCE
+    statuses['Per sequence quality scores'] = (
+        'fail' if mode <= error else 'warn' if mode <= warn else 'pass')
+
+    content = stats.base_content()[:stats.max_length]
+    g, a, t, c = [content[:, i] for i in range(len(BASES))]
+    difference = max(np.abs(a - t).max(), np.abs(g - c).max())
+    warn, error = SEQUENCE_CONTENT
+    statuses['Per base sequence content'] = (
+        'fail' if difference > error else 'warn' if difference > warn else 'pass')
+
+    return statuses
+
+
+def analyse(paths, batch_size=BATCH_SIZE, workers=1):
+    stats = QualityStats()
+    for sequences, qualities in iter_batches(paths, batch_size, workers):
+        stats.add(sequences, qualities)
+    return stats
+
+
+def write_data(stats, name, path):
+    """Write the analysed modules in the fastqc_data.txt format."""
+    mean = stats.mean_per_position()
+    p10, p25, p50, p75, p90 = stats.percentiles([0.1, 0.25, 0.5, 0.75, 0.9])
+    content = stats.base_content()
+    statuses = get_statuses(stats)
+
+    out = open(path, 'w')
+    out.write('##FastQC\t%s\n' % ENGINE_VERSION)
+
+    out.write('>>Basic Statistics\t%s\n' % statuses['Basic Statistics'])
+    out.write('#Measure\tValue\n')
+    out.write('Filename\t%s\n' % name)
+    out.write('File type\tConventional base calls\n')
+    out.write('Encoding\tSanger / Illumina 1.9\n')
+    out.write('Total Sequences\t%d\n' % stats.reads)
+    if(stats.min_length == stats.max_length):
+        out.write('Sequence length\t%d\n' % stats.max_length)
+    else:
+        out.write('Sequence length\t%d-%d\n' % (stats.min_length, stats.max_length))
+    out.write('%%GC\t%d\n' % stats.gc_content())
+    out.write('>>END_MODULE\n')
+
+    out.write('>>Per base sequence quality\t%s\n' % statuses['Per base sequence quality'])
+    out.write('#Base\tMean\tMedian\tLower Quartile\tUpper Quartile\t'
+              '10th Percentile\t90th Percentile\n')
+    for i in range(stats.max_length):
+        out.write('%d\t%s\t%.1f\t%.1f\t%.1f\t%.1f\t%.1f\n' % (
+            i + 1, repr(float(mean[i])), p50[i], p25[i], p75[i], p10[i], p90[i]))
+    out.write('>>END_MODULE\n')
+
+    out.write('>>Per sequence quality scores\t%s\n' % statuses['Per sequence quality scores'])
+    out.write('#Quality\tCount\n')
+    for quality in np.nonzero(stats.mean_quality)[0]:
+        out.write('%d\t%.1f\n' % (quality, stats.mean_quality[quality]))
+    out.write('>>END_MODULE\n')
+
+    out.write('>>Per base sequence content\t%s\n' % statuses['Per base sequence content'])
+    out.write('#Base\tG\tA\tT\tC\n')
+    for i in range(stats.max_length):
+        out.write('%d\t%s\n' % (i + 1, '\t'.join(repr(float(v)) for v in content[i])))
+    out.write('>>END_MODULE\n')
+
+    out.close()
+
+
+def write_images(stats, images_dir):
+    # matplotlib is only needed to draw the plots
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    positions = np.arange(1, stats.max_length + 1)
+
+    # Per base sequence quality
+    mean = stats.mean_per_position()
+    p10, p25, p50, p75, p90 = stats.percentiles([0.1, 0.25, 0.5, 0.75, 0.9])
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for low, high, colour in QUALITY_BANDS:
+        ax.axhspan(low, high, color=colour, zorder=0)
+    ax.bar(positions, p75 - p25, bottom=p25, width=0.8, color='#ffff00',
+           edgecolor='#000000', linewidth=0.3, zorder=2)
+    ax.vlines(positions, p10, p25, linewidth=0.5, zorder=1)
+    ax.vlines(positions, p75, p90, linewidth=0.5, zorder=1)
+    ax.hlines(p50, positions - 0.4, positions + 0.4, color='#ff0000', zorder=3)
+    ax.plot(positions, mean, color='#0000ff', zorder=4)
+    ax.set_xlim(0.5, stats.max_length + 0.5)
+    ax.set_ylim(0, max(40, int(p90.max()) + 2 if stats.reads else 40))
+    ax.set_title('Quality scores across all bases (Sanger / Illumina 1.9 encoding)')
+    ax.set_xlabel('Position in read (bp)')
+    fig.savefig(os.path.join(images_dir, 'per_base_quality.png'), dpi=100)
+    plt.close(fig)
+
+    # Per sequence quality scores
+    fig, ax = plt.subplots(figsize=(8, 6))
+    ax.plot(np.arange(MAX_QUALITY + 1), stats.mean_quality, color='#ff0000')
+    qualities = np.nonzero(stats.mean_quality)[0]
+    if(len(qualities)):
+        ax.set_xlim(qualities[0], qualities[-1])
+    ax.set_title('Quality score distribution over all sequences')
+    ax.set_xlabel('Mean Sequence Quality (Phred Score)')
+    fig.savefig(os.path.join(images_dir, 'per_sequence_quality.png'), dpi=100)
+    plt.close(fig)
+
+    # Per base sequence content
+    content = stats.base_content()
+    colours = {'G': '#000000', 'A': '#00ff00', 'T': '#ff0000', 'C': '#0000ff'}
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for i, base in enumerate(BASES):
+        ax.plot(positions, content[:, i], color=colours[base], label='%%%s' % base)
+    ax.set_ylim(0, 100)
+    ax.set_xlim(1, max(1, stats.max_length))
+    ax.legend(loc='upper right')
+    ax.set_title('Sequence content across all bases')
+    ax.set_xlabel('Position in read (bp)')
+    fig.savefig(os.path.join(images_dir, 'per_base_sequence_content.png'), dpi=100)
+    plt.close(fig)
+
+
+def write_report(stats, name, outdir):
+    report_dir = os.path.join(outdir, '%s_fastqc' % name)
+    images_dir = os.path.join(report_dir, 'Images')
+    if(not os.path.exists(images_dir)):
+        os.makedirs(images_dir)
+
+    write_data(stats, name, os.path.join(report_dir, 'fastqc_data.txt'))
+    write_images(stats, images_dir)
+
+    html = open(os.path.join(outdir, '%s_fastqc.html' % name), 'w')
+    html.write('<html><head><title>%s</title></head><body>\n' % name)
+    html.write('<h1>%s (%s)</h1>\n' % (name, ENGINE_VERSION))
+    for image in ['per_base_quality', 'per_sequence_quality', 'per_base_sequence_content']:
+        html.write('<img src="%s_fastqc/Images/%s.png"/>\n' % (name, image))
+    html.write('</body></html>\n')
+    html.close()
+
+    return report_dir
+
+
+def get_groups(paths, casava):
+    """Group the files like FastQC: one per file or one per casava basename."""
+    groups = OrderedDict([])
+    for path in paths:
+        name = os.path.basename(path)
+        if(casava):
+            name = re.sub('_\\d{3}\\.fastq(\\.gz)?$', '', name)
+        else:
+            name = re.sub('\\.gz$', '', name)
+            name = re.sub('\\.(fastq|fq)$', '', name)
+        groups.setdefault(name, []).append(path)
+    return groups
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Native FastQC quality plots')
+
+    parser.add_argument(
+        'files', nargs='+', help='FASTQ files, gzipped or not')
+    parser.add_argument(
+        '--version', '-v', action='version', version=ENGINE_VERSION)
+    parser.add_argument(
+        '--outdir', '-o',
+        default=None, help='Output folder (default: folder of each file)')
+    parser.add_argument(
+        '--casava', action='store_true',
+        help='Merge the files of a casava group in one report')
+    parser.add_argument(
+        '--threads', '-t', type=int,
+        default=1, help='Processes used to decompress the files (default: %(default)s)')
+    parser.add_argument(
+        '--batchSize', '-b', type=int,
+        default=BATCH_SIZE, help='Records analysed at once (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    for name, paths in get_groups(args.files, args.casava).items():
+        outdir = args.outdir or os.path.dirname(os.path.abspath(paths[0]))
+        stats = analyse(paths, args.batchSize, args.threads)
+        write_report(stats, name, outdir)
+        print('analysed %s: %d reads' % (name, stats.reads))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+# Reads gzipped FASTQ files using several cores.
+#
+# A gzip stream can only be decompressed from the start of a member, so the
+# file is split at member boundaries: BGZF files (bgzip) carry the size of
+# each block in the header. The boundaries of other gzip files are only known
+# once they are decompressed, so they are read by a single stream the first
+# time, which records where its members start. The boundaries are grouped in
+# chunks of about CHUNK_SIZE compressed bytes and saved next to the file
+# (<file>.blocks), and the next reads of a multi-member file (cat *.gz,
+# pigz -i) are split. The chunks are decompressed by a pool of processes and
+# glued back in order, and the caller gets lists of lines that always end at
+# the end of a FASTQ record.
+#
+# Plain single-member gzip files can not be split and are always read by a
+# single stream.
+
+import json
+import os
+import struct
+import zlib
+import multiprocessing
+
+
+# bytes read from the compressed file at once
+READ_SIZE = 4 * 1024 * 1024
+# compressed bytes handed to a worker at once
+CHUNK_SIZE = 16 * 1024 * 1024
+BLOCK_INDEX_SUFFIX = '.blocks'
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def scan_bgzf(f):
+    """Return the offsets of the BGZF blocks or None if f is not BGZF."""
+    offsets = []
+    offset = 0
+    while(True):
+        f.seek(offset)
+        header = f.read(12)
+        if(not header):
+            return offsets
+        if(len(header) < 12 or header[:2] != GZIP_MAGIC or not ord(header[3:4]) & 4):
+            return None
+
+        xlen = struct.unpack('<H', header[10:12])[0]
+        extra = f.read(xlen)
+        bsize = None
+        i = 0
+        while(i + 4 <= len(extra)):
+            slen = struct.unpack('<H', extra[i + 2:i + 4])[0]
+            if(extra[i:i + 2] == b'BC' and slen == 2):
+                bsize = struct.unpack('<H', extra[i + 4:i + 6])[0]
+                break
+            i += 4 + slen
+        if(bsize is None):
+            return None
+
+        offsets.append(offset)
+        offset += bsize + 1
+
+
+def get_chunks(offsets, size):
+    """Group member offsets in (start, end) ranges of about CHUNK_SIZE bytes."""
+    chunks = []
+    start = 0
+    for offset in offsets[1:]:
+        if(offset - start >= CHUNK_SIZE):
+            chunks.append((start, offset))
+            start = offset
+    chunks.append((start, size))
+    return chunks
+
+
+def save_block_index(path, st, offsets, bgzf):
+    """Save the chunks of the member offsets of a file and return them."""
+    chunks = get_chunks(offsets, st.st_size)
+
+    index = {
+        'size': st.st_size,
+        'mtime': int(st.st_mtime),
+        'bgzf': bgzf,
+        'chunks': chunks}
+    try:
+        tmp = '%s.%d' % (path + BLOCK_INDEX_SUFFIX, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.rename(tmp, path + BLOCK_INDEX_SUFFIX)
+    except (IOError, OSError):
+        # read only folder, the index is only kept for this read
+        pass
+
+    return chunks
+
+
+def get_block_index(path):
+    """Return the chunks of a gzip file, None when they are not known yet.
+
+    They are known for BGZF files and for the files read once by iter_stream
+    with index set.
+    """
+    path = os.path.realpath(path)
+    index_path = path + BLOCK_INDEX_SUFFIX
+    st = os.stat(path)
+
+    if(os.path.exists(index_path)):
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            if(index['size'] == st.st_size and index['mtime'] == int(st.st_mtime)):
+                return [tuple(chunk) for chunk in index['chunks']]
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    # only the headers are read, a file that is not BGZF stops at the first one
+    with open(path, 'rb') as f:
+        offsets = scan_bgzf(f)
+    if(offsets is None):
+        return None
+
+    return save_block_index(path, st, offsets, True)
+
+
+def decompress_range(task):
+    """Decompress the members found between two offsets of a file."""
+    path, start, end = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    out = []
+    while(data):
+        decompressor = zlib.decompressobj(31)
+        out.append(decompressor.decompress(data))
+        out.append(decompressor.flush())
+        data = decompressor.unused_data
+        if(not data.startswith(GZIP_MAGIC)):
+            break
+    return b''.join(out)
+
+
+def iter_stream(path, index=False):
+    """Yield the decompressed data of a file with a single stream.
+
+    With index the offsets of its gzip members are saved once it is read to
+    the end, so the next reads can split it.
+    """
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    f = open(path, 'rb')
+    try:
+        magic = f.read(2)
+        f.seek(0)
+        decompressor = zlib.decompressobj(31) if magic == GZIP_MAGIC else None
+        offsets = [0]
+        fed = 0
+
+        while(True):
+            chunk = f.read(READ_SIZE)
+            if(not chunk):
+                break
+            fed += len(chunk)
+
+            if(decompressor):
+                data = decompressor.decompress(chunk)
+                # concatenated gzip members (bgzip, cat *.gz)
+                while(decompressor.unused_data):
+                    unused = decompressor.unused_data
+                    if(len(unused) >= 2 and not unused.startswith(GZIP_MAGIC)):
+                        # trailing garbage after the last member
+                        break
+                    offsets.append(fed - len(unused))
+                    decompressor = zlib.decompressobj(31)
+                    data += decompressor.decompress(unused)
+                yield data
+            else:
+                yield chunk
+
+        if(decompressor):
+            yield decompressor.flush()
+            if(index):
+                save_block_index(path, st, offsets, False)
+    finally:
+        f.close()
+
+
+def iter_parallel(path, workers):
+    """Yield the decompressed chunks of a file, in order, using a pool."""
+    chunks = get_block_index(path)
+    if(chunks is None or len(chunks) < 2):
+        for data in iter_stream(path, chunks is None):
+            yield data
+        return
+
+    path = os.path.realpath(path)
+    tasks = [(path, start, end) for start, end in chunks]
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        # keep at most two chunks per worker in memory
+        window = []
+        for task in tasks:
+            window.append(pool.apply_async(decompress_range, (task,)))
+            if(len(window) >= 2 * workers):
+                yield window.pop(0).get()
+        for result in window:
+            yield result.get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def iter_chunks(path, workers=1, index=False):
+    """Yield lists of lines of a FASTQ file ending at a record boundary.
+
+    With index a single stream saves the member offsets of the file.
+    """
+    if(workers > 1):
+        source = iter_parallel(path, workers)
+    else:
+        source = iter_stream(path, index)
+
+    rest = []
+    partial = b''
+    for data in source:
+        if(not data):
+            continue
+        lines = (partial + data).split(b'\n')
+        partial = lines.pop()
+        if(rest):
+            lines = rest + lines
+        complete = len(lines) - len(lines) % 4
+        rest = lines[complete:]
+        if(complete):
+            yield lines[:complete]
+
+    if(partial):
+        rest.append(partial)
+    if(rest):
+        yield rest
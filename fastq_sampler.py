@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Fixed-size sample of the reads of a lane/read, for quick-look reports.
+#
+# The read budget is split between the FASTQ files of the lane/read in
+# proportion to their size, so every sample (and every tile, as bcl2fastq
+# writes them in order) is represented. Files that can be split at gzip
+# member boundaries (BGZF, as bcl2fastq writes them, see fastq_reader) are
+# sampled by decompressing only evenly spaced chunks of the file, enough of
+# them for the budget of the file, so the time does not grow with the depth
+# of the run. The other files are streamed whole through a reservoir
+# (Algorithm L), which keeps a uniform sample in the memory of the budget:
+#   - files of a single chunk (under fastq_reader.CHUNK_SIZE compressed
+#     bytes), whose time is bounded by the chunk size;
+#   - plain single-member gzip files, which can not be read from the
+#     middle: their time still grows with the depth. Stopping the stream
+#     once the budget is met would only sample the first tiles;
+#   - multi-member files that are not BGZF the first time they are read,
+#     the stream saves their member offsets and the next samples are read
+#     by chunks.
+# The method of each file ('chunks' or 'reservoir') is in the information.
+#
+# The sample is written as a single gzipped FASTQ file and a json document
+# with the budget, the reads sampled and the reads of the files (estimated
+# for the files sampled by chunks), which the reports show.
+#
+# Execution:
+#   python fastq_sampler.py --reads 2000000 --output sampled/L1_L001_R1_001.fastq.gz \
+#       --info sampled/L1_L001_R1.json L1_L001_R1_001.fastq.gz L1_L001_R1_002.fastq.gz
+
+import argparse
+import gzip
+import io
+import json
+import math
+import os
+import random
+from collections import OrderedDict
+
+from fastq_reader import decompress_range, get_block_index, iter_chunks
+
+
+# name of the sample information in the FastQC report folder
+SAMPLE_INFO = 'sampled.json'
+# approximate memory taken by a read kept in the reservoir
+READ_MEMORY = 400
+# chunks read of a file at least, so a small budget still covers all of it
+SPREAD_CHUNKS = 8
+
+
+def get_budgets(paths, reads):
+    """Reads to sample of each file, in proportion to their sizes."""
+    sizes = [os.path.getsize(path) for path in paths]
+    total = sum(sizes)
+    if(not total):
+        return [reads // len(paths) if paths else 0 for path in paths]
+
+    shares = [reads * float(size) / total for size in sizes]
+    budgets = [int(share) for share in shares]
+    # the reads left by the rounding go to the largest remainders
+    left = reads - sum(budgets)
+    for i in sorted(range(len(paths)), key=lambda i: budgets[i] - shares[i])[:left]:
+        budgets[i] += 1
+    return budgets
+
+
+class Reservoir(object):
+    """Uniform sample of size records of a stream of FASTQ records.
+
+    Algorithm L: after the reservoir is full, the number of records to skip
+    before the next one kept is drawn at once, so most of the records are
+    never looked at.
+    """
+
+    def __init__(self, size, rnd):
+        self.size = size
+        self.rnd = rnd
+        self.records = []
+        self.seen = 0
+        self.weight = 1.0
+        self.next = None
+
+    def uniform(self):
+        """Random number in (0, 1)."""
+        while(True):
+            u = self.rnd.random()
+            if(u > 0):
+                return u
+
+    def skip(self, position):
+        """Position of the next record to keep, after the one at position."""
+        self.weight *= math.exp(math.log(self.uniform()) / self.size)
+        self.next = position + 1 + int(math.floor(
+            math.log(self.uniform()) / math.log(1 - self.weight)))
+
+    def add(self, lines):
+        """Add the records of lines, a list of complete 4-line records."""
+        count = len(lines) // 4
+        first = self.seen
+        i = 0
+        while(i < count and len(self.records) < self.size):
+            self.records.append(b'\n'.join(lines[4 * i:4 * i + 4]))
+            i += 1
+            if(len(self.records) == self.size):
+                self.skip(first + i - 1)
+
+        while(self.next is not None and self.next < first + count):
+            i = self.next - first
+            self.records[self.rnd.randrange(self.size)] = b'\n'.join(lines[4 * i:4 * i + 4])
+            self.skip(self.next)
+
+        self.seen += count
+
+
+def get_records(data, first):
+    """Complete records of decompressed data, which may start and end mid-record."""
+    lines = data.split(b'\n')
+    # the last line is cut by the end of the chunk, or empty
+    lines.pop()
+    start = 0
+    if(not first):
+        # a header is followed by the sequence and the + line
+        start = len(lines)
+        for i in range(len(lines) - 2):
+            if(lines[i].startswith(b'@') and lines[i + 2].startswith(b'+')):
+                start = i
+                break
+    lines = lines[start:]
+    return lines[:len(lines) - len(lines) % 4]
+
+
+def sample_stream(path, reads, rnd, index=False):
+    """Sample a file read from the start to the end. Returns the records and the reads.
+
+    With index the member offsets of the file are saved, so a multi-member
+    file is sampled by chunks the next time.
+    """
+    reservoir = Reservoir(reads, rnd)
+    for lines in iter_chunks(path, index=index):
+        reservoir.add(lines[:len(lines) - len(lines) % 4])
+    return reservoir.records, reservoir.seen
+
+
+def sample_chunks(path, chunks, reads, rnd):
+    """Sample evenly spaced chunks of a file. Returns the records and the estimated reads."""
+    lines = get_records(decompress_range((path, chunks[0][0], chunks[0][1])), True)
+    per_chunk = max(1, len(lines) // 4)
+    # twice the chunks the budget needs, so a chunk does not weigh more than its share
+    count = min(len(chunks), max(SPREAD_CHUNKS, int(math.ceil(2.0 * reads / per_chunk))))
+
+    reservoir = Reservoir(reads, rnd)
+    reservoir.add(lines)
+    for n in range(1, count):
+        start, end = chunks[n * len(chunks) // count]
+        reservoir.add(get_records(decompress_range((path, start, end)), False))
+
+    return reservoir.records, int(round(reservoir.seen * float(len(chunks)) / count))
+
+
+def sample_files(paths, reads, output, seed=0):
+    """Write in output a sample of reads records of the files and return its information."""
+    rnd = random.Random(seed)
+    info = OrderedDict([
+        ('reads', reads),
+        ('sampled_reads', 0),
+        ('total_reads', 0),
+        ('estimated', False),
+        ('files', [])])
+
+    tmp = '%s.%d' % (output, os.getpid())
+    out = gzip.open(tmp, 'wb', 1)
+    try:
+        for path, budget in zip(paths, get_budgets(paths, reads)):
+            path = os.path.realpath(path)
+            if(budget <= 0):
+                continue
+
+            chunks = get_block_index(path)
+            if(chunks and len(chunks) > 1):
+                records, total = sample_chunks(path, chunks, budget, rnd)
+                method = 'chunks'
+            else:
+                records, total = sample_stream(path, budget, rnd, chunks is None)
+                method = 'reservoir'
+
+            if(records):
+                out.write(b'\n'.join(records) + b'\n')
+
+            info['sampled_reads'] += len(records)
+            info['total_reads'] += total
+            info['estimated'] = info['estimated'] or method == 'chunks'
+            info['files'].append(OrderedDict([
+                ('file', os.path.basename(path)),
+                ('method', method),
+                ('sampled_reads', len(records)),
+                ('total_reads', total)]))
+    finally:
+        out.close()
+    os.rename(tmp, output)
+
+    return info
+
+
+def write_info(info, path):
+    tmp = '%s.%d' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(info, f, indent=1)
+    os.rename(tmp, path)
+
+
+def load_info(report_dir):
+    """Sample information of a FastQC report folder, None if it analysed every read."""
+    path = os.path.join(report_dir, SAMPLE_INFO)
+    if(not os.path.exists(path)):
+        return None
+    try:
+        with io.open(path, 'r', encoding='utf-8') as f:
+            return json.load(f, object_pairs_hook=OrderedDict)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Sample the reads of FASTQ files')
+
+    parser.add_argument(
+        'files', nargs='+', help='gzipped FASTQ files of a lane/read')
+    parser.add_argument(
+        '--reads', '-n', type=int, required=True,
+        help='Reads of the sample, spread across the files')
+    parser.add_argument(
+        '--output', '-o', required=True, help='gzipped FASTQ file of the sample')
+    parser.add_argument(
+        '--info', '-i', default=None, help='json file with the sample information')
+    parser.add_argument(
+        '--seed', type=int, default=0, help='Seed of the sample (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    info = sample_files(args.files, args.reads, args.output, args.seed)
+    if(args.info):
+        write_info(info, args.info)
+    print('sampled %d of %d%s reads' % (
+        info['sampled_reads'], info['total_reads'], ' (estimated)' if info['estimated'] else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Columnar store of the FastQC metrics of a run.
+#
+# Every module of fastqc_data.txt (Basic Statistics, per base quality, GC
+# content, duplication levels, overrepresented sequences, ...) becomes a
+# Table with a NumPy array per column: numeric columns are int64 or
+# float64, the others (base ranges as 10-14, sequences) unicode. The '#'
+# lines of a module before its column header, as
+# #Total Deduplicated Percentage, are kept as attributes.
+#
+# The tables of all the lanes/reads of a run are saved in a single
+# compressed .npz file, one array per <unit>/<module>/<column> plus a json
+# document with the module results, column order and attributes, and can
+# be loaded back without FastQC or parsing text.
+#
+# Execution:
+#   python fastqc_metrics.py RUN/fastqc_metrics.npz [--unit L001-R1] [--module 'Per base sequence quality']
+
+import argparse
+import io
+import json
+import os
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+
+META_KEY = '__meta__'
+INTEGER = re.compile('-?\\d+\\Z')
+
+
+class Table(object):
+    """A FastQC module: its result, attributes and columns."""
+
+    __slots__ = ('name', 'status', 'attributes', 'columns')
+
+    def __init__(self, name, status, attributes=None, columns=None):
+        self.name = name
+        self.status = status
+        self.attributes = attributes or OrderedDict([])
+        self.columns = columns or OrderedDict([])
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __len__(self):
+        for values in self.columns.values():
+            return len(values)
+        return 0
+
+    def rows(self):
+        return zip(*self.columns.values())
+
+
+def to_array(values):
+    """Array of the values of a column, numeric when they all are numbers."""
+    if(values and all(INTEGER.match(v) for v in values)):
+        return np.array([int(v) for v in values], dtype=np.int64)
+    try:
+        return np.array([float(v) for v in values], dtype=np.float64)
+    except ValueError:
+        return np.array(values, dtype='U')
+
+
+def parse_fastqc_data(path):
+    """Tables of the modules of a fastqc_data.txt, by module name."""
+    tables = OrderedDict([])
+
+    def close(table, comments, rows):
+        # the last comment is the column header, the others attributes
+        header = comments.pop() if comments else []
+        for comment in comments:
+            table.attributes[comment[0]] = comment[1] if len(comment) > 1 else ''
+        for i, column in enumerate(header):
+            table.columns[column] = to_array([row[i] if i < len(row) else '' for row in rows])
+
+    table = None
+    with io.open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if(line.startswith('>>END_MODULE')):
+                if(table is not None):
+                    close(table, comments, rows)
+                table = None
+            elif(line.startswith('>>')):
+                parts = line[2:].split('\t')
+                table = Table(parts[0], parts[1] if len(parts) > 1 else '')
+                tables[table.name] = table
+                comments = []
+                rows = []
+            elif(table is None):
+                continue
+            elif(line.startswith('#')):
+                comments.append(line[1:].split('\t'))
+            elif(line):
+                rows.append(line.split('\t'))
+
+    return tables
+
+
+def write_store(path, units):
+    """Save the tables of units ({unit: {module: Table}}) in the .npz at path."""
+    arrays = {}
+    meta = OrderedDict([])
+    for unit, tables in units.items():
+        meta[unit] = OrderedDict([])
+        for name, table in tables.items():
+            meta[unit][name] = OrderedDict([
+                ('status', table.status),
+                ('attributes', table.attributes),
+                ('columns', list(table.columns.keys()))])
+            for column, values in table.columns.items():
+                arrays['%s/%s/%s' % (unit, name, column)] = values
+    arrays[META_KEY] = np.array(json.dumps(meta), dtype='U')
+
+    # np.savez adds .npz to names without it
+    tmp = '%s.%d.npz' % (path, os.getpid())
+    np.savez_compressed(tmp, **arrays)
+    os.rename(tmp, path)
+
+
+def load_store(path):
+    """Tables saved by write_store, as {unit: {module: Table}}."""
+    units = OrderedDict([])
+    with np.load(path) as store:
+        meta = json.loads(u'%s' % store[META_KEY], object_pairs_hook=OrderedDict)
+        for unit, tables in meta.items():
+            units[unit] = OrderedDict([])
+            for name, info in tables.items():
+                table = Table(name, info['status'], info['attributes'])
+                for column in info['columns']:
+                    table.columns[column] = store['%s/%s/%s' % (unit, name, column)]
+                units[unit][name] = table
+    return units
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Print the FastQC metrics saved for a run')
+
+    parser.add_argument('store', help='fastqc_metrics.npz of the run')
+    parser.add_argument('--unit', '-u', help='Lane/read, as L001-R1')
+    parser.add_argument('--module', '-m', help='FastQC module, as "Per base sequence quality"')
+
+    args = parser.parse_args()
+
+    for unit, tables in load_store(args.store).items():
+        if(args.unit and unit != args.unit):
+            continue
+        for name, table in tables.items():
+            if(args.module and name != args.module):
+                continue
+            print('%s\t%s\t%s' % (unit, name, table.status))
+            if(not args.module):
+                continue
+            for key, value in table.attributes.items():
+                print('#%s\t%s' % (key, value))
+            print('\t'.join(table.columns.keys()))
+            for row in table.rows():
+                print('\t'.join('%s' % v for v in row))
+
+
+if __name__ == '__main__':
+    main()
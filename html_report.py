@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+# HTML and JSON versions of the run report.
+#
+# The page has the same content as FastQC_report.tex (run details from the
+# SampleSheet, the bcl2fastq tables and the three FastQC plots of each
+# lane/read) with the images embedded, so it is a single file that opens
+# in any browser. The JSON document has the same data plus the Basic
+# Statistics and the module results of fastqc_data.txt. Nothing here needs
+# TeX, the report is written in a few milliseconds. Lanes analysed on a
+# sample of their reads (--sampleReads) are labelled as sampled.
+
+import base64
+import io
+import json
+import os
+from collections import OrderedDict
+
+import fastq_sampler
+
+try:
+    from html import escape as html_escape
+except ImportError:
+    from cgi import escape as html_escape
+
+
+# plots of the report: (file in Images, caption)
+IMAGES = [
+    ('per_base_quality.png', u'Distribuição de qualidade ao longo dos reads'),
+    ('per_sequence_quality.png', u'Distribuição de qualidade média dos reads'),
+    ('per_base_sequence_content.png', u'Composição média de bases ao longo dos reads'),
+]
+LOGO = 'logo_CEFAP.png'
+
+STYLE = u'''
+body { font-family: sans-serif; font-size: 13px; margin: 2em auto; max-width: 1100px; }
+table { border-collapse: collapse; margin: 1em 0; }
+th, td { border: 1px solid #999; padding: 2px 6px; text-align: left; }
+th.section { background: #eee; text-align: center; }
+figure { margin: 1em 0; }
+figcaption { font-style: italic; }
+.header { display: flex; align-items: center; gap: 2em; }
+'''
+
+
+def text(value):
+    """value as unicode, SampleSheet values are bytes on Python 2."""
+    if(isinstance(value, bytes)):
+        return value.decode('utf-8', 'replace')
+    return u'%s' % (value,)
+
+
+def escape(value):
+    return html_escape(text(value), True)
+
+
+def read_fastqc_data(path):
+    """Basic Statistics and the result of each module of a fastqc_data.txt."""
+    basic = OrderedDict([])
+    modules = OrderedDict([])
+    if(not os.path.exists(path)):
+        return basic, modules
+
+    module = None
+    with io.open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if(line.startswith('>>END_MODULE')):
+                module = None
+            elif(line.startswith('>>')):
+                parts = line[2:].split('\t')
+                module = parts[0]
+                modules[module] = parts[1] if len(parts) > 1 else ''
+            elif(module == 'Basic Statistics' and not line.startswith('#')):
+                parts = line.split('\t')
+                if(len(parts) > 1):
+                    basic[parts[0]] = parts[1]
+
+    return basic, modules
+
+
+def embed_image(path):
+    """data: URI of a png, None if it does not exist."""
+    if(not os.path.exists(path)):
+        return None
+    with open(path, 'rb') as f:
+        return u'data:image/png;base64,' + base64.b64encode(f.read()).decode('ascii')
+
+
+def get_lanes(fastq_path, reports):
+    """(unit, lane, read, folder) of the FastQC reports, in lane/read order."""
+    lanes = []
+    for report in reports:
+        folder = os.path.join(fastq_path, report.split('.', 1)[0])
+        lane = folder.rsplit('_', 3)[1][-1]
+        read = folder.rsplit('_', 2)[1]  # R1 or R2
+        lanes.append(('L00%s-%s' % (lane, read), lane, read, folder))
+    return sorted(lanes)
+
+
+def build_metrics(run_name, sequencer, sheet, bcl2fastq, lanes):
+    """Content of the report as a dict, the JSON document."""
+    metrics = OrderedDict([])
+    metrics['run'] = text(run_name)
+    metrics['sequencer'] = text(sequencer)
+
+    if(sheet):
+        samples = OrderedDict([])
+        samples['header'] = OrderedDict(
+            (text(k), text(v)) for k, v in sheet.header.items())
+        samples['reads'] = sheet.reads
+        samples['settings'] = OrderedDict(
+            (text(k), text(v)) for k, v in sheet.settings.items())
+        samples['columns'] = [text(c) for c in sheet.columns]
+        samples['samples'] = [[text(v) for v in sample.values] for sample in sheet.rows]
+        metrics['samplesheet'] = samples
+
+    tables = OrderedDict([])
+    if(bcl2fastq):
+        for i, head in enumerate(bcl2fastq.get('h2') or []):
+            tb = bcl2fastq.get('table-%i' % i)
+            if(not tb):
+                continue
+            tables[text(head)] = OrderedDict([
+                ('head', [text(v) for v in tb['head']]),
+                ('rows', [[text(v) for v in values]
+                          for key, values in tb.items() if key != 'head'])])
+    metrics['bcl2fastq'] = tables
+
+    fastqc = OrderedDict([])
+    for unit, lane, read, folder in lanes:
+        basic, modules = read_fastqc_data(os.path.join(folder, 'fastqc_data.txt'))
+        fastqc[unit] = OrderedDict([
+            ('lane', int(lane)),
+            ('read', read),
+            ('basic_statistics', basic),
+            ('modules', modules),
+            ('sampled', fastq_sampler.load_info(folder))])
+    metrics['fastqc'] = fastqc
+
+    return metrics
+
+
+def render_table(head, rows, title=None):
+    out = [u'<table>']
+    if(title):
+        out.append(u'<tr><th class="section" colspan="%d">%s</th></tr>' % (
+            max(1, len(head)), escape(title)))
+    if(head):
+        out.append(u'<tr>%s</tr>' % u''.join(u'<th>%s</th>' % escape(v) for v in head))
+    for row in rows:
+        out.append(u'<tr>%s</tr>' % u''.join(u'<td>%s</td>' % escape(v) for v in row))
+    out.append(u'</table>')
+    return u'\n'.join(out)
+
+
+def render_html(metrics, lanes, logo=None):
+    """Self-contained page of the report."""
+    out = [
+        u'<!DOCTYPE html>',
+        u'<html><head><meta charset="utf-8">',
+        u'<title>%s</title>' % escape(metrics['run']),
+        u'<style>%s</style>' % STYLE,
+        u'</head><body>',
+        u'<div class="header">']
+    logo = embed_image(logo) if logo else None
+    if(logo):
+        out.append(u'<img src="%s" height="80">' % logo)
+    out.append(u'<div>Centro de Facilidades de Apoio à Pesquisa<br>'
+               u'Universidade de São Paulo - USP</div></div>')
+    out.append(u'<h1>Relatório da corrida %s</h1>' % escape(metrics['run']))
+
+    samples = metrics.get('samplesheet')
+    if(samples):
+        out.append(u'<h2>Informações técnicas</h2>')
+        out.append(u'<p>Detalhes da corrida realizada no equipamento %s.</p>' % escape(
+            metrics['sequencer']))
+        out.append(render_table([], samples['header'].items(), 'Header'))
+        out.append(render_table([], [[r] for r in samples['reads']], 'Reads'))
+        out.append(render_table([], samples['settings'].items(), 'Settings'))
+        out.append(render_table(samples['columns'], samples['samples'], 'Data'))
+
+    if(metrics['bcl2fastq']):
+        out.append(u'<h2>Relatório da corrida gerado pelo sistema BCL2FASTQ</h2>')
+        for title, table in metrics['bcl2fastq'].items():
+            out.append(render_table(table['head'], table['rows'], title))
+
+    for unit, lane, read, folder in lanes:
+        out.append(u'<h2>Informações selecionadas do FastQC para a LANE %s %s</h2>' % (
+            escape(lane), escape(read)))
+        sampled = metrics['fastqc'][unit]['sampled']
+        if(sampled):
+            out.append(u'<p><b>Relatório por amostragem:</b> as figuras desta seção foram '
+                       u'geradas com %d reads de um total %sde %d reads da lane.</p>' % (
+                           sampled['sampled_reads'], u'estimado ' if sampled['estimated'] else u'',
+                           sampled['total_reads']))
+        basic = metrics['fastqc'][unit]['basic_statistics']
+        if(basic):
+            out.append(render_table([], basic.items()))
+        for image, caption in IMAGES:
+            src = embed_image(os.path.join(folder, 'Images', image))
+            if(src):
+                out.append(u'<figure><img src="%s"><figcaption>%s</figcaption></figure>' % (
+                    src, escape(caption)))
+
+    out.append(u'</body></html>\n')
+    return u'\n'.join(out)
+
+
+def write_report(folder, name, metrics, page):
+    """Write <name>.html and <name>.json in folder and return their paths."""
+    if(not os.path.exists(folder)):
+        os.makedirs(folder)
+
+    paths = []
+    for ext, content in [('html', page), ('json', json.dumps(metrics, indent=1))]:
+        path = os.path.join(folder, '%s.%s' % (name, ext))
+        tmp = '%s.%d' % (path, os.getpid())
+        with io.open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text(content))
+        os.rename(tmp, path)
+        paths.append(path)
+
+    return paths
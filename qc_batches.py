@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# Batches of QC invocations balanced by the bytes they read.
+#
+# FastQC --casava analyses all the files of a lane/read as one group, in a
+# single thread, so a group can not be split and a FastQC with -t N
+# analyses N of its groups at a time. plan_batches packs the groups in
+# batches with the longest processing time first rule on their size in
+# bytes (each group, largest first, goes to the batch with the fewest bytes
+# so far) and gives each batch a share of the cores in proportion to its
+# bytes, never more threads than it has groups, so the batches end at about
+# the same time. There are as many batches as FastQC of BATCH_THREADS
+# threads fit in the cores, and more when the arguments of a batch do not
+# fit in what exec accepts (ARG_MAX less the environment). A group whose
+# arguments alone do not fit raises ArgumentsTooLong, exec would fail with
+# E2BIG.
+
+import heapq
+import os
+
+
+# threads of a FastQC batch, a JVM reserving 250 MB of heap for each one
+BATCH_THREADS = 4
+# ARG_MAX when the system does not tell it, and what is kept free of it
+DEFAULT_ARG_MAX = 128 * 1024
+ARG_MARGIN = 4096
+# exec also counts the pointer to every argument and variable
+POINTER_SIZE = 8
+
+
+class ArgumentsTooLong(ValueError):
+    """The arguments of a group alone do not fit in what exec accepts."""
+
+    def __init__(self, index, size, limit):
+        ValueError.__init__(self, 'its arguments take %d bytes, exec accepts %d' % (size, limit))
+        self.index = index
+        self.size = size
+        self.limit = limit
+
+
+def get_arg_limit():
+    """Bytes the arguments of a program can take, ARG_MAX less the environment."""
+    try:
+        arg_max = os.sysconf('SC_ARG_MAX')
+    except (AttributeError, ValueError, OSError):
+        arg_max = -1
+    if(arg_max <= 0):
+        arg_max = DEFAULT_ARG_MAX
+    environment = sum(len(key) + len(value) + 2 + POINTER_SIZE
+                      for key, value in os.environ.items())
+    return max(ARG_MARGIN, arg_max - environment - ARG_MARGIN)
+
+
+def get_arg_size(args):
+    """Bytes exec takes for the arguments args."""
+    return sum(len(arg) + 1 + POINTER_SIZE for arg in args)
+
+
+def lpt_pack(sizes, bins):
+    """Indexes of the items of each bin, the largest items first to the emptiest bin."""
+    heap = [(0, b) for b in range(bins)]
+    packed = [[] for _ in range(bins)]
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+        load, b = heapq.heappop(heap)
+        packed[b].append(i)
+        heapq.heappush(heap, (load + sizes[i], b))
+    return [items for items in packed if items]
+
+
+def split_cores(sizes, cores, caps=None):
+    """Cores of each item in proportion to its size, at least one and at most its cap.
+
+    Every core left after the first one of each item goes to the item with
+    the most bytes per core.
+    """
+    threads = [1] * len(sizes)
+    caps = caps or [cores] * len(sizes)
+    heap = [(-float(size), i) for i, size in enumerate(sizes) if caps[i] > 1]
+    heapq.heapify(heap)
+    for _ in range(cores - len(sizes)):
+        if(not heap):
+            break
+        _, i = heapq.heappop(heap)
+        threads[i] += 1
+        if(threads[i] < caps[i]):
+            heapq.heappush(heap, (-float(sizes[i]) / threads[i], i))
+    return threads
+
+
+def plan_batches(sizes, arg_sizes, cores, fixed_size=0, arg_limit=None):
+    """Batches of the groups of sizes bytes whose arguments take arg_sizes bytes.
+
+    fixed_size is the size of the arguments every batch has besides its
+    groups. Returns (indexes of the groups largest first, threads) of each
+    batch. Raises ArgumentsTooLong for the first group whose arguments alone
+    do not fit.
+    """
+    if(not sizes):
+        return []
+    if(arg_limit is None):
+        arg_limit = get_arg_limit()
+    for i, arg_size in enumerate(arg_sizes):
+        if(fixed_size + arg_size > arg_limit):
+            raise ArgumentsTooLong(i, fixed_size + arg_size, arg_limit)
+
+    count = min(len(sizes), max(1, cores // BATCH_THREADS))
+    while(True):
+        batches = lpt_pack(sizes, count)
+        if(count >= len(sizes) or all(
+                fixed_size + sum(arg_sizes[i] for i in batch) <= arg_limit
+                for batch in batches)):
+            break
+        count += 1
+
+    threads = split_cores([sum(sizes[i] for i in batch) for batch in batches],
+                          max(cores, len(batches)), [len(batch) for batch in batches])
+    return list(zip(batches, threads))
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+# Persistent cache of FastQC results.
+#
+# A result is keyed on the fingerprint of its FASTQ files (size, mtime and a
+# hash of a few blocks sampled from the file) and on the version of the QC
+# tool, so an unchanged lane/read is never analysed twice. The cache folder
+# holds one folder per key with the <name>_fastqc outputs and an index.json
+# with the size and the last use of every entry; the least recently used
+# entries are removed when the cache grows over its size limit. The runs of
+# batch_runs.py are threads of one process and several pipelines can share
+# the cache, so the index is read, changed and written holding a lock of
+# the process and an flock on index.lock (index.json itself is replaced).
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+INDEX_FILE = 'index.json'
+LOCK_FILE = 'index.lock'
+INDEX_LOCK = threading.Lock()
+# bytes hashed at the start, middle and end of each file
+SAMPLE_SIZE = 64 * 1024
+
+
+def fingerprint_file(path):
+    path = os.path.realpath(path)
+    st = os.stat(path)
+
+    sha = hashlib.sha1()
+    sha.update(('%d:%d' % (st.st_size, int(st.st_mtime))).encode('utf-8'))
+    f = open(path, 'rb')
+    try:
+        for offset in set([0, max(0, st.st_size // 2 - SAMPLE_SIZE // 2),
+                           max(0, st.st_size - SAMPLE_SIZE)]):
+            f.seek(offset)
+            sha.update(f.read(SAMPLE_SIZE))
+    finally:
+        f.close()
+
+    return sha.hexdigest()
+
+
+def get_key(name, paths, version):
+    """Key of the result called name for the given files and tool version."""
+    sha = hashlib.sha1()
+    sha.update(('%s\n%s\n' % (name, version)).encode('utf-8'))
+    # the order the files are listed in does not change the result
+    for fingerprint in sorted(fingerprint_file(path) for path in paths):
+        sha.update(fingerprint.encode('utf-8'))
+    return sha.hexdigest()
+
+
+def get_size(path):
+    if(os.path.isfile(path)):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            total += os.path.getsize(os.path.join(root, f))
+    return total
+
+
+def read_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, INDEX_FILE), 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def write_index(cache_dir, index):
+    fd, tmp = tempfile.mkstemp(prefix='.%s.' % INDEX_FILE, dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.rename(tmp, os.path.join(cache_dir, INDEX_FILE))
+    except BaseException:
+        if(os.path.exists(tmp)):
+            os.remove(tmp)
+        raise
+
+
+@contextlib.contextmanager
+def locked(cache_dir):
+    """Hold the index of cache_dir for the threads and processes using it."""
+    with INDEX_LOCK:
+        with open(os.path.join(cache_dir, LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def get_outputs(folder, name):
+    """Files and folders FastQC creates for the result called name."""
+    return [f for f in ['%s_fastqc' % name, '%s_fastqc.html' % name, '%s_fastqc.zip' % name]
+            if os.path.exists(os.path.join(folder, f))]
+
+
+def copy_output(src, dest):
+    if(os.path.isdir(src)):
+        if(os.path.exists(dest)):
+            shutil.rmtree(dest)
+        shutil.copytree(src, dest)
+    else:
+        shutil.copy2(src, dest)
+
+
+def lookup(cache_dir, key, dest):
+    """Copy the cached outputs of key into dest. Returns False on a miss.
+
+    A cache that can not be read is a miss, the result is made again.
+    """
+    if(not os.path.isdir(cache_dir)):
+        return False
+    try:
+        with locked(cache_dir):
+            index = read_index(cache_dir)
+            entry = index.get(key)
+            entry_dir = os.path.join(cache_dir, key)
+            if(not entry or not os.path.isdir(entry_dir)):
+                return False
+
+            for f in os.listdir(entry_dir):
+                copy_output(os.path.join(entry_dir, f), os.path.join(dest, f))
+
+            entry['used'] = time.time()
+            write_index(cache_dir, index)
+    except Exception:
+        return False
+
+    return True
+
+
+def store(cache_dir, key, name, src, max_size):
+    """Save the outputs of the result called name and trim the cache."""
+    outputs = get_outputs(src, name)
+    if(not outputs):
+        return False
+
+    if(not os.path.exists(cache_dir)):
+        os.makedirs(cache_dir)
+
+    # copied aside, out of the lock, and moved in holding it
+    tmp_dir = tempfile.mkdtemp(prefix='.%s.' % key, dir=cache_dir)
+    try:
+        for f in outputs:
+            copy_output(os.path.join(src, f), os.path.join(tmp_dir, f))
+
+        with locked(cache_dir):
+            entry_dir = os.path.join(cache_dir, key)
+            if(os.path.exists(entry_dir)):
+                shutil.rmtree(entry_dir)
+            os.rename(tmp_dir, entry_dir)
+
+            index = read_index(cache_dir)
+            index[key] = {'name': name, 'size': get_size(entry_dir), 'used': time.time()}
+            evict(cache_dir, index, max_size)
+            write_index(cache_dir, index)
+    finally:
+        if(os.path.exists(tmp_dir)):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return True
+
+
+def evict(cache_dir, index, max_size):
+    """Remove the least recently used entries until index fits in max_size bytes."""
+    total = sum(entry['size'] for entry in index.values())
+    for key in sorted(index.keys(), key=lambda k: index[k]['used']):
+        if(total <= max_size):
+            break
+        total -= index[key]['size']
+        del index[key]
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# History of the QC metrics of all the runs, in a SQLite database.
+#
+# Every run processed by RunFastQC adds (or replaces) its row in runs, the
+# FastQC metrics of each lane/read in lane_metrics (with the % >= Q30 bases
+# of the bcl2fastq Stats.json) and the demultiplexing metrics of each sample
+# in sample_metrics. The tables are indexed on
+# sequencer, instrument, run date, lane, read and sample, and
+# lane_rolling keeps for each run the mean of the last ROLLING_WINDOW runs
+# of the same sequencer, lane and read, so trends over years of runs are
+# read without aggregating at query time.
+#
+# Execution:
+#   python qc_history.py --db qc_history.sqlite trend --sequencer nextseq --lane 2 --metric q30 --last 200
+#   python qc_history.py --db qc_history.sqlite sample S1
+#   python qc_history.py --db qc_history.sqlite runs --since 2016-01-01
+
+import argparse
+import os
+import re
+import sqlite3
+import time
+
+
+# number of runs in the rolling means of lane_rolling
+ROLLING_WINDOW = 20
+# metrics of lane_metrics that can be followed with trend
+LANE_METRICS = ['total_sequences', 'mean_quality', 'q30', 'gc', 'failed_modules']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_name TEXT UNIQUE NOT NULL,
+    sequencer TEXT,
+    instrument TEXT,
+    flowcell TEXT,
+    run_date TEXT,
+    added REAL);
+CREATE INDEX IF NOT EXISTS runs_sequencer ON runs (sequencer, run_date);
+CREATE INDEX IF NOT EXISTS runs_instrument ON runs (instrument, run_date);
+CREATE INDEX IF NOT EXISTS runs_date ON runs (run_date);
+
+CREATE TABLE IF NOT EXISTS lane_metrics (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    lane INTEGER NOT NULL,
+    read TEXT NOT NULL,
+    total_sequences INTEGER,
+    mean_quality REAL,
+    q30 REAL,
+    gc REAL,
+    failed_modules INTEGER,
+    PRIMARY KEY (run_id, lane, read));
+CREATE INDEX IF NOT EXISTS lane_metrics_lane ON lane_metrics (lane, read);
+
+CREATE TABLE IF NOT EXISTS sample_metrics (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    lane INTEGER,
+    project TEXT,
+    sample TEXT,
+    barcode TEXT,
+    clusters INTEGER,
+    lane_percent REAL,
+    yield_mbases INTEGER,
+    q30 REAL,
+    mean_quality REAL);
+CREATE INDEX IF NOT EXISTS sample_metrics_run ON sample_metrics (run_id, lane);
+CREATE INDEX IF NOT EXISTS sample_metrics_sample ON sample_metrics (sample);
+CREATE INDEX IF NOT EXISTS sample_metrics_project ON sample_metrics (project);
+
+CREATE TABLE IF NOT EXISTS lane_rolling (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    lane INTEGER NOT NULL,
+    read TEXT NOT NULL,
+    runs INTEGER,
+    total_sequences REAL,
+    mean_quality REAL,
+    q30 REAL,
+    gc REAL,
+    failed_modules REAL,
+    PRIMARY KEY (run_id, lane, read));
+'''
+
+# bcl2fastq table columns of sample_metrics
+SAMPLE_COLUMNS = [
+    ('lane', 'Lane', int),
+    ('project', 'Project', None),
+    ('sample', 'Sample', None),
+    ('barcode', 'Barcode sequence', None),
+    ('clusters', 'PF Clusters', int),
+    ('lane_percent', '% of the lane', float),
+    ('yield_mbases', 'Yield (Mbases)', int),
+    ('q30', '% >= Q30 bases', float),
+    ('mean_quality', 'Mean Quality Score', float),
+]
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=60)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def parse_run_name(run_name):
+    """(instrument, flowcell, date) of a YYMMDD_<instrument>_<run>_<flowcell> name."""
+    parts = run_name.split('_')
+    if(len(parts) >= 4 and re.match('\\d{6}\\Z', parts[0])):
+        date = '20%s-%s-%s' % (parts[0][:2], parts[0][2:4], parts[0][4:])
+        return parts[1], parts[-1], date
+    return None, None, None
+
+
+def to_number(value, kind):
+    value = ('%s' % value).replace(',', '').strip()
+    try:
+        number = kind(value)
+    except ValueError:
+        return None
+    return None if number != number else number  # NaN
+
+
+def get_lane_metrics(tables, q30=None):
+    """Metrics of a lane/read from its fastqc_metrics tables.
+
+    q30 is the % >= Q30 bases of the lane/read, from the bcl2fastq yields.
+    """
+    metrics = dict((k, None) for k in LANE_METRICS)
+    metrics['q30'] = q30
+
+    basic = tables.get('Basic Statistics')
+    if(basic is not None and len(basic)):
+        values = dict(zip(basic['Measure'], basic['Value']))
+        metrics['total_sequences'] = to_number(values.get('Total Sequences', ''), int)
+        metrics['gc'] = to_number(values.get('%GC', ''), float)
+
+    scores = tables.get('Per sequence quality scores')
+    if(scores is not None and len(scores)):
+        total = float(sum(scores['Count']))
+        if(total):
+            metrics['mean_quality'] = sum(
+                q * c for q, c in zip(scores['Quality'], scores['Count'])) / total
+
+    metrics['failed_modules'] = sum(1 for t in tables.values() if t.status == 'fail')
+    return metrics
+
+
+def get_sample_rows(bcl2fastq):
+    """Rows of the bcl2fastq Lane Summary table as SAMPLE_COLUMNS tuples."""
+    if(not bcl2fastq):
+        return []
+    for i, head in enumerate(bcl2fastq.get('h2') or []):
+        tb = bcl2fastq.get('table-%i' % i)
+        if(head != 'Lane Summary' or not tb):
+            continue
+        positions = dict((name, j) for j, name in enumerate(tb['head']))
+        rows = []
+        for key, values in tb.items():
+            if(key == 'head'):
+                continue
+            row = []
+            for column, name, kind in SAMPLE_COLUMNS:
+                j = positions.get(name)
+                value = values[j] if j is not None and j < len(values) else None
+                row.append(to_number(value, kind) if kind and value is not None else value)
+            rows.append(tuple(row))
+        return rows
+    return []
+
+
+def refresh_rolling(conn, sequencer, lane, read, since):
+    """Recompute the rolling means of the runs from the date since on."""
+    history = conn.execute(
+        'SELECT r.id, r.run_date, %s FROM lane_metrics m JOIN runs r ON r.id = m.run_id '
+        'WHERE r.sequencer = ? AND m.lane = ? AND m.read = ? '
+        'ORDER BY r.run_date, r.id' % ', '.join('m.%s' % k for k in LANE_METRICS),
+        (sequencer, lane, read)).fetchall()
+
+    for i, row in enumerate(history):
+        if(since and row[1] and row[1] < since):
+            continue
+        window = history[max(0, i - ROLLING_WINDOW + 1):i + 1]
+        means = []
+        for k in range(len(LANE_METRICS)):
+            values = [r[2 + k] for r in window if r[2 + k] is not None]
+            means.append(sum(values) / float(len(values)) if values else None)
+        conn.execute(
+            'INSERT OR REPLACE INTO lane_rolling (run_id, lane, read, runs, %s) '
+            'VALUES (?, ?, ?, ?, %s)' % (
+                ', '.join(LANE_METRICS), ', '.join('?' * len(LANE_METRICS))),
+            [row[0], lane, read, len(window)] + means)
+
+
+def record_run(path, run_name, sequencer, lanes, samples):
+    """Add or replace a run.
+
+    lanes is {(lane, read): metrics of get_lane_metrics} and samples the
+    rows of get_sample_rows.
+    """
+    instrument, flowcell, run_date = parse_run_name(run_name)
+    conn = connect(path)
+    try:
+        with conn:
+            row = conn.execute('SELECT id FROM runs WHERE run_name = ?', (run_name,)).fetchone()
+            if(row):
+                run_id = row[0]
+                for table in ['lane_metrics', 'sample_metrics', 'lane_rolling']:
+                    conn.execute('DELETE FROM %s WHERE run_id = ?' % table, (run_id,))
+                conn.execute(
+                    'UPDATE runs SET sequencer = ?, instrument = ?, flowcell = ?, run_date = ?, '
+                    'added = ? WHERE id = ?',
+                    (sequencer, instrument, flowcell, run_date, time.time(), run_id))
+            else:
+                run_id = conn.execute(
+                    'INSERT INTO runs (run_name, sequencer, instrument, flowcell, run_date, added) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (run_name, sequencer, instrument, flowcell, run_date, time.time())).lastrowid
+
+            for (lane, read), metrics in sorted(lanes.items()):
+                conn.execute(
+                    'INSERT INTO lane_metrics (run_id, lane, read, %s) VALUES (?, ?, ?, %s)' % (
+                        ', '.join(LANE_METRICS), ', '.join('?' * len(LANE_METRICS))),
+                    [run_id, lane, read] + [metrics[k] for k in LANE_METRICS])
+                refresh_rolling(conn, sequencer, lane, read, run_date)
+
+            conn.executemany(
+                'INSERT INTO sample_metrics (run_id, %s) VALUES (?, %s)' % (
+                    ', '.join(c[0] for c in SAMPLE_COLUMNS), ', '.join('?' * len(SAMPLE_COLUMNS))),
+                [(run_id,) + row for row in samples])
+    finally:
+        conn.close()
+
+    return run_id
+
+
+def query_trend(conn, sequencer, lane, read, metric, last):
+    """(run date, run, value, rolling mean) of the last runs, oldest first."""
+    if(metric not in LANE_METRICS):
+        raise ValueError('unknown metric %s' % metric)
+    rows = conn.execute(
+        'SELECT r.run_date, r.run_name, m.%s, g.%s FROM runs r '
+        'JOIN lane_metrics m ON m.run_id = r.id '
+        'LEFT JOIN lane_rolling g ON g.run_id = m.run_id AND g.lane = m.lane AND g.read = m.read '
+        'WHERE r.sequencer = ? AND m.lane = ? AND m.read = ? '
+        'ORDER BY r.run_date DESC, r.id DESC LIMIT ?' % (metric, metric),
+        (sequencer, lane, read, last)).fetchall()
+    return rows[::-1]
+
+
+def query_sample(conn, sample):
+    return conn.execute(
+        'SELECT r.run_date, r.run_name, s.lane, s.project, s.barcode, s.clusters, s.q30, '
+        's.mean_quality FROM sample_metrics s JOIN runs r ON r.id = s.run_id '
+        'WHERE s.sample = ? ORDER BY r.run_date, r.id, s.lane', (sample,)).fetchall()
+
+
+def query_runs(conn, since=None, sequencer=None):
+    sql = 'SELECT run_date, run_name, sequencer, instrument, flowcell FROM runs WHERE 1 = 1'
+    params = []
+    if(since):
+        sql += ' AND run_date >= ?'
+        params.append(since)
+    if(sequencer):
+        sql += ' AND sequencer = ?'
+        params.append(sequencer)
+    return conn.execute(sql + ' ORDER BY run_date, id', params).fetchall()
+
+
+def format_value(value):
+    if(value is None):
+        return '-'
+    if(isinstance(value, float)):
+        return '%.2f' % value
+    return '%s' % value
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Query the QC history of the runs')
+
+    parser.add_argument(
+        '--db', '-d',
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qc_history.sqlite'),
+        help='History database (default: %(default)s)')
+
+    commands = parser.add_subparsers(dest='command')
+
+    trend = commands.add_parser('trend', help='A lane metric over the last runs')
+    trend.add_argument('--sequencer', '-s', required=True, choices=['miseq', 'nextseq'])
+    trend.add_argument('--lane', '-l', type=int, default=1)
+    trend.add_argument('--read', '-r', default='R1')
+    trend.add_argument('--metric', '-m', default='q30', choices=LANE_METRICS)
+    trend.add_argument('--last', '-n', type=int, default=200)
+
+    sample = commands.add_parser('sample', help='Demultiplexing metrics of a sample in every run')
+    sample.add_argument('sample')
+
+    runs = commands.add_parser('runs', help='Runs in the history')
+    runs.add_argument('--since', help='First run date, as YYYY-MM-DD')
+    runs.add_argument('--sequencer', '-s', choices=['miseq', 'nextseq'])
+
+    args = parser.parse_args()
+
+    if(not os.path.exists(args.db)):
+        parser.error('%s does not exist' % args.db)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if(args.command == 'trend'):
+            print('%-10s %-40s %12s %12s' % ('date', 'run', args.metric, 'rolling'))
+            for row in query_trend(conn, args.sequencer.upper(), args.lane, args.read,
+                                   args.metric, args.last):
+                print('%-10s %-40s %12s %12s' % tuple(format_value(v) for v in row))
+        elif(args.command == 'sample'):
+            for row in query_sample(conn, args.sample):
+                print('\t'.join(format_value(v) for v in row))
+        elif(args.command == 'runs'):
+            for row in query_runs(conn, args.since, args.sequencer and args.sequencer.upper()):
+                print('\t'.join(format_value(v) for v in row))
+        else:
+            parser.print_help()
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
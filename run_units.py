@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+# Dependency graph of the units of work of a run.
+#
+# Every step of the pipeline is split in small units (bcl2fastq of a lane,
+# FastQC of a lane/read, the tex and the pdf of a report). A unit knows the
+# units it depends on and the files it reads and writes. After a unit runs,
+# the fingerprints of its inputs and outputs are saved in run_units.json in
+# the run folder, and the next execution only runs the units that failed,
+# whose inputs changed or outputs are missing, or that depend on a unit that
+# runs. Units never run here whose outputs already exist (runs processed
+# before this file existed) are taken as done.
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+
+UNITS_FILE = 'run_units.json'
+
+
+def fingerprint_paths(paths):
+    """Hash of the name, size and mtime of the files, None if one is missing."""
+    sha = hashlib.sha1()
+    for path in sorted(paths):
+        if(not os.path.exists(path)):
+            return None
+        if(os.path.isdir(path)):
+            files = sorted(
+                os.path.join(root, f) for root, dirs, fs in os.walk(path) for f in fs)
+        else:
+            files = [path]
+        for f in files:
+            st = os.stat(f)
+            sha.update(('%s:%d:%d\n' % (f, st.st_size, int(st.st_mtime))).encode('utf-8'))
+    return sha.hexdigest()
+
+
+class Unit(object):
+    """A unit of work. inputs and outputs are callables returning paths."""
+
+    __slots__ = ('name', 'deps', 'inputs', 'outputs')
+
+    def __init__(self, name, deps=None, inputs=None, outputs=None):
+        self.name = name
+        self.deps = deps or []
+        self.inputs = inputs or (lambda: [])
+        self.outputs = outputs or (lambda: [])
+
+
+class UnitGraph(object):
+
+    def __init__(self, run_dir):
+        self.path = os.path.join(run_dir, UNITS_FILE)
+        self.units = OrderedDict([])
+        self.state = {}
+        self.dirty = OrderedDict([])
+
+        if(os.path.exists(self.path)):
+            try:
+                with open(self.path, 'r') as f:
+                    self.state = json.load(f)
+            except (IOError, OSError, ValueError):
+                self.state = {}
+
+    def add(self, unit):
+        for dep in unit.deps:
+            if(dep not in self.units):
+                raise Exception('Unit %s depends on the unknown unit %s' % (unit.name, dep))
+        self.units[unit.name] = unit
+        return unit
+
+    def get_reason(self, unit):
+        """Why the unit has to run, or None if it is up to date."""
+        for dep in unit.deps:
+            if(dep in self.dirty):
+                return 'depends on %s' % dep
+
+        state = self.state.get(unit.name)
+        if(not state):
+            return 'never run'
+        if(state.get('status') != 'done'):
+            return 'last run %s' % state.get('status')
+        if(fingerprint_paths(unit.inputs()) != state.get('inputs')):
+            return 'inputs changed'
+        # changed outputs are picked up by the inputs of the units after this one
+        if(not all(os.path.exists(path) for path in unit.outputs())):
+            return 'outputs missing'
+        return None
+
+    def plan(self):
+        """Return the units that have to run, in dependency order, with the reason."""
+        self.dirty = OrderedDict([])
+        # units are added after their dependencies, so this is a topological order
+        for name, unit in self.units.items():
+            reason = self.get_reason(unit)
+            if(reason == 'never run' and self.adopt(unit)):
+                reason = None
+            if(reason):
+                self.dirty[name] = reason
+        return self.dirty
+
+    def adopt(self, unit):
+        """Record as done a unit never run here whose outputs already exist."""
+        outputs = unit.outputs()
+        if(not outputs or not all(os.path.exists(path) for path in outputs)):
+            return False
+        self.record(unit.name, True)
+        return True
+
+    def invalidate(self, name, status):
+        """Run the unit again, its last run is shown as status in the plan."""
+        self.state[name] = {'status': status}
+
+    def is_dirty(self, name):
+        return name in self.dirty
+
+    def record(self, name, ok):
+        unit = self.units[name]
+        if(ok):
+            self.state[name] = {
+                'status': 'done',
+                'inputs': fingerprint_paths(unit.inputs()),
+                'outputs': fingerprint_paths(unit.outputs())}
+            self.dirty.pop(name, None)
+        else:
+            self.state[name] = {'status': 'failed'}
+
+    def mark(self, name, ok):
+        """Record the result of a unit and save the state of the run."""
+        self.record(name, ok)
+        self.save()
+
+    def save(self):
+        tmp = '%s.%d' % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.rename(tmp, self.path)
+
+    def print_plan(self):
+        for name in self.units.keys():
+            if(name in self.dirty):
+                print('run   %-24s %s' % (name, self.dirty[name]))
+            else:
+                print('skip  %-24s up to date' % name)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+# Illumina SampleSheet.csv model shared by the pipeline.
+#
+# The sheet is parsed once per file (load keeps it until the file changes).
+# The [Header], [Reads], [Settings] and any other sections keep their rows,
+# and the [Data] section becomes a list of Sample rows (a tuple of values
+# behind __slots__) indexed by lane, Sample_ID, index/index2 and project.
+
+import csv
+import os
+import sys
+from collections import OrderedDict
+
+
+DATA = '[DATA]'
+
+# SampleSheet objects by path: ((size, mtime), sheet)
+SHEETS = {}
+
+
+class Sample(object):
+    """A row of the [Data] section."""
+
+    __slots__ = ('sheet', 'values')
+
+    def __init__(self, sheet, values):
+        self.sheet = sheet
+        self.values = tuple(values)
+
+    def get(self, column, default=''):
+        i = self.sheet.positions.get(column.lower())
+        if(i is None or i >= len(self.values)):
+            return default
+        return self.values[i]
+
+    def __getitem__(self, column):
+        return self.get(column)
+
+    @property
+    def sample_id(self):
+        return self.get('Sample_ID')
+
+    @property
+    def sample_name(self):
+        return self.get('Sample_Name') or self.sample_id
+
+    @property
+    def lane(self):
+        lane = self.get('Lane')
+        return int(lane) if lane.isdigit() else None
+
+    @property
+    def index(self):
+        return self.get('index')
+
+    @property
+    def index2(self):
+        return self.get('index2')
+
+    @property
+    def project(self):
+        return self.get('Sample_Project')
+
+    def __repr__(self):
+        return 'Sample(%r)' % (self.values,)
+
+
+class SampleSheet(object):
+
+    __slots__ = ('path', 'sections', 'columns', 'positions', 'rows',
+                 'by_lane', 'by_id', 'by_index', 'by_project')
+
+    def __init__(self, path=None):
+        self.path = path
+        self.sections = OrderedDict([])
+        self.columns = ()
+        self.positions = {}
+        self.rows = []
+        self.by_lane = {}
+        self.by_id = {}
+        self.by_index = {}
+        self.by_project = OrderedDict([])
+
+    def parse(self, lines):
+        key = ''
+        for row in csv.reader(lines, delimiter=','):
+            if(not row or not any(v.strip() for v in row)):
+                continue
+            if(row[0].startswith('[')):
+                key = row[0].strip().upper()
+                self.sections[key] = None if key == DATA else []
+            elif(key == DATA):
+                if(not self.columns):
+                    self.set_columns(row)
+                else:
+                    self.add(row)
+            elif(key):
+                self.sections[key].append(row)
+        return self
+
+    def set_columns(self, columns):
+        self.columns = tuple(columns)
+        self.positions = dict((c.strip().lower(), i) for i, c in enumerate(self.columns))
+
+    def add(self, values):
+        sample = Sample(self, values)
+        self.rows.append(sample)
+        self.by_lane.setdefault(sample.lane, []).append(sample)
+        self.by_id.setdefault(sample.sample_id, []).append(sample)
+        self.by_index.setdefault((sample.index, sample.index2), []).append(sample)
+        self.by_project.setdefault(sample.project, []).append(sample)
+        return sample
+
+    def get_sample(self, sample_id, lane=None):
+        """Row of a Sample_ID, in the given lane when it is in several."""
+        samples = self.by_id.get(sample_id)
+        if(not samples):
+            return None
+        if(lane is not None):
+            for sample in samples:
+                if(sample.lane == lane):
+                    return sample
+        return samples[0]
+
+    def get_project(self, sample_id, default='default'):
+        sample = self.get_sample(sample_id)
+        return sample.project if sample and sample.project else default
+
+    def get_lane(self, lane):
+        """Samples of a lane; sheets without a Lane column use every lane."""
+        return self.by_lane.get(lane) or self.by_lane.get(None, [])
+
+    @property
+    def header(self):
+        return OrderedDict((row[0], row[1] if len(row) > 1 else '')
+                           for row in self.sections.get('[HEADER]') or [])
+
+    @property
+    def reads(self):
+        return [int(row[0]) for row in self.sections.get('[READS]') or []
+                if row[0].strip().isdigit()]
+
+    @property
+    def settings(self):
+        return OrderedDict((row[0], row[1] if len(row) > 1 else '')
+                           for row in self.sections.get('[SETTINGS]') or [])
+
+
+def load(path):
+    """Parsed SampleSheet of path, parsed again only when the file changes."""
+    st = os.stat(path)
+    stamp = (st.st_size, st.st_mtime)
+    cached = SHEETS.get(path)
+    if(cached and cached[0] == stamp):
+        return cached[1]
+
+    if(sys.version_info[0] < 3):
+        f = open(path, 'rb')
+    else:
+        f = open(path, 'r', newline='')
+    try:
+        sheet = SampleSheet(path).parse(f)
+    finally:
+        f.close()
+
+    SHEETS[path] = (stamp, sheet)
+    return sheet
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Work queue of the shards of a bcl2fastq conversion, in a folder.
+#
+# The queue is a folder of the run (shared by NFS when workers run on other
+# hosts) with a json file per job in one of the folders pending, claimed,
+# done and failed. A worker claims a job by renaming it from pending to
+# claimed/<job>@<worker>.json, which only one of the workers trying at the
+# same time can do, runs its command with the output in logs/<job>.log and
+# moves it to done or failed with its exit code, worker and times. While
+# the command runs the worker touches the claimed file every HEARTBEAT
+# seconds, so a job whose worker died (its host went down) is put back in
+# pending by requeue_stale and claimed by another worker. The claimed file
+# carries the name of its worker, so a worker only ever renames its own
+# claim: one that stalled and lost its job finds its file gone.
+#
+# Execution (on any host that sees the run folder at the same path):
+#   python shard_queue.py work RUN/bcl2fastq_queue
+#   python shard_queue.py status RUN/bcl2fastq_queue
+
+import argparse
+import errno
+import json
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+FAILED = 'failed'
+STATES = [PENDING, CLAIMED, DONE, FAILED]
+LOGS = 'logs'
+# seconds between two touches of a claimed job by its worker
+HEARTBEAT = 30
+# a claimed job not touched for this long is given to another worker
+STALE_SECONDS = 10 * HEARTBEAT
+# separates the job from its worker in the names of the claimed files
+OWNER_SEPARATOR = '@'
+
+
+class WorkQueue(object):
+    """Jobs in the folders of path, by state."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_path(self, state, name):
+        return os.path.join(self.path, state, '%s.json' % name)
+
+    def get_claimed_path(self, name, worker):
+        # ':' can not be in a file name on CIFS
+        return self.get_path(CLAIMED, '%s%s%s' % (
+            name, OWNER_SEPARATOR, worker.replace(':', '_')))
+
+    def claims(self):
+        """(name, path) of the claimed jobs."""
+        folder = os.path.join(self.path, CLAIMED)
+        if(not os.path.exists(folder)):
+            return []
+        return sorted((f[:-len('.json')].split(OWNER_SEPARATOR, 1)[0], os.path.join(folder, f))
+                      for f in os.listdir(folder) if f.endswith('.json'))
+
+    def get_log(self, name):
+        return os.path.join(self.path, LOGS, '%s.log' % name)
+
+    def create(self):
+        for folder in STATES + [LOGS]:
+            if(not os.path.exists(os.path.join(self.path, folder))):
+                os.makedirs(os.path.join(self.path, folder))
+
+    def clear(self):
+        """Remove the jobs of an old conversion."""
+        if(os.path.exists(self.path)):
+            shutil.rmtree(self.path)
+        self.create()
+
+    def write(self, path, job):
+        # written aside and renamed, a worker never reads half a job
+        tmp = os.path.join(self.path, '.%s.%s.%d' % (
+            os.path.basename(path), socket.gethostname(), os.getpid()))
+        with open(tmp, 'w') as f:
+            json.dump(job, f, indent=1)
+        os.rename(tmp, path)
+
+    def read(self, path):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def put(self, name, job):
+        self.write(self.get_path(PENDING, name), job)
+
+    def names(self, state):
+        if(state == CLAIMED):
+            return [name for name, path in self.claims()]
+        folder = os.path.join(self.path, state)
+        if(not os.path.exists(folder)):
+            return []
+        return sorted(f[:-len('.json')] for f in os.listdir(folder) if f.endswith('.json'))
+
+    def get(self, state, name):
+        return self.read(self.get_path(state, name))
+
+    def claim(self, worker):
+        """Take the first pending job for worker. Returns (name, job), None when none is left."""
+        for name in self.names(PENDING):
+            path = self.get_claimed_path(name, worker)
+            try:
+                os.rename(self.get_path(PENDING, name), path)
+                # the rename keeps the time of the pending file, which looks stale
+                os.utime(path, None)
+                job = self.read(path)
+            except (IOError, OSError) as e:
+                # claimed by another worker, or put back by requeue_stale, in the meantime
+                if(e.errno == errno.ENOENT):
+                    continue
+                raise
+            job['worker'] = worker
+            job['claimed'] = time.time()
+            self.write(path, job)
+            return name, job
+        return None
+
+    def heartbeat(self, name, worker):
+        try:
+            os.utime(self.get_claimed_path(name, worker), None)
+        except OSError:
+            pass
+
+    def finish(self, name, job, ok):
+        """Move a claimed job to done or failed. False if it was given to another worker."""
+        path = self.get_path(DONE if ok else FAILED, name)
+        # only the worker of the claim has its file, requeue_stale takes it
+        # away from a worker that stalled
+        try:
+            os.rename(self.get_claimed_path(name, job['worker']), path)
+        except OSError as e:
+            if(e.errno == errno.ENOENT):
+                return False
+            raise
+        self.write(path, job)
+        return True
+
+    def requeue_stale(self, seconds=STALE_SECONDS):
+        """Put back in pending the claimed jobs not touched for seconds."""
+        requeued = []
+        for name, path in self.claims():
+            try:
+                if(time.time() - os.path.getmtime(path) < seconds):
+                    continue
+                os.rename(path, self.get_path(PENDING, name))
+                requeued.append(name)
+            except OSError:
+                # finished in the meantime
+                continue
+        return requeued
+
+    def abandon(self, worker, reason):
+        """Move the jobs claimed by a worker that was stopped to failed."""
+        for name, path in self.claims():
+            if(path != self.get_claimed_path(name, worker)):
+                continue
+            try:
+                job = self.read(path)
+            except (IOError, OSError, ValueError):
+                continue
+            job['error'] = reason
+            self.finish(name, job, False)
+
+    def finished(self):
+        return not self.names(PENDING) and not self.names(CLAIMED)
+
+
+def get_worker(pid=None):
+    """Name of the worker process pid of this host, the current process by default."""
+    return '%s:%d' % (socket.gethostname(), pid or os.getpid())
+
+
+def keep_claimed(queue, name, worker, stop):
+    """Touch the claimed job every HEARTBEAT seconds until stop is set."""
+    while(not stop.wait(HEARTBEAT)):
+        queue.heartbeat(name, worker)
+
+
+def run_job(queue, name, job):
+    """Run the command of a claimed job and move it to done or failed."""
+    log = open(queue.get_log(name), 'ab')
+    try:
+        job['start'] = time.time()
+        process = subprocess.Popen(
+            job['cl'], cwd=job.get('cwd'), stdout=log, stderr=subprocess.STDOUT, shell=False)
+        stop = threading.Event()
+        beat = threading.Thread(target=keep_claimed, args=(queue, name, job['worker'], stop))
+        beat.daemon = True
+        beat.start()
+        try:
+            process.wait()
+        finally:
+            stop.set()
+            beat.join()
+    finally:
+        log.close()
+
+    job['end'] = time.time()
+    job['exit_code'] = process.returncode
+    if(not queue.finish(name, job, process.returncode == 0)):
+        print('%s was given to another worker' % name)
+    return process.returncode
+
+
+def work(path, once=False):
+    """Run the jobs of the queue until none is pending. Returns the jobs that failed."""
+    queue = WorkQueue(path)
+    worker = get_worker()
+    failed = []
+    while(True):
+        claimed = queue.claim(worker)
+        if(claimed is None):
+            break
+        name, job = claimed
+        print('%s running %s' % (worker, name))
+        retCode = run_job(queue, name, job)
+        if(retCode != 0):
+            print('%s failed with exit code %s' % (name, retCode))
+            failed.append(name)
+        else:
+            print('%s finished' % name)
+        if(once):
+            break
+    return failed
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Worker of a queue of bcl2fastq shards')
+
+    parser.add_argument('command', choices=['work', 'status'])
+    parser.add_argument('queue', help='Folder of the queue, RUN/bcl2fastq_queue')
+    parser.add_argument('--once', action='store_true', help='Run a single job')
+
+    args = parser.parse_args()
+
+    if(args.command == 'work'):
+        work(args.queue, args.once)
+        return
+
+    queue = WorkQueue(args.queue)
+    for state in STATES:
+        if(state == CLAIMED):
+            jobs = queue.claims()
+        else:
+            jobs = [(name, queue.get_path(state, name)) for name in queue.names(state)]
+        for name, path in jobs:
+            job = queue.read(path) if state != PENDING else {}
+            print('%-8s %-16s %s' % (state, name, job.get('worker', '')))
+
+
+if __name__ == '__main__':
+    main()
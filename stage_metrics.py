@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+# Time, CPU and memory used by the stages of a run and by the programs
+# they start.
+#
+# Every external program (bcl2fastq, each FastQC job, each pdflatex) is
+# reaped with os.wait4, which gives its wall time, user and system CPU
+# time and peak RSS (including the processes it waited for, as the java
+# of FastQC under its shell), together with the bytes of input it was
+# given. The stages add up their programs and the CPU used by the
+# pipeline itself. Everything is saved as json in the run folder and as a
+# Prometheus textfile for the node_exporter textfile collector.
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+PREFIX = 'fastqc_report'
+
+
+def get_exit_code(status):
+    """Return code of a wait status, as subprocess gives it."""
+    if(os.WIFSIGNALED(status)):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def get_max_rss(rusage):
+    """Peak RSS in bytes, ru_maxrss is in bytes on macOS and KB elsewhere."""
+    if(sys.platform == 'darwin'):
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024
+
+
+def get_input_bytes(paths):
+    """Size of the files, of the files in the folders, in paths."""
+    total = 0
+    for path in paths:
+        if(os.path.isdir(path)):
+            for root, dirs, files in os.walk(path):
+                for f in files:
+                    try:
+                        total += os.path.getsize(os.path.join(root, f))
+                    except OSError:
+                        pass
+        elif(os.path.exists(path)):
+            total += os.path.getsize(path)
+    return total
+
+
+class Command(object):
+    """A program started by a stage, measured when it is reaped."""
+
+    __slots__ = ('metrics', 'stage', 'name', 'process', 'input_bytes', 'start')
+
+    def __init__(self, metrics, stage, name, process, input_bytes=0):
+        self.metrics = metrics
+        self.stage = stage
+        self.name = name
+        self.process = process
+        self.input_bytes = input_bytes
+        self.start = time.time()
+
+    def done(self, status, rusage):
+        self.process.returncode = get_exit_code(status)
+        if(self.metrics is not None):
+            self.metrics.add_command(
+                self.stage, self.name, time.time() - self.start, rusage.ru_utime,
+                rusage.ru_stime, get_max_rss(rusage), self.input_bytes,
+                self.process.returncode)
+        return self.process.returncode
+
+    def wait(self):
+        """Wait for the program and return its exit code."""
+        if(self.process.returncode is not None):
+            return self.process.returncode
+        pid, status, rusage = os.wait4(self.process.pid, 0)
+        return self.done(status, rusage)
+
+    def poll(self):
+        """Exit code of the program, None while it runs."""
+        if(self.process.returncode is not None):
+            return self.process.returncode
+        pid, status, rusage = os.wait4(self.process.pid, os.WNOHANG)
+        if(pid == 0):
+            return None
+        return self.done(status, rusage)
+
+
+class RunMetrics(object):
+    """Measures of the stages and programs of a run."""
+
+    def __init__(self, run, sequencer):
+        self.run = run
+        self.sequencer = sequencer
+        self.start = time.time()
+        self.stages = OrderedDict([])
+        self.commands = []
+        self.lock = threading.Lock()
+
+    def command(self, stage, name, process, inputs=None):
+        """Wrap a started process, inputs are the paths it reads."""
+        return Command(self, stage, name, process, get_input_bytes(inputs or []))
+
+    def add_command(self, stage, name, wall, user, system, max_rss, input_bytes, exit_code):
+        with self.lock:
+            # a program run again (a retried compile) gets its own series
+            runs = sum(1 for c in self.commands if c['stage'] == stage and
+                       c['command'].split(' #', 1)[0] == name)
+            if(runs):
+                name = '%s #%d' % (name, runs + 1)
+            self.commands.append(OrderedDict([
+                ('stage', stage), ('command', name), ('wall_seconds', wall),
+                ('user_seconds', user), ('system_seconds', system),
+                ('max_rss_bytes', max_rss), ('input_bytes', input_bytes),
+                ('exit_code', exit_code)]))
+
+    def begin(self, stage):
+        """Start measuring a stage, returns what end needs."""
+        return stage, time.time(), resource.getrusage(resource.RUSAGE_SELF)
+
+    def end(self, token, ok=True):
+        stage, start, usage = token
+        now = resource.getrusage(resource.RUSAGE_SELF)
+        with self.lock:
+            commands = [c for c in self.commands if c['stage'] == stage]
+            self.stages[stage] = OrderedDict([
+                ('wall_seconds', time.time() - start),
+                # the pipeline's own CPU, of all its threads
+                ('self_cpu_seconds', (now.ru_utime - usage.ru_utime) +
+                                     (now.ru_stime - usage.ru_stime)),
+                ('child_cpu_seconds', sum(
+                    c['user_seconds'] + c['system_seconds'] for c in commands)),
+                ('max_rss_bytes', max([c['max_rss_bytes'] for c in commands] or [0])),
+                ('input_bytes', sum(c['input_bytes'] for c in commands)),
+                ('commands', len(commands)),
+                ('ok', ok)])
+
+    def to_dict(self):
+        with self.lock:
+            return OrderedDict([
+                ('run', self.run),
+                ('sequencer', self.sequencer),
+                ('start', self.start),
+                ('wall_seconds', time.time() - self.start),
+                ('stages', self.stages),
+                ('commands', list(self.commands))])
+
+    def write_json(self, path):
+        tmp = '%s.%d' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.rename(tmp, path)
+
+    def to_prometheus(self):
+        data = self.to_dict()
+        run = [('run', self.run), ('sequencer', self.sequencer)]
+        lines = []
+
+        def add(name, kind, help, samples):
+            lines.append('# HELP %s_%s %s' % (PREFIX, name, help))
+            lines.append('# TYPE %s_%s %s' % (PREFIX, name, kind))
+            for labels, value in samples:
+                lines.append('%s_%s{%s} %s' % (PREFIX, name, ','.join(
+                    '%s="%s"' % (k, escape_label(v)) for k, v in labels), repr(float(value))))
+
+        add('run_seconds', 'gauge', 'Wall time of the run.', [(run, data['wall_seconds'])])
+        add('run_start_timestamp_seconds', 'gauge', 'Start of the run.', [(run, data['start'])])
+        for key, help in [
+                ('wall_seconds', 'Wall time of the stage.'),
+                ('self_cpu_seconds', 'CPU time of the pipeline during the stage.'),
+                ('child_cpu_seconds', 'CPU time of the programs of the stage.'),
+                ('max_rss_bytes', 'Peak RSS of the programs of the stage.'),
+                ('input_bytes', 'Input of the programs of the stage.'),
+                ('commands', 'Programs run by the stage.')]:
+            add('stage_%s' % key, 'gauge', help, [
+                (run + [('stage', stage)], values[key])
+                for stage, values in data['stages'].items()])
+        for key, help in [
+                ('wall_seconds', 'Wall time of the program.'),
+                ('user_seconds', 'User CPU time of the program.'),
+                ('system_seconds', 'System CPU time of the program.'),
+                ('max_rss_bytes', 'Peak RSS of the program.'),
+                ('input_bytes', 'Input of the program.'),
+                ('exit_code', 'Exit code of the program.')]:
+            add('command_%s' % key, 'gauge', help, [
+                (run + [('stage', c['stage']), ('command', c['command'])], c[key])
+                for c in data['commands']])
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, folder):
+        """Write <folder>/<PREFIX>_<run>.prom for the textfile collector."""
+        if(not os.path.exists(folder)):
+            os.makedirs(folder)
+        path = os.path.join(folder, '%s_%s.prom' % (PREFIX, self.run))
+        # the collector only reads *.prom, the file appears complete
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self.to_prometheus())
+        os.rename(tmp, path)
+        return path
+
+
+def escape_label(value):
+    return ('%s' % value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch_runs  # noqa: E402
+import RunFastQC  # noqa: E402
+
+
+def get_job(name, on_finish=None):
+    return {'name': name, 'cl': ['true'], 'cores': 2, 'memory': 100, 'on_finish': on_finish}
+
+
+class ResourcePoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.pool = batch_runs.ResourcePool(2, 1000, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def test_cancel_withdraws_request(self):
+        request = self.pool.request('a', {'cores': 2})
+        self.pool.cancel(request)
+        self.assertEqual(self.pool.waiting, [])
+        self.assertTrue(self.pool.try_grant(self.pool.request('b', {'cores': 2})))
+
+    def test_failed_run_does_not_block_the_others(self):
+        def fail(job, retCode):
+            raise RuntimeError('run a failed')
+
+        # the second job of run a waits for the cores of the first one when it fails
+        with self.assertRaises(RuntimeError):
+            RunFastQC.run_jobs(
+                [get_job('a1', fail), get_job('a2')], 2, 1000, self.log_dir, self.pool, 'a')
+        self.assertEqual(self.pool.waiting, [])
+
+        failed = []
+        thread = threading.Thread(target=lambda: failed.extend(RunFastQC.run_jobs(
+            [get_job('b1')], 2, 1000, self.log_dir, self.pool, 'b')))
+        thread.daemon = True
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(failed, [])
+        self.assertEqual(self.pool.free['cores'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
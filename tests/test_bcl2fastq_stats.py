@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import RunFastQC  # noqa: E402
+
+
+STATS = {
+    'ConversionResults': [{
+        'LaneNumber': 1, 'TotalClustersRaw': 125, 'TotalClustersPF': 100, 'Yield': 20000,
+        'DemuxResults': [{
+            'SampleId': 'S1', 'SampleName': 'Sample1', 'NumberReads': 80, 'Yield': 16000,
+            'IndexMetrics': [{'IndexSequence': 'ACGT', 'MismatchCounts': {'0': 76, '1': 4}}],
+            'ReadMetrics': [
+                {'ReadNumber': 1, 'Yield': 8000, 'YieldQ30': 6000, 'QualityScoreSum': 280000},
+                {'ReadNumber': 2, 'Yield': 8000, 'YieldQ30': 4000, 'QualityScoreSum': 280000}]}],
+        'Undetermined': {'NumberReads': 20, 'Yield': 4000, 'ReadMetrics': []}}],
+    'UnknownBarcodes': [{'Lane': 1, 'Barcodes': {'GGGG': 5, 'TTTT': 9}}]}
+
+
+class Bcl2fastqStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fastq_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.fastq_path, 'Stats'))
+        with open(os.path.join(self.fastq_path, RunFastQC.BCL2FASTQ_STATS), 'w') as f:
+            json.dump(STATS, f)
+        # a run without SampleSheet
+        self.args = argparse.Namespace(runPath=os.path.join(self.fastq_path, 'missing'))
+        self.ijson = RunFastQC.ijson
+
+    def tearDown(self):
+        RunFastQC.ijson = self.ijson
+        RunFastQC.BCL2FASTQ_REPORTS.clear()
+        shutil.rmtree(self.fastq_path)
+
+    def test_records(self):
+        lanes, samples, unknown = RunFastQC.read_bcl2fastq_stats(
+            os.path.join(self.fastq_path, RunFastQC.BCL2FASTQ_STATS))
+        self.assertEqual(lanes, [RunFastQC.LaneMetrics(1, 125, 100, 20000)])
+        self.assertEqual([(s.sample_id, s.barcode, s.reads, s.yield_q30) for s in samples],
+                         [('S1', 'ACGT', 80, 10000), ('Undetermined', 'unknown', 20, 0)])
+        self.assertEqual(unknown, [RunFastQC.UnknownMetrics(1, 'TTTT', 9),
+                                   RunFastQC.UnknownMetrics(1, 'GGGG', 5)])
+
+    def test_records_without_ijson(self):
+        RunFastQC.ijson = None
+        self.test_records()
+
+    def test_report_tables(self):
+        ncolums, result = RunFastQC.get_bcl2fastq_stats_report(self.args, self.fastq_path)
+        self.assertEqual(ncolums, 12)
+        self.assertEqual(result['h2'], ['Flowcell Summary', 'Lane Summary', 'Top Unknown Barcodes'])
+        self.assertEqual(result['table-0']['1-col'], ['125', '100', '0'])
+        self.assertEqual(result['table-1']['1-col'], [
+            '1', 'default', 'Sample1', 'ACGT', '80', '80.00', '95.00', '5.00', '0', '100.00',
+            '62.50', '35.00'])
+        self.assertEqual(result['table-1']['2-col'], [
+            '1', 'default', 'Undetermined', 'unknown', '20', '20.00', 'NaN', 'NaN', '0', '100.00',
+            '0.00', '0.00'])
+        self.assertEqual(result['table-2']['1-col'], ['1', '9', 'TTTT'])
+
+    def test_report_kept_until_stats_change(self):
+        report = RunFastQC.get_bcl2fastq_report(self.args, self.fastq_path)
+        self.assertTrue(RunFastQC.get_bcl2fastq_report(self.args, self.fastq_path)[1] is report[1])
+
+        path = os.path.join(self.fastq_path, RunFastQC.BCL2FASTQ_STATS)
+        mtime = os.path.getmtime(path) + 10
+        os.utime(path, (mtime, mtime))
+        self.assertFalse(RunFastQC.get_bcl2fastq_report(self.args, self.fastq_path)[1] is report[1])
+
+    def test_no_report(self):
+        os.remove(os.path.join(self.fastq_path, RunFastQC.BCL2FASTQ_STATS))
+        self.assertEqual(RunFastQC.get_bcl2fastq_report(self.args, self.fastq_path), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import command_runner  # noqa: E402
+
+
+class RunCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def test_exit_code_without_reason(self):
+        group = command_runner.CommandGroup(self.log_dir)
+        self.assertEqual(group.run_command(['sh', '-c', 'exit 3'], 'exit', 'pdflatex'), (3, None))
+        self.assertEqual(group.run(['true'], 'true', 'pdflatex'), 0)
+
+    def test_timeout_has_reason(self):
+        group = command_runner.CommandGroup(self.log_dir, timeouts={'pdflatex': 1})
+        retCode, reason = group.run_command(['sleep', '30'], 'sleep', 'pdflatex')
+        self.assertNotEqual(retCode, 0)
+        self.assertIn('timed out', reason)
+
+    def test_cancelled_group_does_not_start(self):
+        group = command_runner.CommandGroup(self.log_dir)
+        group.cancel('stopped')
+        self.assertEqual(group.run_command(['true'], 'true', 'pdflatex'),
+                         (command_runner.CANCELLED, 'stopped'))
+
+
+if __name__ == '__main__':
+    unittest.main()
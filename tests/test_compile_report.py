@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import command_runner  # noqa: E402
+import RunFastQC  # noqa: E402
+
+
+class CompileReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.folder + os.pathsep + self.path
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.folder)
+
+    def set_pdflatex(self, command):
+        """pdflatex stand-in counting its calls in the calls file."""
+        path = os.path.join(self.folder, 'pdflatex')
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\necho x >> %s\n%s\n' % (os.path.join(self.folder, 'calls'), command))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+    def get_calls(self):
+        with open(os.path.join(self.folder, 'calls'), 'r') as f:
+            return len(f.readlines())
+
+    def test_failure_with_format_retried_without(self):
+        self.set_pdflatex('exit 1')
+        group = command_runner.CommandGroup(self.folder)
+        self.assertEqual(RunFastQC.compile_report('report', self.folder, group, 'fmt'),
+                         ('report', 1))
+        self.assertEqual(self.get_calls(), 2)
+
+    def test_timeout_not_retried(self):
+        self.set_pdflatex('exec sleep 30')
+        group = command_runner.CommandGroup(self.folder, timeouts={'pdflatex': 1})
+        filename, retCode = RunFastQC.compile_report('report', self.folder, group, 'fmt')
+        self.assertNotEqual(retCode, 0)
+        self.assertEqual(self.get_calls(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import RunFastQC  # noqa: E402
+
+
+class FastqIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fastq_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.fastq_path, 'Project'))
+        for f in ['Undetermined_S0_L001_R1_001.fastq.gz',
+                  os.path.join('Project', 'Sample1_S1_L001_R1_001.fastq.gz'),
+                  os.path.join('Project', 'Sample1_S1_L001_R2_001.fastq.gz'),
+                  os.path.join('Project', 'Sample2_S2_L002_R1_001.fastq.gz'),
+                  os.path.join('Project', 'Sample2_S2_L002_R1_001.fastq'),
+                  'L1_L001_R1_fastqc.html']:
+            open(os.path.join(self.fastq_path, f), 'w').close()
+        os.symlink(os.path.join(self.fastq_path, 'Undetermined_S0_L001_R1_001.fastq.gz'),
+                   os.path.join(self.fastq_path, 'L1_L001_R1_001.fastq.gz'))
+
+    def tearDown(self):
+        shutil.rmtree(self.fastq_path)
+
+    def test_index(self):
+        index = RunFastQC.FastqIndex(self.fastq_path)
+        self.assertEqual(index.get_files(1, 1), [
+            os.path.join('Project', 'Sample1_S1_L001_R1_001.fastq.gz'),
+            'Undetermined_S0_L001_R1_001.fastq.gz'])
+        self.assertEqual(index.get_files(1, 2), [
+            os.path.join('Project', 'Sample1_S1_L001_R2_001.fastq.gz')])
+        self.assertEqual(index.get_samples(2, 1), ['Sample2'])
+        self.assertEqual(index.html, ['L1_L001_R1_fastqc.html'])
+        self.assertEqual(index.links, set(['L1_L001_R1_001.fastq.gz']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fastq_qc  # noqa: E402
+
+
+# every base at every position
+BALANCED = [(b'GATC' * 11)[i:i + 40] for i in range(4)] * 25
+
+
+def get_stats(sequences, qualities):
+    stats = fastq_qc.QualityStats()
+    stats.add(sequences, qualities)
+    return stats
+
+
+class StatusTest(unittest.TestCase):
+
+    def test_good_reads_pass(self):
+        stats = get_stats(BALANCED, [b'I' * 40] * 100)
+        self.assertEqual(list(fastq_qc.get_statuses(stats).values()), ['pass'] * 4)
+
+    def test_bad_reads_fail(self):
+        # quality 10 everywhere and only As
+        stats = get_stats([b'A' * 40] * 100, [b'+' * 40] * 100)
+        statuses = fastq_qc.get_statuses(stats)
+        self.assertEqual(statuses['Per base sequence quality'], 'fail')
+        self.assertEqual(statuses['Per sequence quality scores'], 'fail')
+        self.assertEqual(statuses['Per base sequence content'], 'fail')
+
+    def test_median_between_limits_warns(self):
+        # quality 22: median under 25, lower quartile over 10
+        stats = get_stats(BALANCED, [b'7' * 40] * 100)
+        self.assertEqual(fastq_qc.get_statuses(stats)['Per base sequence quality'], 'warn')
+
+    def test_no_reads_fail(self):
+        statuses = fastq_qc.get_statuses(fastq_qc.QualityStats())
+        self.assertEqual(statuses['Basic Statistics'], 'pass')
+        self.assertEqual(statuses['Per base sequence quality'], 'fail')
+
+    def test_data_has_statuses(self):
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, 'fastqc_data.txt')
+            fastq_qc.write_data(get_stats([b'A' * 40] * 10, [b'+' * 40] * 10), 'x', path)
+            with open(path, 'r') as f:
+                modules = [line.strip().split('\t') for line in f if line.startswith('>>')
+                           and not line.startswith('>>END')]
+        finally:
+            shutil.rmtree(folder)
+        self.assertEqual(modules, [
+            ['>>Basic Statistics', 'pass'], ['>>Per base sequence quality', 'fail'],
+            ['>>Per sequence quality scores', 'fail'], ['>>Per base sequence content', 'fail']])
+
+
+if __name__ == '__main__':
+    unittest.main()
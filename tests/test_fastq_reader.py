@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import io
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fastq_reader  # noqa: E402
+
+
+RECORDS = b''.join(b'@r%d\nACGTACGT\n+\nIIIIIIII\n' % i for i in range(200))
+
+
+def gzip_member(data):
+    buf = io.BytesIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+def bgzf_block(data):
+    """A BGZF block as written by bgzip."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+    bsize = len(header) + 2 + len(deflated) + 8 - 1
+    return (header + struct.pack('<H', bsize) + deflated +
+            struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data)))
+
+
+class FastqReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'L1_L001_R1_001.fastq.gz')
+        self.read_size = fastq_reader.READ_SIZE
+        self.chunk_size = fastq_reader.CHUNK_SIZE
+        # every member is a chunk
+        fastq_reader.CHUNK_SIZE = 1
+
+    def tearDown(self):
+        fastq_reader.READ_SIZE = self.read_size
+        fastq_reader.CHUNK_SIZE = self.chunk_size
+        shutil.rmtree(self.folder)
+
+    def write(self, members):
+        with open(self.path, 'wb') as f:
+            f.write(b''.join(members))
+        return [sum(len(m) for m in members[:i]) for i in range(len(members))]
+
+    def read_lines(self, workers, index=False):
+        lines = []
+        for chunk in fastq_reader.iter_chunks(self.path, workers, index):
+            self.assertEqual(len(chunk) % 4, 0)
+            lines.extend(chunk)
+        return lines
+
+    def test_member_boundary_on_read_size(self):
+        members = [gzip_member(RECORDS[:1000]), gzip_member(RECORDS[1000:])]
+        offsets = self.write(members)
+        for read_size in (len(members[0]) - 1, len(members[0]), len(members[0]) + 1):
+            fastq_reader.READ_SIZE = read_size
+            if(os.path.exists(self.path + fastq_reader.BLOCK_INDEX_SUFFIX)):
+                os.remove(self.path + fastq_reader.BLOCK_INDEX_SUFFIX)
+            self.assertEqual(b''.join(fastq_reader.iter_stream(self.path, True)), RECORDS)
+            self.assertEqual(fastq_reader.get_block_index(self.path),
+                             [(0, offsets[1]), (offsets[1], os.path.getsize(self.path))])
+
+    def test_parallel_read_of_indexed_file(self):
+        self.write([gzip_member(RECORDS[i:i + 700]) for i in range(0, len(RECORDS), 700)])
+        # not known before a first read
+        self.assertEqual(fastq_reader.get_block_index(self.path), None)
+        self.assertEqual(self.read_lines(1, True), RECORDS.split(b'\n')[:-1])
+        self.assertTrue(len(fastq_reader.get_block_index(self.path)) > 2)
+        self.assertEqual(self.read_lines(2), RECORDS.split(b'\n')[:-1])
+
+    def test_bgzf_split_without_index(self):
+        blocks = [bgzf_block(RECORDS[i:i + 500]) for i in range(0, len(RECORDS), 500)]
+        blocks.append(bgzf_block(b''))
+        offsets = self.write(blocks)
+        chunks = fastq_reader.get_block_index(self.path)
+        self.assertEqual([start for start, end in chunks], offsets)
+        self.assertEqual(self.read_lines(3), RECORDS.split(b'\n')[:-1])
+
+    def test_changed_file_index_ignored(self):
+        self.write([gzip_member(RECORDS[:1000]), gzip_member(RECORDS[1000:])])
+        self.read_lines(1, True)
+        self.write([gzip_member(RECORDS)])
+        self.assertEqual(fastq_reader.get_block_index(self.path), None)
+        self.assertEqual(self.read_lines(2), RECORDS.split(b'\n')[:-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fastq_reader  # noqa: E402
+import fastq_sampler  # noqa: E402
+
+
+def get_record(i):
+    return b'@r%d\nACGTACGT\n+\nIIIIIIII' % i
+
+
+def gzip_member(records):
+    buf = io.BytesIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(b''.join(r + b'\n' for r in records))
+    f.close()
+    return buf.getvalue()
+
+
+class SamplerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.chunk_size = fastq_reader.CHUNK_SIZE
+
+    def tearDown(self):
+        fastq_reader.CHUNK_SIZE = self.chunk_size
+        shutil.rmtree(self.folder)
+
+    def write(self, name, records, per_member):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            for i in range(0, len(records), per_member):
+                f.write(gzip_member(records[i:i + per_member]))
+        return path
+
+    def read_output(self, path):
+        f = gzip.open(path, 'rb')
+        try:
+            lines = f.read().split(b'\n')[:-1]
+        finally:
+            f.close()
+        return [b'\n'.join(lines[i:i + 4]) for i in range(0, len(lines), 4)]
+
+    def test_budgets(self):
+        paths = []
+        for name, size in [('a', 300), ('b', 100), ('c', 0)]:
+            paths.append(os.path.join(self.folder, name))
+            with open(paths[-1], 'wb') as f:
+                f.write(b'x' * size)
+        self.assertEqual(fastq_sampler.get_budgets(paths, 10), [8, 2, 0])
+        self.assertEqual(sum(fastq_sampler.get_budgets(paths, 7)), 7)
+
+    def test_reservoir(self):
+        records = [get_record(i) for i in range(1000)]
+        lines = b'\n'.join(records).split(b'\n')
+        reservoir = fastq_sampler.Reservoir(50, random.Random(0))
+        for i in range(0, len(lines), 40):
+            reservoir.add(lines[i:i + 40])
+        self.assertEqual(reservoir.seen, 1000)
+        self.assertEqual(len(set(reservoir.records)), 50)
+        self.assertTrue(set(reservoir.records) <= set(records))
+        # not the first records only
+        self.assertTrue(max(records.index(r) for r in reservoir.records) > 500)
+
+    def test_records_of_a_chunk_cut_mid_record(self):
+        data = b'\n'.join(get_record(i) for i in range(3)) + b'\n'
+        self.assertEqual(fastq_sampler.get_records(data[5:], False),
+                         b'\n'.join(get_record(i) for i in (1, 2)).split(b'\n'))
+        self.assertEqual(len(fastq_sampler.get_records(data[:-3], True)), 8)
+
+    def test_small_file_read_whole(self):
+        records = [get_record(i) for i in range(20)]
+        output = os.path.join(self.folder, 'sampled.fastq.gz')
+        info = fastq_sampler.sample_files(
+            [self.write('L1_L001_R1_001.fastq.gz', records, 20)], 100, output)
+        self.assertEqual(info['sampled_reads'], 20)
+        self.assertEqual(info['total_reads'], 20)
+        self.assertEqual(info['files'][0]['method'], 'reservoir')
+        self.assertEqual(sorted(self.read_output(output)), sorted(records))
+
+    def test_split_file_sampled_by_chunks(self):
+        fastq_reader.CHUNK_SIZE = 1
+        records = [get_record(i) for i in range(2000)]
+        path = self.write('L1_L001_R1_001.fastq.gz', records, 50)
+        output = os.path.join(self.folder, 'sampled.fastq.gz')
+
+        # the first sample streams the file and saves its members
+        info = fastq_sampler.sample_files([path], 30, output)
+        self.assertEqual(info['files'][0]['method'], 'reservoir')
+        self.assertFalse(info['estimated'])
+
+        info = fastq_sampler.sample_files([path], 30, output)
+        self.assertEqual(info['files'][0]['method'], 'chunks')
+        self.assertTrue(info['estimated'])
+        self.assertEqual(info['total_reads'], 2000)
+        sampled = self.read_output(output)
+        self.assertEqual(len(set(sampled)), 30)
+        self.assertTrue(set(sampled) <= set(records))
+
+
+if __name__ == '__main__':
+    unittest.main()
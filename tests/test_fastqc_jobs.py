@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import qc_batches  # noqa: E402
+import RunFastQC  # noqa: E402
+
+
+class PlanQcBatchesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fastq_path = tempfile.mkdtemp()
+        self.finished = {}
+        self.get_arg_limit = qc_batches.get_arg_limit
+        self.fastqc_path = RunFastQC.FASTQC_PATH
+        RunFastQC.FASTQC_PATH = 'true'
+
+    def tearDown(self):
+        qc_batches.get_arg_limit = self.get_arg_limit
+        RunFastQC.FASTQC_PATH = self.fastqc_path
+        shutil.rmtree(self.fastq_path)
+
+    def get_job(self, name, count):
+        files = ['L1_L001_%s_%03d.fastq.gz' % (name, n) for n in range(count)]
+        return {
+            'name': name,
+            'cl': RunFastQC.get_fastqc_cl(1, files),
+            'cwd': self.fastq_path,
+            'cores': 1,
+            'memory': RunFastQC.FASTQC_THREAD_MEMORY,
+            'files': files,
+            'inputs': [os.path.join(self.fastq_path, f) for f in files],
+            'on_finish': lambda job, retCode: self.finished.__setitem__(job['name'], retCode)}
+
+    def test_group_too_long_for_exec_fails(self):
+        qc_batches.get_arg_limit = lambda: 1000
+        args = argparse.Namespace(qcEngine='fastqc', cores=4)
+        jobs = RunFastQC.plan_qc_batches(
+            args, self.fastq_path, [self.get_job('R1', 2), self.get_job('R2', 100)])
+
+        errors = [job for job in jobs if job.get('error')]
+        self.assertEqual([job['name'] for job in errors], ['R2'])
+        self.assertIn('L1_L001_R2_000.fastq.gz', errors[0]['error'])
+
+        failed = RunFastQC.run_jobs(jobs, 4, 1000, self.fastq_path)
+        self.assertEqual(failed, ['R2'])
+        self.assertEqual(self.finished, {'R1': 0, 'R2': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import qc_batches  # noqa: E402
+
+
+class PlanBatchesTest(unittest.TestCase):
+
+    def test_batches_balanced_by_bytes(self):
+        batches = qc_batches.plan_batches([9, 7, 5, 3], [100] * 4, 8, 50, 250)
+        self.assertEqual(batches, [([0, 3], 2), ([1, 2], 2)])
+
+    def test_batches_split_to_fit_arguments(self):
+        batches = qc_batches.plan_batches([4, 3, 2, 1], [100] * 4, 8, 50, 170)
+        self.assertEqual(sorted(i for indexes, threads in batches for i in indexes), [0, 1, 2, 3])
+        self.assertEqual(len(batches), 4)
+
+    def test_group_too_long_for_exec(self):
+        with self.assertRaises(qc_batches.ArgumentsTooLong) as raised:
+            qc_batches.plan_batches([4, 3, 2], [100, 300, 100], 8, 50, 250)
+        self.assertEqual(raised.exception.index, 1)
+        self.assertEqual(raised.exception.size, 350)
+        self.assertIn('350', str(raised.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import qc_cache  # noqa: E402
+
+
+class QcCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.folder, 'cache')
+        self.fastq = [self.write('L1_L001_R1_001.fastq.gz', 'a' * 100),
+                      self.write('L1_L002_R1_001.fastq.gz', 'b' * 100)]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, content):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def make_outputs(self, name, content='x' * 10):
+        src = tempfile.mkdtemp(dir=self.folder)
+        os.mkdir(os.path.join(src, '%s_fastqc' % name))
+        with open(os.path.join(src, '%s_fastqc' % name, 'fastqc_data.txt'), 'w') as f:
+            f.write(content)
+        with open(os.path.join(src, '%s_fastqc.html' % name), 'w') as f:
+            f.write(content)
+        return src
+
+    def test_key(self):
+        key = qc_cache.get_key('L1-R1', self.fastq, '0.11.5')
+        self.assertEqual(key, qc_cache.get_key('L1-R1', self.fastq[::-1], '0.11.5'))
+        self.assertNotEqual(key, qc_cache.get_key('L1-R1', self.fastq, '0.11.9'))
+        self.write('L1_L002_R1_001.fastq.gz', 'c' * 101)
+        self.assertNotEqual(key, qc_cache.get_key('L1-R1', self.fastq, '0.11.5'))
+
+    def test_store_and_lookup(self):
+        dest = tempfile.mkdtemp(dir=self.folder)
+        self.assertFalse(qc_cache.lookup(self.cache_dir, 'k1', dest))
+
+        self.assertTrue(qc_cache.store(self.cache_dir, 'k1', 'L1-R1', self.make_outputs('L1-R1'), 10 ** 6))
+        self.assertFalse(qc_cache.lookup(self.cache_dir, 'k2', dest))
+        self.assertTrue(qc_cache.lookup(self.cache_dir, 'k1', dest))
+        self.assertEqual(sorted(os.listdir(dest)), ['L1-R1_fastqc', 'L1-R1_fastqc.html'])
+        with open(os.path.join(dest, 'L1-R1_fastqc', 'fastqc_data.txt'), 'r') as f:
+            self.assertEqual(f.read(), 'x' * 10)
+
+    def test_nothing_to_store(self):
+        self.assertFalse(qc_cache.store(self.cache_dir, 'k1', 'L1-R1', self.folder, 10 ** 6))
+
+    def test_least_recently_used_evicted(self):
+        dest = tempfile.mkdtemp(dir=self.folder)
+        # each entry is 20 bytes, the cache holds two
+        qc_cache.store(self.cache_dir, 'k1', 'L1-R1', self.make_outputs('L1-R1'), 40)
+        qc_cache.store(self.cache_dir, 'k2', 'L1-R2', self.make_outputs('L1-R2'), 40)
+        self.assertTrue(qc_cache.lookup(self.cache_dir, 'k1', dest))
+        qc_cache.store(self.cache_dir, 'k3', 'L2-R1', self.make_outputs('L2-R1'), 40)
+
+        self.assertEqual(sorted(qc_cache.read_index(self.cache_dir)), ['k1', 'k3'])
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, 'k2')))
+        self.assertFalse(qc_cache.lookup(self.cache_dir, 'k2', dest))
+
+    def test_unreadable_index_is_a_miss(self):
+        qc_cache.store(self.cache_dir, 'k1', 'L1-R1', self.make_outputs('L1-R1'), 10 ** 6)
+        with open(os.path.join(self.cache_dir, qc_cache.INDEX_FILE), 'w') as f:
+            f.write('{')
+        self.assertFalse(qc_cache.lookup(self.cache_dir, 'k1', tempfile.mkdtemp(dir=self.folder)))
+
+
+if __name__ == '__main__':
+    unittest.main()
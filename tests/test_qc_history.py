@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import qc_history  # noqa: E402
+import RunFastQC  # noqa: E402
+
+
+def get_sample(sample_id, yields):
+    return {
+        'SampleId': sample_id, 'SampleName': sample_id, 'NumberReads': 10,
+        'Yield': sum(y for y, q30 in yields),
+        'ReadMetrics': [{'ReadNumber': n + 1, 'Yield': y, 'YieldQ30': q30, 'QualityScoreSum': 0}
+                        for n, (y, q30) in enumerate(yields)]}
+
+
+class LaneQ30Test(unittest.TestCase):
+
+    def setUp(self):
+        self.fastq_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.fastq_path, 'Stats'))
+        stats = {'ConversionResults': [
+            {'LaneNumber': 1, 'DemuxResults': [get_sample('S1', [(100, 90), (100, 50)])],
+             'Undetermined': get_sample('Undetermined', [(100, 10), (100, 50)])},
+            {'LaneNumber': 2, 'DemuxResults': [get_sample('S1', [(0, 0), (0, 0)])]}]}
+        with open(os.path.join(self.fastq_path, RunFastQC.BCL2FASTQ_STATS), 'w') as f:
+            json.dump(stats, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.fastq_path)
+
+    def test_q30_of_yields(self):
+        # lane 2 has no yield
+        self.assertEqual(RunFastQC.get_read_q30(self.fastq_path),
+                         {(1, 'R1'): 50.0, (1, 'R2'): 50.0})
+
+    def test_no_stats(self):
+        os.remove(os.path.join(self.fastq_path, RunFastQC.BCL2FASTQ_STATS))
+        self.assertEqual(RunFastQC.get_read_q30(self.fastq_path), {})
+
+    def test_lane_metrics_q30(self):
+        self.assertEqual(qc_history.get_lane_metrics({}, 50.0)['q30'], 50.0)
+        self.assertEqual(qc_history.get_lane_metrics({})['q30'], None)
+
+
+if __name__ == '__main__':
+    unittest.main()
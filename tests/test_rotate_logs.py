@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import RunFastQC  # noqa: E402
+
+
+class GzipLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'bcl2fastq.log')
+        with open(self.path, 'wb') as f:
+            f.write(b'line\n' * 10000)
+        os.utime(self.path, (1000000000, 1000000000))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_compressed_keeping_age(self):
+        RunFastQC.gzip_log(self.path, self.path + '.gz')
+        self.assertEqual(os.listdir(self.folder), ['bcl2fastq.log.gz'])
+        self.assertEqual(os.path.getmtime(self.path + '.gz'), 1000000000)
+        f = gzip.open(self.path + '.gz', 'rb')
+        try:
+            self.assertEqual(f.read(), b'line\n' * 10000)
+        finally:
+            f.close()
+
+    def test_threads_rotating_the_same_log(self):
+        errors = []
+
+        def rotate():
+            try:
+                RunFastQC.gzip_log(self.path, self.path + '.gz')
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=rotate) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(self.folder), ['bcl2fastq.log.gz'])
+        f = gzip.open(self.path + '.gz', 'rb')
+        try:
+            self.assertEqual(f.read(), b'line\n' * 10000)
+        finally:
+            f.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
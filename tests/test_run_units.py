@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import run_units  # noqa: E402
+
+
+class UnitGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.run_dir = tempfile.mkdtemp()
+        for lane in (1, 2):
+            self.write('L%d.bcl' % lane, 'bcl')
+
+    def tearDown(self):
+        shutil.rmtree(self.run_dir)
+
+    def path(self, name):
+        return os.path.join(self.run_dir, name)
+
+    def write(self, name, content):
+        with open(self.path(name), 'w') as f:
+            f.write(content)
+
+    def get_graph(self):
+        """bcl2fastq and FastQC of two lanes and the report of both."""
+        graph = run_units.UnitGraph(self.run_dir)
+        for lane in (1, 2):
+            graph.add(run_units.Unit(
+                'bcl2fastq:L%d' % lane,
+                inputs=lambda lane=lane: [self.path('L%d.bcl' % lane)],
+                outputs=lambda lane=lane: [self.path('L%d.fastq' % lane)]))
+            graph.add(run_units.Unit(
+                'fastqc:L%d-R1' % lane, ['bcl2fastq:L%d' % lane],
+                inputs=lambda lane=lane: [self.path('L%d.fastq' % lane)],
+                outputs=lambda lane=lane: [self.path('L%d.html' % lane)]))
+        graph.add(run_units.Unit(
+            'report', ['fastqc:L1-R1', 'fastqc:L2-R1'],
+            inputs=lambda: [self.path('L1.html'), self.path('L2.html')],
+            outputs=lambda: [self.path('report.pdf')]))
+        return graph
+
+    def run_all(self):
+        graph = self.get_graph()
+        for name in list(graph.plan()):
+            for output in graph.units[name].outputs():
+                self.write(os.path.basename(output), name)
+            graph.mark(name, True)
+
+    def test_all_run_first(self):
+        plan = self.get_graph().plan()
+        self.assertEqual(list(plan), [
+            'bcl2fastq:L1', 'fastqc:L1-R1', 'bcl2fastq:L2', 'fastqc:L2-R1', 'report'])
+        self.assertEqual(plan['fastqc:L1-R1'], 'depends on bcl2fastq:L1')
+
+    def test_up_to_date(self):
+        self.run_all()
+        self.assertEqual(list(self.get_graph().plan()), [])
+
+    def test_changed_input_dirties_one_lane(self):
+        self.run_all()
+        self.write('L2.bcl', 'changed bcl')
+        plan = self.get_graph().plan()
+        self.assertEqual(plan, {
+            'bcl2fastq:L2': 'inputs changed',
+            'fastqc:L2-R1': 'depends on bcl2fastq:L2',
+            'report': 'depends on fastqc:L2-R1'})
+
+    def test_failed_and_missing_outputs(self):
+        self.run_all()
+        graph = self.get_graph()
+        graph.mark('fastqc:L1-R1', False)
+        os.remove(self.path('report.pdf'))
+        plan = self.get_graph().plan()
+        self.assertEqual(list(plan.items()), [
+            ('fastqc:L1-R1', 'last run failed'), ('report', 'depends on fastqc:L1-R1')])
+
+        os.remove(self.path('L2.html'))
+        self.assertEqual(self.get_graph().plan()['fastqc:L2-R1'], 'outputs missing')
+
+    def test_existing_outputs_adopted(self):
+        for name in ('L1.fastq', 'L2.fastq'):
+            self.write(name, 'fastq')
+        self.assertEqual(list(self.get_graph().plan()), ['fastqc:L1-R1', 'fastqc:L2-R1', 'report'])
+
+    def test_unknown_dependency(self):
+        graph = run_units.UnitGraph(self.run_dir)
+        self.assertRaises(Exception, graph.add, run_units.Unit('report', ['fastqc:L1-R1']))
+
+
+if __name__ == '__main__':
+    unittest.main()
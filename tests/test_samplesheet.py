@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import samplesheet  # noqa: E402
+
+
+SHEET = '''[Header],,,,,,
+IEMFileVersion,4,,,,,
+Experiment Name,Run1,,,,,
+
+[Reads],,,,,,
+151,,,,,,
+151,,,,,,
+
+[Settings],,,,,,
+Adapter,CTGTCTCTTATACACATCT,,,,,
+
+[Data],,,,,,
+Lane,Sample_ID,Sample_Name,index,index2,Sample_Project,Description
+1,S1,Sample1,ACGT,TTTT,P1,
+1,S2,,CCCC,TTTT,P2,
+2,S1,Sample1,ACGT,TTTT,P1,"a, b"
+'''
+
+
+class SampleSheetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'SampleSheet.csv')
+        with open(self.path, 'w') as f:
+            f.write(SHEET)
+
+    def tearDown(self):
+        samplesheet.SHEETS.pop(self.path, None)
+        shutil.rmtree(self.folder)
+
+    def test_sections(self):
+        sheet = samplesheet.load(self.path)
+        self.assertEqual(sheet.header['Experiment Name'], 'Run1')
+        self.assertEqual(sheet.reads, [151, 151])
+        self.assertEqual(sheet.settings['Adapter'], 'CTGTCTCTTATACACATCT')
+        self.assertEqual(sheet.columns[:2], ('Lane', 'Sample_ID'))
+
+    def test_samples(self):
+        sheet = samplesheet.load(self.path)
+        self.assertEqual(len(sheet.rows), 3)
+        self.assertEqual([s.sample_id for s in sheet.get_lane(1)], ['S1', 'S2'])
+        self.assertEqual(sheet.get_sample('S1', 2)['Description'], 'a, b')
+        self.assertEqual(sheet.get_sample('S2').sample_name, 'S2')
+        self.assertEqual(sheet.get_sample('S3'), None)
+        self.assertEqual(sheet.get_project('S2'), 'P2')
+        self.assertEqual(sheet.get_project('S3'), 'default')
+        self.assertEqual(len(sheet.by_index[('ACGT', 'TTTT')]), 2)
+        self.assertEqual(list(sheet.by_project), ['P1', 'P2'])
+
+    def test_sheet_without_lanes(self):
+        with open(self.path, 'w') as f:
+            f.write('[Data]\nSample_ID,index\nS1,ACGT\n')
+        sheet = samplesheet.load(self.path)
+        self.assertEqual([s.sample_id for s in sheet.get_lane(3)], ['S1'])
+        self.assertEqual(sheet.get_sample('S1').get('Lane', None), None)
+
+    def test_load_parses_again_when_changed(self):
+        sheet = samplesheet.load(self.path)
+        self.assertTrue(samplesheet.load(self.path) is sheet)
+        with open(self.path, 'a') as f:
+            f.write('2,S3,,GGGG,TTTT,P3,\n')
+        self.assertEqual(len(samplesheet.load(self.path).rows), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
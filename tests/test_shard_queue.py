@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shard_queue  # noqa: E402
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.queue = shard_queue.WorkQueue(os.path.join(self.folder, 'queue'))
+        self.queue.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_claim_in_order(self):
+        for name in ('L1', 'L2'):
+            self.queue.put(name, {'cl': ['true']})
+        name, job = self.queue.claim('host:1')
+        self.assertEqual((name, job['worker']), ('L1', 'host:1'))
+        self.assertEqual(self.queue.claim('host:2')[0], 'L2')
+        self.assertEqual(self.queue.claim('host:3'), None)
+        self.assertEqual(self.queue.names(shard_queue.CLAIMED), ['L1', 'L2'])
+        self.assertFalse(self.queue.finished())
+
+        self.assertTrue(self.queue.finish('L1', job, True))
+        self.assertEqual(self.queue.names(shard_queue.DONE), ['L1'])
+        self.assertEqual(self.queue.get(shard_queue.DONE, 'L1')['worker'], 'host:1')
+
+    def test_two_workers_racing_for_one_shard(self):
+        for round in range(20):
+            self.queue.clear()
+            self.queue.put('L1', {'cl': ['true']})
+            start = threading.Event()
+            claims = []
+
+            def claim(worker):
+                start.wait()
+                claims.append(self.queue.claim(worker))
+
+            threads = [threading.Thread(target=claim, args=('host:%d' % i,)) for i in (1, 2)]
+            for thread in threads:
+                thread.start()
+            start.set()
+            for thread in threads:
+                thread.join()
+
+            winners = [c for c in claims if c is not None]
+            self.assertEqual(len(winners), 1)
+            self.assertEqual(self.queue.names(shard_queue.CLAIMED), ['L1'])
+            self.assertEqual(self.queue.names(shard_queue.PENDING), [])
+
+    def test_stalled_worker_loses_its_claim(self):
+        self.queue.put('L1', {'cl': ['true']})
+        name, stalled = self.queue.claim('host:1')
+        self.assertEqual(self.queue.requeue_stale(0), ['L1'])
+        name, job = self.queue.claim('host:2')
+
+        # the first worker comes back once the shard is running again
+        stalled['exit_code'] = 1
+        self.assertFalse(self.queue.finish('L1', stalled, False))
+        self.assertEqual(self.queue.names(shard_queue.FAILED), [])
+        self.assertEqual(self.queue.names(shard_queue.CLAIMED), ['L1'])
+
+        self.assertTrue(self.queue.finish('L1', job, True))
+        self.assertEqual(self.queue.names(shard_queue.DONE), ['L1'])
+        self.assertTrue(self.queue.finished())
+
+    def test_heartbeat_keeps_claim(self):
+        for name in ('L1', 'L2'):
+            self.queue.put(name, {'cl': ['true']})
+        self.queue.claim('host:1')
+        self.queue.claim('host:2')
+        old = time.time() - 100
+        for name, path in self.queue.claims():
+            os.utime(path, (old, old))
+
+        self.queue.heartbeat('L2', 'host:2')
+        self.assertEqual(self.queue.requeue_stale(50), ['L1'])
+        self.assertEqual(self.queue.names(shard_queue.PENDING), ['L1'])
+        self.assertEqual(self.queue.names(shard_queue.CLAIMED), ['L2'])
+
+    def test_abandon(self):
+        for name in ('L1', 'L2'):
+            self.queue.put(name, {'cl': ['true']})
+        self.queue.claim('host:1')
+        self.queue.claim('host:2')
+        self.queue.abandon('host:1', 'timed out')
+        self.assertEqual(self.queue.names(shard_queue.FAILED), ['L1'])
+        self.assertEqual(self.queue.get(shard_queue.FAILED, 'L1')['error'], 'timed out')
+        self.assertEqual(self.queue.names(shard_queue.CLAIMED), ['L2'])
+
+    def test_work(self):
+        self.queue.put('L1', {'cl': ['true']})
+        self.queue.put('L2', {'cl': ['false']})
+        self.assertEqual(shard_queue.work(self.queue.path), ['L2'])
+        self.assertEqual(self.queue.names(shard_queue.DONE), ['L1'])
+        self.assertEqual(self.queue.get(shard_queue.FAILED, 'L2')['exit_code'], 1)
+        self.assertTrue(self.queue.finished())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tex_table  # noqa: E402
+
+
+class TexTableTest(unittest.TestCase):
+
+    def test_escape(self):
+        self.assertEqual(tex_table.escape('A_1 & 50% #2 {x} $'),
+                         'A\\_1 \\& 50\\% \\#2 \\{x\\} \\$')
+        self.assertEqual(tex_table.escape('a\\b~c^d'),
+                         'a\\textbackslash{}b\\textasciitilde{}c\\textasciicircum{}d')
+
+    def test_two_lines(self):
+        self.assertEqual(tex_table.two_lines('Lane'), 'Lane')
+        self.assertEqual(tex_table.two_lines('% of the lane'),
+                         '\\begin{tabular}[c]{@{}l@{}}\\% of the\\\\ lane\\end{tabular}')
+
+    def test_rows(self):
+        table = tex_table.TexTableWriter(3)
+        self.assertEqual(table.columns(), '{|l|l|l|}')
+        table.title('Data')
+        table.field('Date', '1/1/2016')
+        table.line('151')
+        table.row(['S_1', 'ACGT', ''])
+        table.row(['\\textbf{x}', 'y', 'z'], escaped=True)
+        self.assertEqual(table.getvalue(), (
+            '\\multicolumn{3}{|c|}{Data} \\\\ \\hline\n'
+            'Date & \\multicolumn{2}{l|}{1/1/2016} \\\\ \\hline\n'
+            '\\multicolumn{3}{|l|}{151} \\\\ \\hline\n'
+            'S\\_1 & ACGT &  \\\\ \\hline\n'
+            '\\textbf{x} & y & z \\\\ \\hline\n'))
+
+    def test_chunks_written_to_out(self):
+        out = io.StringIO()
+        table = tex_table.TexTableWriter(1, out, chunk_size=2)
+        for i in range(5):
+            table.row([u'%d' % i])
+            # a chunk is only written once full
+            self.assertEqual(out.getvalue().count(u'\n'), (i + 1) // 2 * 2)
+        table.flush()
+        self.assertEqual(out.getvalue(), u''.join(u'%d \\\\ \\hline\n' % i for i in range(5)))
+        self.assertEqual(table.getvalue(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
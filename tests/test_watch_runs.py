@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import watch_runs  # noqa: E402
+
+
+class FakeInotify(object):
+    """Watches that never raise an event, as on NFS for the writes of other hosts."""
+
+    def __init__(self):
+        self.paths = {}
+
+    def add_watch(self, path, mask):
+        self.paths[len(self.paths) + 1] = path
+
+
+class RescanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.runs_dir = tempfile.mkdtemp()
+        self.watcher = watch_runs.RunWatcher(self.runs_dir)
+        self.inotify = FakeInotify()
+        self.inotify.add_watch(self.runs_dir, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.runs_dir)
+
+    def make_run(self, name, complete):
+        run_dir = os.path.join(self.runs_dir, name)
+        os.mkdir(run_dir)
+        if(complete):
+            open(os.path.join(run_dir, 'RTAComplete.txt'), 'w').close()
+        return run_dir
+
+    def test_runs_found_without_events(self):
+        running = self.make_run('160101_NB501279_0001_AH0000001BGXX', False)
+        self.watcher.rescan(self.inotify)
+        self.assertEqual(sorted(self.inotify.paths.values()), [self.runs_dir, running])
+
+        finished = self.make_run('160102_M01234_0002_000000000-A1B2C', True)
+        open(os.path.join(running, 'CopyComplete.txt'), 'w').close()
+        self.watcher.rescan(self.inotify)
+        self.assertEqual(sorted(self.watcher.queue.get()[0] for _ in range(2)),
+                         [running, finished])
+        # not watched twice, the finished run is not watched
+        self.assertEqual(len(self.inotify.paths), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
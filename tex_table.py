@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+# Writer of the rows of the LaTeX tables of the report.
+#
+# Rows are escaped cell by cell in a single pass and written in chunks of
+# LT_CHUNK_SIZE rows to the output (a file or the internal buffer), so the
+# time to render a table grows linearly with its number of rows. The chunk
+# size is the same as the \LTchunksize set in FastQC_report.tex, the number
+# of rows longtable typesets at a time.
+
+import re
+
+
+LT_CHUNK_SIZE = 100
+
+SPECIAL = re.compile('([\\\\&%$#_{}~^])')
+REPLACEMENTS = {
+    '\\': '\\textbackslash{}',
+    '~': '\\textasciitilde{}',
+    '^': '\\textasciicircum{}'}
+
+
+def escape(value):
+    """Escape the LaTeX special characters of a cell."""
+    return SPECIAL.sub(lambda m: REPLACEMENTS.get(m.group(1), '\\' + m.group(1)), value)
+
+
+def two_lines(value):
+    """Header cell broken in two lines at its last space, escaped."""
+    parts = value.rsplit(' ', 1)
+    if(len(parts) == 1):
+        return escape(value)
+    return '\\begin{tabular}[c]{@{}l@{}}%s\\\\ %s\\end{tabular}' % (
+        escape(parts[0]), escape(parts[1]))
+
+
+class TexTableWriter(object):
+    """Rows of a table with ncolumns columns, written to out or kept in memory."""
+
+    def __init__(self, ncolumns, out=None, chunk_size=LT_CHUNK_SIZE):
+        self.ncolumns = ncolumns
+        self.out = out
+        self.chunk_size = chunk_size
+        self.parts = []
+        self.chunk = []
+
+    def columns(self):
+        """Column spec of the table, as {|l|l|l|}."""
+        return '{%s|}' % ('|l' * self.ncolumns)
+
+    def write(self, line):
+        self.chunk.append(line)
+        if(len(self.chunk) >= self.chunk_size):
+            self.flush()
+
+    def flush(self):
+        if(not self.chunk):
+            return
+        text = ''.join(self.chunk)
+        self.chunk = []
+        if(self.out is None):
+            self.parts.append(text)
+        else:
+            self.out.write(text)
+
+    def title(self, text):
+        """A row with the text centered over all the columns."""
+        self.write('\\multicolumn{%s}{|c|}{%s} \\\\ \\hline\n' % (self.ncolumns, escape(text)))
+
+    def line(self, text):
+        """A row with the text over all the columns."""
+        self.write('\\multicolumn{%s}{|l|}{%s} \\\\ \\hline\n' % (self.ncolumns, escape(text)))
+
+    def field(self, name, value):
+        """A row with the name in the first column and the value over the others."""
+        self.write('%s & \\multicolumn{%s}{l|}{%s} \\\\ \\hline\n' % (
+            escape(name), self.ncolumns - 1, escape(value)))
+
+    def row(self, cells, escaped=False):
+        """A row with a cell per column."""
+        if(not escaped):
+            cells = [escape(cell) for cell in cells]
+        self.write('%s \\\\ \\hline\n' % ' & '.join(cells))
+
+    def getvalue(self):
+        """The rows written so far, when there is no out."""
+        self.flush()
+        return ''.join(self.parts)
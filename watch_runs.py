@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Watches the folder where the sequencers write their runs and starts
+# RunFastQC as soon as a run is finished, instead of polling from cron.
+#
+# Linux inotify tells when a run folder is created and when the sequencer
+# writes RTAComplete.txt or CopyComplete.txt in it. The sequencer (MiSeq or
+# NextSeq) comes from the instrument in RunInfo.xml or from the name of the
+# run folder (YYMMDD_<instrument>_<run>_<flowcell>). Finished runs go to a
+# queue and are processed one at a time by RunFastQC.main. Runs that already
+# have a run_units.json were taken by the pipeline before and are left alone.
+#
+# inotify only sees the changes made through the kernel of this host: on a
+# network filesystem (NFS, CIFS) the folders and files written by the
+# sequencer or by another host raise no event. The folder is therefore
+# scanned again every POLL_INTERVAL seconds while inotify is used, which
+# finds those runs with at most that delay, and only the runs written on
+# this host are taken at once.
+#
+# Execution:
+#   python watch_runs.py --runsDir /data/runs
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import re
+import select
+import struct
+import threading
+import time
+import traceback
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import RunFastQC
+import run_units
+
+
+COMPLETE_FILES = ['RTAComplete.txt', 'CopyComplete.txt']
+RUNINFO = 'RunInfo.xml'
+# instrument id prefixes of each sequencer
+INSTRUMENTS = [('NB', 'nextseq'), ('NS', 'nextseq'), ('VH', 'nextseq'), ('M', 'miseq')]
+# seconds between two scans, with or without inotify
+POLL_INTERVAL = 60
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+# events watched in the run folders
+RUN_MASK = IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """Minimal inotify binding over ctypes."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if(self.fd < 0):
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self.paths = {}
+
+    def add_watch(self, path, mask):
+        name = path if isinstance(path, bytes) else path.encode('utf-8')
+        wd = self.libc.inotify_add_watch(self.fd, name, mask)
+        if(wd < 0):
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed', path)
+        self.paths[wd] = path
+        return wd
+
+    def read_events(self, timeout=None):
+        """Yield (folder, name, mask) of the events available in timeout seconds."""
+        try:
+            ready = select.select([self.fd], [], [], timeout)[0]
+        except select.error as e:
+            if(e.args[0] == errno.EINTR):
+                return
+            raise
+        if(not ready):
+            return
+
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while(offset + EVENT_HEADER.size <= len(data)):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            if(not isinstance(name, str)):
+                name = name.decode('utf-8', 'replace')
+            offset += length
+
+            if(mask & IN_IGNORED):
+                self.paths.pop(wd, None)
+                continue
+            if(wd in self.paths):
+                yield self.paths[wd], name, mask
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_sequencer(run_dir):
+    """Return 'miseq' or 'nextseq' for a run folder, None if unknown."""
+    instrument = None
+    runinfo = os.path.join(run_dir, RUNINFO)
+    if(os.path.exists(runinfo)):
+        match = re.search(
+            '<Instrument>\\s*([^<\\s]+)\\s*</Instrument>', open(runinfo, 'r').read())
+        if(match):
+            instrument = match.group(1)
+
+    if(not instrument):
+        parts = os.path.basename(run_dir.rstrip('/')).split('_')
+        if(len(parts) >= 4 and re.match('\\d{6}\\Z', parts[0])):
+            instrument = parts[1]
+
+    if(instrument):
+        for prefix, sequencer in INSTRUMENTS:
+            if(instrument.upper().startswith(prefix)):
+                return sequencer
+
+    return None
+
+
+def is_complete(run_dir):
+    return any(os.path.exists(os.path.join(run_dir, f)) for f in COMPLETE_FILES)
+
+
+def is_processed(run_dir):
+    return os.path.exists(os.path.join(run_dir, run_units.UNITS_FILE))
+
+
+class RunWatcher(object):
+
+    def __init__(self, runs_dir):
+        self.runs_dir = os.path.abspath(runs_dir)
+        self.queue = queue.Queue()
+        self.queued = set()
+
+    def enqueue(self, run_dir):
+        if(run_dir in self.queued or is_processed(run_dir)):
+            return
+        sequencer = get_sequencer(run_dir)
+        if(not sequencer):
+            print('%s: unknown sequencer, skipped' % run_dir)
+            return
+        print('%s: finished %s run queued' % (run_dir, sequencer))
+        self.queued.add(run_dir)
+        self.queue.put((run_dir, sequencer))
+
+    def check(self, run_dir):
+        if(os.path.isdir(run_dir) and is_complete(run_dir)):
+            self.enqueue(run_dir)
+
+    def scan(self):
+        runs = []
+        for f in sorted(os.listdir(self.runs_dir)):
+            run_dir = os.path.join(self.runs_dir, f)
+            if(os.path.isdir(run_dir) and not f.startswith('.')):
+                runs.append(run_dir)
+                self.check(run_dir)
+        return runs
+
+    def process(self):
+        while(True):
+            run_dir, sequencer = self.queue.get()
+            try:
+                RunFastQC.main([
+                    '--runPath', run_dir + '/',
+                    '--sequencerName', sequencer])
+            except Exception:
+                print('%s: execution failed' % run_dir)
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    def rescan(self, inotify):
+        """Scan the folder and watch the unfinished runs not watched yet."""
+        watched = set(inotify.paths.values())
+        for run_dir in self.scan():
+            if(run_dir not in watched and run_dir not in self.queued and
+               not is_processed(run_dir)):
+                inotify.add_watch(run_dir, RUN_MASK)
+
+    def watch(self):
+        inotify = Inotify()
+        inotify.add_watch(self.runs_dir, IN_CREATE | IN_MOVED_TO)
+        self.rescan(inotify)
+        next_scan = time.time() + POLL_INTERVAL
+
+        while(True):
+            for folder, name, event in inotify.read_events(max(0, next_scan - time.time())):
+                path = os.path.join(folder, name)
+                if(folder == self.runs_dir):
+                    if(event & IN_ISDIR):
+                        inotify.add_watch(path, RUN_MASK)
+                        # the marker may have been written before the watch
+                        self.check(path)
+                elif(name in COMPLETE_FILES):
+                    self.check(folder)
+
+            # the runs written by other hosts on a network filesystem
+            if(time.time() >= next_scan):
+                self.rescan(inotify)
+                next_scan = time.time() + POLL_INTERVAL
+
+    def poll(self):
+        while(True):
+            self.scan()
+            time.sleep(POLL_INTERVAL)
+
+    def run(self, use_inotify=True):
+        worker = threading.Thread(target=self.process)
+        worker.daemon = True
+        worker.start()
+
+        if(use_inotify):
+            try:
+                self.watch()
+            except (OSError, AttributeError) as e:
+                print('inotify is not available (%s), scanning every %d seconds' % (
+                    e, POLL_INTERVAL))
+        self.poll()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Start RunFastQC for every run the sequencers finish')
+
+    parser.add_argument(
+        '--runsDir', '-d', required=True,
+        help='Folder where the sequencers write their runs')
+    parser.add_argument(
+        '--poll', action='store_true',
+        help='Only scan the folder every %d seconds, without inotify' % POLL_INTERVAL)
+
+    args = parser.parse_args()
+
+    RunWatcher(args.runsDir).run(not args.poll)
+
+
+if __name__ == '__main__':
+    main()